@@ -0,0 +1,116 @@
+"""
+Бенчмарк постоянного кэша ответов API (таблица api_cache): рост таблицы на долго работающем боте.
+
+Каждый раунд записывает --keys новых ключей (как разные запросы городов и id отелей) со временем жизни --ttl сек,
+затем ждет, пока записи устареют. Режим "no-purge" воспроизводит бот без очистки, режим "purge" - бот,
+у которого фоновый поток вызывает purge_caches() после каждого раунда. Печатает количество строк api_cache
+и задержку чтения (p50/p99) после всех раундов.
+
+В конце проверяет очистку: устаревшие записи удаляются, свежие остаются, запись, поднятая из api_cache в память,
+устаревает вместе с записью в БД, а поток start_cache_purger
+чистит таблицу сам, без потока сохранения диалогов (при ошибке - ненулевой код выхода).
+
+Запуск из корня проекта:
+    python benchmarks/bench_api_cache.py --rounds 20 --keys 2000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('telegram_bot_token', '123456:bench-token')
+os.environ.setdefault('x-rapidapi-key', 'bench-key')
+
+import settings  # noqa: E402
+
+settings.db_name = os.path.join(tempfile.mkdtemp(), 'bench_users.db')
+
+from body.botrequests import cache, connection, migrations  # noqa: E402
+
+
+def rows() -> int:
+    return connection.get_connection().execute("SELECT COUNT(*) FROM api_cache;").fetchone()[0]
+
+
+def run(mode: str, rounds: int, keys: int, ttl: float) -> None:
+    """ Прогоняет раунды записи и печатает размер таблицы и задержки чтения. """
+
+    connection.get_connection().execute("DELETE FROM api_cache;")
+    locations = cache.SqliteCache('bench_locations', ttl)
+    for i_round in range(rounds):
+        for i_key in range(keys):
+            locations.set('{round}:{key}'.format(round=i_round, key=i_key), {'1506246': 'Нью-Йорк, США'})
+        time.sleep(ttl)
+        if mode == 'purge':
+            cache.purge_caches()
+
+    latencies: List[float] = list()
+    for i_key in range(keys):
+        started = time.perf_counter()
+        locations.get('{round}:{key}'.format(round=rounds, key=i_key))
+        latencies.append((time.perf_counter() - started) * 1000)
+    quantiles = statistics.quantiles(latencies, n=100)
+    print('{mode:>8}: строк в api_cache: {rows}, чтение p50: {p50:.3f} мс, p99: {p99:.3f} мс'.format(
+        mode=mode, rows=rows(), p50=quantiles[49], p99=quantiles[98]))
+
+
+def check(ttl: float) -> None:
+    """ Проверяет, что purge_caches() удаляет устаревшие записи всех кэшей и оставляет свежие. """
+
+    connection.get_connection().execute("DELETE FROM api_cache;")
+    photos = cache.SqliteCache('bench_photos', ttl)
+    locations = cache.SqliteCache('bench_locations', ttl)
+    photos.set('1', {'urls': []})
+    locations.set('нью-йорк|ru_RU', {'1506246': 'Нью-Йорк, США'})
+    time.sleep(ttl)
+    photos.set('2', {'urls': []})
+
+    removed: int = cache.purge_caches()
+    left: List[tuple] = connection.get_connection().execute(
+        "SELECT namespace, key FROM api_cache WHERE namespace LIKE 'bench_%';").fetchall()
+    if removed != 2 or left != [('bench_photos', '2')]:
+        raise SystemExit('purge_caches: удалено {removed}, осталось {left}'.format(removed=removed, left=left))
+    print('проверка очистки: удалено устаревших записей {removed}, свежая запись осталась'.format(removed=removed))
+
+    tiered = cache.TieredCache(cache.TTLCache(16, 60), photos)
+    photos.set('5', {'urls': []}, ttl=ttl)
+    tiered.get('5')
+    time.sleep(ttl)
+    if tiered.memory.get('5') is not None:
+        raise SystemExit('TieredCache: запись из api_cache живет в памяти дольше, чем в БД')
+    print('проверка подъема в память: запись устаревает вместе с записью api_cache')
+
+    photos.set('3', {'urls': []}, ttl=0)
+    photos.set('4', {'urls': []}, ttl=60)
+    stop = threading.Event()
+    purger: threading.Thread = cache.start_cache_purger(ttl, stop)
+    time.sleep(ttl * 3)
+    stop.set()
+    purger.join()
+    left = connection.get_connection().execute(
+        "SELECT namespace, key FROM api_cache WHERE namespace LIKE 'bench_%';").fetchall()
+    if ('bench_photos', '3') in left or ('bench_photos', '4') not in left:
+        raise SystemExit('start_cache_purger: осталось {left}'.format(left=left))
+    print('проверка потока очистки: устаревшая запись удалена')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--keys', type=int, default=2000, help='новых ключей за раунд')
+    parser.add_argument('--ttl', type=float, default=0.2, help='время жизни записи (сек)')
+    args = parser.parse_args()
+
+    migrations.migrate()
+
+    run('no-purge', args.rounds, args.keys, args.ttl)
+    run('purge', args.rounds, args.keys, args.ttl)
+    check(args.ttl)
+    connection.close_connections()
@@ -0,0 +1,180 @@
+"""
+Бенчмарк постраничного поиска /bestdeal на записанных ответах /properties/list (benchmarks/fixtures).
+
+Сравнивает прежний порядок (страницы 1-3 одна за другой), адаптивный (предварительный запрос следующей
+страницы, остановка после num_hotels подходящих отелей, ограничение bestdeal_max_pages) и сортировку API
+по расстоянию до центра (bestdeal_mode = 'distance': остановка за max_distance, оценка цены и расстояния)
+для плотного и редкого диапазонов расстояний: запросов к API, время поиска на один /bestdeal
+и средние цена и расстояние найденных отелей.
+Ответ API задерживается на --latency секунд, обработка каждой партии отелей (фотографии и отправка)
+имитируется задержкой --consume секунд.
+
+В конце проверяет стратегию /bestdeal по умолчанию (settings.bestdeal_mode): в каждом диапазоне, в том числе
+в далеком редком, она находит не меньше отелей, чем прежний порядок (при ошибке - ненулевой код выхода).
+
+Запуск из корня проекта:
+    python benchmarks/bench_bestdeal_paging.py --searches 20 --latency 0.3 --consume 0.2
+Запись новых ответов (с локальной заглушки RapidAPI или с --api-url):
+    python benchmarks/bench_bestdeal_paging.py --record
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple, Union
+
+import requests
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('telegram_bot_token', '123456:bench-token')
+os.environ.setdefault('x-rapidapi-key', 'bench-key')
+
+from body.botrequests import properties, search  # noqa: E402
+from settings import bestdeal_max_pages, bestdeal_page_size, headers_request  # noqa: E402
+
+FIXTURE = os.path.join(ROOT, 'fixtures', 'properties_list_bestdeal.json')
+RECORD_PAGES = 8
+SORT_ORDERS: Tuple[str, ...] = ('PRICE', 'DISTANCE_FROM_LANDMARK')
+SCENARIOS: List[Tuple[str, float, float]] = [('плотный 0-12 км', 0, 12), ('редкий 1-2 км', 1, 2),
+                                             ('очень редкий 11,5-12 км', 11.5, 12)]
+
+
+def record(api_url: str) -> None:
+    """ Записывает страницы /properties/list для каждой сортировки в fixtures. """
+
+    sort_orders: Dict[str, Dict[str, dict]] = dict()
+    for sort_order in SORT_ORDERS:
+        pages: Dict[str, dict] = dict()
+        for page in range(1, RECORD_PAGES + 1):
+            querystring = {"destinationId": "1506246", "checkIn": "2026-11-01", "checkOut": "2026-11-05",
+                           "pageSize": bestdeal_page_size, "pageNumber": page, "adults1": "1",
+                           "sortOrder": sort_order, "priceMin": 1000, "priceMax": 100000, "locale": "ru_RU",
+                           "currency": "RUB"}
+            pages[str(page)] = requests.get(api_url + '/properties/list', params=querystring,
+                                            headers=headers_request, timeout=15).json()
+        sort_orders[sort_order] = pages
+
+    os.makedirs(os.path.dirname(FIXTURE), exist_ok=True)
+    with open(FIXTURE, 'w', encoding='utf-8') as file:
+        json.dump({'page_size': bestdeal_page_size, 'sort_orders': sort_orders}, file, ensure_ascii=False)
+    print('Записано страниц: {num} -> {path}'.format(num=len(SORT_ORDERS) * RECORD_PAGES, path=FIXTURE))
+
+
+def replay(sort_orders: Dict[str, Dict[str, dict]], latency: float, calls: List[int], lock: threading.Lock):
+    """ Возвращает замену api_client.get_json, которая отдает записанные страницы нужной сортировки с задержкой. """
+
+    def get_json(path: str, params: Dict[str, Union[str, int, float]]) -> dict:
+        time.sleep(latency)
+        with lock:
+            calls.append(int(params['pageNumber']))
+
+        empty: dict = {'result': 'OK', 'data': {'body': {'searchResults': {'results': []}}}}
+        return sort_orders[str(params['sortOrder'])].get(str(params['pageNumber']), empty)
+
+    return get_json
+
+
+def found_hotels(strategy: search.SearchStrategy, sort_orders: Dict[str, Dict[str, dict]], min_dist: float,
+                 max_dist: float, num_hotels: int, prefetch: bool = False) -> int:
+    """ Выполняет один поиск без задержек и возвращает количество найденных отелей. """
+
+    properties.get_json = replay(sort_orders, 0, list(), threading.Lock())
+    properties.search_cache.clear()
+    request = search.SearchRequest(user_id=1, request_id=1, command='bestdeal', id_city='1506246',
+                                   check_in='2026-11-01', check_out='2026-11-05', num_hotels=num_hotels,
+                                   photos=None, min_price=1000, max_price=100000, min_distance=min_dist,
+                                   max_distance=max_dist, request=None)
+
+    return sum(len(batch) for batch in search._pages(strategy, request, prefetch=prefetch))
+
+
+def check(sort_orders: Dict[str, Dict[str, dict]], num_hotels: int) -> None:
+    """ Проверяет, что стратегия /bestdeal по умолчанию находит не меньше отелей, чем прежний порядок. """
+
+    for name, min_dist, max_dist in SCENARIOS:
+        legacy: int = found_hotels(search.BestDealStrategy(max_pages=3), sort_orders, min_dist, max_dist, num_hotels)
+        default: int = found_hotels(search.strategies['bestdeal'], sort_orders, min_dist, max_dist, num_hotels)
+        if default < legacy:
+            raise SystemExit('{strategy} | {name}: найдено {default} отелей, прежний порядок - {legacy}'.format(
+                strategy=type(search.strategies['bestdeal']).__name__, name=name, default=default, legacy=legacy))
+    print('проверка стратегии по умолчанию ({strategy}): не меньше отелей, чем прежний порядок, '
+          'во всех диапазонах'.format(strategy=type(search.strategies['bestdeal']).__name__))
+
+
+def run(mode: str, sort_orders: Dict[str, Dict[str, dict]], searches: int, latency: float, consume: float,
+        num_hotels: int) -> None:
+    """ Выполняет поиски для всех диапазонов и печатает статистику. """
+
+    if mode == 'прежний':
+        strategy, prefetch = search.BestDealStrategy(max_pages=3), False
+    elif mode == 'адаптивный':
+        strategy, prefetch = search.BestDealStrategy(max_pages=bestdeal_max_pages), True
+    else:
+        strategy, prefetch = search.BestDealDistanceStrategy(max_pages=bestdeal_max_pages), True
+
+    for name, min_dist, max_dist in SCENARIOS:
+        calls: List[int] = list()
+        lock = threading.Lock()
+        properties.get_json = replay(sort_orders, latency, calls, lock)
+        request = search.SearchRequest(user_id=1, request_id=1, command='bestdeal', id_city='1506246',
+                                       check_in='2026-11-01', check_out='2026-11-05', num_hotels=num_hotels,
+                                       photos=None, min_price=1000, max_price=100000, min_distance=min_dist,
+                                       max_distance=max_dist, request=None)
+
+        durations: List[float] = list()
+        hotels: List[properties.Hotel] = list()
+        recorded: Dict[int, properties.Hotel] = {
+            hotel.id: hotel for pages in sort_orders.values() for i_page in pages.values()
+            for hotel in map(properties.Hotel.from_api, i_page['data']['body']['searchResults']['results'])}
+        for _ in range(searches):
+            properties.search_cache.clear()
+            started = time.perf_counter()
+            for batch in search._pages(strategy, request, prefetch=prefetch):
+                hotels.extend(recorded[hotel_id] for hotel_id in batch)
+                if batch:
+                    time.sleep(consume)
+            durations.append(time.perf_counter() - started)
+        time.sleep(latency)
+
+        print('{mode:>13} | {name:<24} | запросов к API: {calls:.1f} | отелей: {found:.1f} из {num} | '
+              'время: {mean:.2f} с (max {max:.2f} с) | цена: {price:.0f} | расстояние: {dist:.1f} км'.format(
+                  mode=mode, name=name, calls=len(calls) / searches, found=len(hotels) / searches, num=num_hotels,
+                  mean=statistics.mean(durations), max=max(durations),
+                  price=statistics.mean(hotel.price_value for hotel in hotels) if hotels else 0,
+                  dist=statistics.mean(hotel.distance_km for hotel in hotels) if hotels else 0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--searches', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.3, help='задержка ответа API (сек)')
+    parser.add_argument('--consume', type=float, default=0.2, help='обработка одной партии отелей (сек)')
+    parser.add_argument('--num-hotels', type=int, default=5)
+    parser.add_argument('--record', action='store_true', help='записать ответы заново')
+    parser.add_argument('--api-url', help='адрес API для записи (по умолчанию - локальная заглушка)')
+    args = parser.parse_args()
+
+    if args.record:
+        if args.api_url:
+            record(args.api_url)
+        else:
+            from rapidapi_stub import RapidApiStub
+
+            stub = RapidApiStub().start()
+            try:
+                record(stub.url)
+            finally:
+                stub.stop()
+        sys.exit()
+
+    with open(FIXTURE, encoding='utf-8') as fixture_file:
+        recorded: Dict[str, Dict[str, dict]] = json.load(fixture_file)['sort_orders']
+    for i_mode in ('прежний', 'адаптивный', 'по расстоянию'):
+        run(i_mode, recorded, args.searches, args.latency, args.consume, args.num_hotels)
+    check(recorded, args.num_hotels)
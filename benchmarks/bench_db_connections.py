@@ -0,0 +1,143 @@
+"""
+Бенчмарк слоя БД: количество соединений и задержки (p50/p99) на один диалог /bestdeal.
+
+Режим "legacy" воспроизводит исходное поведение: новое соединение sqlite3 на каждый вызов db_functions
+и каждое значение диалога сразу в БД - состояния диалогов в памяти (DialogStore), а с ними и id активного запроса,
+отключены, поэтому результат не зависит от последующих оптимизаций db_functions.
+Режим "pooled" - текущий код: долгоживущие соединения из body.botrequests.connection и диалог в памяти.
+
+Запуск из корня проекта:
+    python benchmarks/bench_db_connections.py --dialogs 200
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('telegram_bot_token', '123456:bench-token')
+os.environ.setdefault('x-rapidapi-key', 'bench-key')
+
+import settings  # noqa: E402
+
+settings.db_name = os.path.join(tempfile.mkdtemp(), 'bench_users.db')
+
+from body.botrequests import connection, db_functions, migrations  # noqa: E402
+
+CITIES = {'1506246': 'Нью-Йорк, США', '1633379': 'Нью-Йорк-Миллс, США'}
+RESULT = {1: {'Название отеля': 'Hotel', 'Адрес': 'Street 1', 'Расстояние до центра': '1,2 км',
+              'Цена за ночь': '1 500 RUB', 'url': 'https://hotels.com/ho1'}}
+
+
+def bestdeal_dialog(user_id: int) -> List[Callable[[], object]]:
+    """ Последовательность вызовов db_functions, которую делает один диалог /bestdeal. """
+
+    def request_id() -> int:
+        return db_functions.get_last_request_id(user_id)
+
+    return [
+        lambda: db_functions.create_user(user_id, 'first', 'last', 'user'),
+        lambda: db_functions.set_command(user_id, 'bestdeal'),
+        lambda: db_functions.set_min_price(1000, user_id),
+        lambda: db_functions.set_max_price(5000, user_id),
+        lambda: db_functions.set_min_distance(0.5, user_id),
+        lambda: db_functions.set_max_distance(5.0, user_id),
+        lambda: db_functions.set_city(str(CITIES)[1:-1], user_id),
+        lambda: db_functions.get_city(user_id),
+        lambda: db_functions.set_id_city('1506246', user_id),
+        lambda: db_functions.set_city('Нью-Йорк, США', user_id),
+        lambda: db_functions.get_last_request(user_id),
+        lambda: db_functions.set_check_in('2026-11-01', request_id()),
+        lambda: db_functions.get_last_request(user_id),
+        lambda: db_functions.set_check_out('2026-11-05', request_id()),
+        lambda: db_functions.set_num_hotels(user_id, '3'),
+        lambda: db_functions.set_num_photos('2', request_id()),
+        lambda: db_functions.get_command(request_id()),
+        lambda: db_functions.get_search_request(user_id, request_id()),
+        lambda: db_functions.set_request(user_id, request_id(), RESULT),
+    ]
+
+
+class NoDialogs:
+    """ Хранилище диалогов, которое ничего не хранит: все значения пишутся и читаются из БД, как до DialogStore. """
+
+    def start(self, user_id: int, request_id: int, command: str) -> None:
+        return None
+
+    def get(self, user_id: int) -> None:
+        return None
+
+    def get_by_request(self, request_id: int) -> None:
+        return None
+
+    def update(self, state: Optional[object], **values: object) -> bool:
+        return False
+
+    def pop(self, request_id: int) -> None:
+        return None
+
+    def dirty_states(self) -> list:
+        return list()
+
+    def mark_dirty(self, states: list) -> None:
+        pass
+
+    def evict_expired(self) -> None:
+        pass
+
+
+def run(mode: str, dialogs: int) -> None:
+    """ Прогоняет заданное количество диалогов и печатает статистику. """
+
+    opened: List[sqlite3.Connection] = list()
+    legacy_stats = {'opened': 0}
+    original = db_functions.get_connection
+    original_dialogs = db_functions._dialogs
+
+    if mode == 'legacy':
+        def legacy_connection() -> sqlite3.Connection:
+            conn = sqlite3.connect(settings.db_name)
+            opened.append(conn)
+            legacy_stats['opened'] += 1
+            return conn
+
+        db_functions.get_connection = legacy_connection
+        db_functions._dialogs = NoDialogs()
+
+    start_opened = connection.connections_opened()
+    latencies: List[float] = list()
+    try:
+        for i_dialog in range(dialogs):
+            for step in bestdeal_dialog(100000 + i_dialog):
+                started = time.perf_counter()
+                step()
+                while opened:
+                    opened.pop().close()
+                latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        db_functions.get_connection = original
+        db_functions._dialogs = original_dialogs
+
+    total_opened = legacy_stats['opened'] + connection.connections_opened() - start_opened
+    per_dialog = total_opened / dialogs
+    quantiles = statistics.quantiles(latencies, n=100)
+    print('{mode:>7}: соединений на диалог: {conn:.2f}, p50: {p50:.3f} мс, p99: {p99:.3f} мс'.format(
+        mode=mode, conn=per_dialog, p50=quantiles[49], p99=quantiles[98]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dialogs', type=int, default=200)
+    args = parser.parse_args()
+
+    migrations.migrate()
+
+    run('legacy', args.dialogs)
+    run('pooled', args.dialogs)
+    connection.close_connections()
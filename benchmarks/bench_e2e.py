@@ -0,0 +1,327 @@
+"""
+Сквозной бенчмарк бота: body/main.py (или body/async_main.py с --runtime async) в режиме polling
+работает с заглушками RapidAPI (rapidapi_stub:
+записанные ответы из fixtures, задержка и доля ошибок) и Telegram Bot API (telegram_stub).
+Симулированные пользователи проходят диалоги /lowprice, /highprice, /bestdeal и /history целиком:
+команда, диапазоны цен и расстояний (/bestdeal), город и его уточнение, даты заезда и выезда в календаре,
+количество отелей и фотографий, повтор последнего запроса из истории. Каждый пользователь ждет ответ бота
+перед следующим шагом, как живой собеседник.
+
+Печатает пропускную способность (диалогов и обновлений в секунду), задержку ответа на шаг диалога, время поиска
+до первого и последнего отеля (p50/p95/p99), запросы к RapidAPI на один поиск и вызовы Telegram по методам.
+По умолчанию лимиты отправки Telegram (send_*_rate) сняты, чтобы измерялся сам бот:
+--telegram-limits оставляет настройки из settings.py.
+
+Запуск из корня проекта:
+    python benchmarks/bench_e2e.py --users 2000 --concurrency 200 --api-latency 0.2
+    python benchmarks/bench_e2e.py --runtime async --users 200 --concurrency 50
+"""
+import argparse
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+import importlib.util
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from types import ModuleType
+from typing import Callable, Dict, List, Optional, Tuple
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, os.path.join(ROOT, 'body'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH)
+
+os.environ.setdefault('telegram_bot_token', '123456:bench-token')
+os.environ.setdefault('x-rapidapi-key', 'bench-key')
+os.environ['bot_mode'] = 'polling'
+
+import settings  # noqa: E402
+import telebot.apihelper  # noqa: E402
+
+from rapidapi_stub import RapidApiStub, load_recorded  # noqa: E402
+from telegram_stub import Sent, TelegramStub  # noqa: E402
+
+DIALOGS = ('lowprice', 'highprice', 'bestdeal', 'history')
+SEARCH_DIALOGS = ('lowprice', 'highprice', 'bestdeal')
+# ответы бота, которыми поиск заканчивается без отелей
+SEARCH_ERRORS = ('По вашему запросу ничего не найдено.', 'Техническая неполадка. Попробуйте еще раз!',
+                 'Технические неполадки с сайтом, попробуйте еще раз.', 'Неполадки с телеграмом')
+
+
+class DialogError(Exception):
+    """ Бот не ответил на шаг диалога вовремя или поиск закончился ошибкой. """
+
+
+class Stats:
+    """ Результаты всех пользователей. """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.steps: List[float] = list()
+        self.first_hotel: List[float] = list()
+        self.last_hotel: List[float] = list()
+        self.dialogs: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.updates: int = 0
+
+    def add(self, name: str, value: float) -> None:
+        with self.lock:
+            getattr(self, name).append(value * 1000)
+
+
+def startswith(text: str) -> Callable[[Sent], bool]:
+    return lambda sent: sent.text.startswith(text)
+
+
+def is_hotel(sent: Sent) -> bool:
+    """ Сообщение с отелем - с кнопкой-ссылкой на страницу отеля. """
+
+    return sent.method == 'sendMessage' and any('url' in button for button in sent.buttons())
+
+
+def is_search_result(sent: Sent) -> bool:
+    return is_hotel(sent) or sent.text in SEARCH_ERRORS
+
+
+def calendar_data(day: date) -> str:
+    """ callback_data кнопки дня в DetailedTelegramCalendar (telegram_bot_calendar): cbcal_<id>_s_d_<y>_<m>_<d>. """
+
+    return 'cbcal_0_s_d_{y}_{m}_{d}'.format(y=day.year, m=day.month, d=day.day)
+
+
+class User:
+    """ Симулированный пользователь: отправляет обновление и ждет нужный ответ бота. """
+
+    def __init__(self, telegram: TelegramStub, user_id: int, stats: Stats, args: argparse.Namespace) -> None:
+        self.telegram = telegram
+        self.user_id = user_id
+        self.stats = stats
+        self.args = args
+
+    def _send(self, update: dict, expected: Callable[[Sent], bool]) -> Sent:
+        start: int = self.telegram.position(self.user_id)
+        sent_at: float = time.perf_counter()
+        self.telegram.put_update(update)
+        with self.stats.lock:
+            self.stats.updates += 1
+        found: Optional[Tuple[int, Sent]] = self.telegram.wait(self.user_id, start, expected, self.args.timeout)
+        if found is None:
+            raise DialogError('нет ответа')
+        self.stats.add('steps', found[1].time - sent_at)
+
+        return found[1]
+
+    def say(self, text: str, expected: Callable[[Sent], bool]) -> Sent:
+        return self._send(self.telegram.message_update(self.user_id, text), expected)
+
+    def press(self, data: str, message: Sent, expected: Callable[[Sent], bool]) -> Sent:
+        return self._send(self.telegram.callback_update(self.user_id, data, message.message), expected)
+
+    def wait_hotels(self, update: dict) -> None:
+        """ Отправляет последний шаг диалога и ждет все hotels отелей или сообщение об ошибке поиска. """
+
+        index: int = self.telegram.position(self.user_id)
+        sent_at: float = time.perf_counter()
+        self.telegram.put_update(update)
+        with self.stats.lock:
+            self.stats.updates += 1
+        for num in range(self.args.hotels):
+            found: Optional[Tuple[int, Sent]] = self.telegram.wait(self.user_id, index, is_search_result,
+                                                                   self.args.search_timeout)
+            if found is None:
+                raise DialogError('поиск не закончился')
+            index, sent = found[0] + 1, found[1]
+            if not is_hotel(sent):
+                raise DialogError(sent.text)
+            if num == 0:
+                self.stats.add('first_hotel', sent.time - sent_at)
+        self.stats.add('last_hotel', sent.time - sent_at)
+
+    def choose_city(self) -> None:
+        cities: Sent = self.say(self.args.city, startswith('Уточните'))
+        check_in_calendar: Sent = self.say(cities.buttons()[0]['text'], startswith('Выберите дату заезда'))
+        check_in: date = date.today() + timedelta(days=7 + self.user_id % 30)
+        check_out_calendar: Sent = self.press(calendar_data(check_in), check_in_calendar,
+                                              startswith('Выберите дату выезда'))
+        self.press(calendar_data(check_in + timedelta(days=3)), check_out_calendar,
+                   startswith('Выберите количество отелей'))
+
+    def search(self) -> None:
+        self.say(str(self.args.hotels), startswith('Нужны фотографии'))
+        if self.args.photos:
+            self.say('Да', startswith('Введите количество'))
+            self.wait_hotels(self.telegram.message_update(self.user_id, str(self.args.photos)))
+        else:
+            self.wait_hotels(self.telegram.message_update(self.user_id, 'Нет'))
+
+    def lowprice(self) -> None:
+        self.say('/lowprice', startswith('Выберите город'))
+        self.choose_city()
+        self.search()
+
+    def highprice(self) -> None:
+        self.say('/highprice', startswith('Выберите город'))
+        self.choose_city()
+        self.search()
+
+    def bestdeal(self) -> None:
+        self.say('/bestdeal', startswith('Введите диапазон желаемых цен'))
+        self.say(self.args.prices, startswith('Введите диапазон расстояния'))
+        self.say(self.args.distances, startswith('Выберите город'))
+        self.choose_city()
+        self.search()
+
+    def history(self) -> None:
+        """ /history и "Повторить запрос" под первым запросом: сохраненный результат без обращения к API. """
+
+        request: Sent = self.say('/history', lambda sent: any(button.get('callback_data', '').isdigit()
+                                                              for button in sent.buttons()))
+        data: str = [button['callback_data'] for button in request.buttons()
+                     if button.get('callback_data', '').isdigit()][0]
+        self.wait_hotels(self.telegram.callback_update(self.user_id, data, request.message))
+
+    def run(self, dialogs: List[str]) -> None:
+        """ Проходит диалоги по порядку; после ошибки остальные диалоги пользователя пропускаются. """
+
+        for dialog in dialogs:
+            try:
+                getattr(self, dialog)()
+            except DialogError as error:
+                with self.stats.lock:
+                    self.stats.errors['{dialog}: {error}'.format(dialog=dialog, error=error)] += 1
+                return
+            with self.stats.lock:
+                self.stats.dialogs[dialog] += 1
+
+
+def start_bot(telegram: TelegramStub, timeout: float) -> Tuple[Callable[[], None], threading.Thread]:
+    """
+    Выполняет body/main.py в отдельном потоке (он заканчивается после bot.stop_polling()).
+    Возвращает функцию остановки бота и поток.
+    """
+
+    spec = importlib.util.spec_from_file_location('main', os.path.join(ROOT, 'body', 'main.py'))
+    module: ModuleType = importlib.util.module_from_spec(spec)
+    thread = threading.Thread(target=spec.loader.exec_module, args=(module,), name='bot', daemon=True)
+    thread.start()
+    if not telegram.polling.wait(timeout):
+        raise SystemExit('Бот не начал получать обновления, подробности в журнале бота')
+
+    return lambda: module.bot.stop_polling(), thread
+
+
+def start_async_bot(telegram: TelegramStub, timeout: float) -> Tuple[Callable[[], None], threading.Thread]:
+    """
+    Импортирует body/async_main.py и выполняет его main() в цикле событий отдельного потока
+    (как python async_main.py). Остановка отменяет задачу main(). Возвращает функцию остановки и поток.
+    """
+
+    import telebot.asyncio_helper  # создает сессию aiohttp при импорте, поэтому только для этого режима
+
+    telebot.asyncio_helper.API_URL = telegram.api_url
+    spec = importlib.util.spec_from_file_location('async_main', os.path.join(ROOT, 'body', 'async_main.py'))
+    module: ModuleType = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if module.botrequests.migrate():
+        raise SystemExit('Не удалось подготовить БД, подробности в журнале бота')
+
+    loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+    task: asyncio.Task = loop.create_task(module.main())
+    thread = threading.Thread(target=loop.run_until_complete, args=(task,), name='bot', daemon=True)
+    thread.start()
+    if not telegram.polling.wait(timeout):
+        raise SystemExit('Бот не начал получать обновления, подробности в журнале бота')
+
+    return lambda: loop.call_soon_threadsafe(task.cancel), thread
+
+
+def percentiles(values: List[float]) -> str:
+    if len(values) < 2:
+        values = values * 2 or [0.0, 0.0]
+    quantiles: List[float] = statistics.quantiles(values, n=100)
+
+    return 'p50 {p50:.1f} мс, p95 {p95:.1f} мс, p99 {p99:.1f} мс'.format(p50=quantiles[49], p95=quantiles[94],
+                                                                       p99=quantiles[98])
+
+
+def run(args: argparse.Namespace) -> None:
+    recorded: Dict[str, dict] = load_recorded(args.fixtures) if args.fixtures else dict()
+    rapidapi = RapidApiStub(latency=args.api_latency, error_rate=args.api_error_rate, recorded=recorded).start()
+    telegram = TelegramStub(latency=args.telegram_latency, error_rate=args.telegram_error_rate).start()
+
+    # настройки подменяются до импорта botrequests в body/main.py: модули читают их при импорте
+    workdir: str = tempfile.mkdtemp(prefix='bench_e2e_')
+    settings.api_base_url = rapidapi.url
+    settings.db_name = os.path.join(workdir, 'users.db')
+    settings.LOGGING_CONFIG['handlers']['logfile']['filename'] = os.path.join(workdir, 'logfile.log')
+    if not args.telegram_limits:
+        settings.send_chat_rate = settings.send_chat_burst = 10 ** 6
+        settings.send_global_rate = settings.send_global_burst = 10 ** 6
+    telebot.apihelper.API_URL = telegram.api_url
+
+    stop_bot, bot_thread = (start_async_bot if args.runtime == 'async' else start_bot)(telegram, args.timeout)
+    print('Заглушки: RapidAPI {api} (записанные ответы: {recorded}), Telegram {tg}; БД и журнал бота: {workdir}'.format(
+        api=rapidapi.url, recorded=', '.join(recorded) or 'нет', tg=telegram.url, workdir=workdir))
+
+    stats = Stats()
+    dialogs: List[str] = args.dialogs.split(',')
+    users: List[User] = [User(telegram, args.first_user_id + i_user, stats, args) for i_user in range(args.users)]
+    started: float = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for _ in executor.map(lambda user: user.run(dialogs), users):
+            pass
+    elapsed: float = time.perf_counter() - started
+
+    stop_bot()
+    bot_thread.join(args.timeout)
+    rapidapi.stop()
+    telegram.stop()
+
+    completed: int = sum(stats.dialogs.values())
+    searches: int = sum(stats.dialogs[dialog] for dialog in SEARCH_DIALOGS) + sum(
+        num for error, num in stats.errors.items() if error.split(':')[0] in SEARCH_DIALOGS)
+    print('пользователей: {users}, диалогов: {dialogs} ({by_dialog}) за {sec:.1f} с'.format(
+        users=args.users, dialogs=completed, by_dialog=dict(stats.dialogs), sec=elapsed))
+    print('пропускная способность: {dialogs:.1f} диалогов/с, {updates:.1f} обновлений/с'.format(
+        dialogs=completed / elapsed, updates=stats.updates / elapsed))
+    print('ответ на шаг диалога:      {pct}'.format(pct=percentiles(stats.steps)))
+    print('поиск до первого отеля:    {pct}'.format(pct=percentiles(stats.first_hotel)))
+    print('поиск до последнего отеля: {pct}'.format(pct=percentiles(stats.last_hotel)))
+    print('запросов к RapidAPI на поиск: {total:.2f} {by_path}'.format(
+        total=sum(rapidapi.calls.values()) / max(searches, 1),
+        by_path={path: round(num / max(searches, 1), 2) for path, num in sorted(rapidapi.calls.items())}))
+    print('вызовы Telegram: {calls}'.format(calls={method: num for method, num in sorted(telegram.calls.items())
+                                                   if method != 'getUpdates'}))
+    if stats.errors:
+        print('незавершенные диалоги: {errors}'.format(errors=dict(stats.errors)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runtime', choices=('sync', 'async'), default='sync',
+                        help='body/main.py (sync) или body/async_main.py (async)')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100, help='пользователей в диалоге одновременно')
+    parser.add_argument('--dialogs', default=','.join(DIALOGS), help='диалоги каждого пользователя по порядку')
+    parser.add_argument('--hotels', type=int, default=3, help='количество отелей в поиске')
+    parser.add_argument('--photos', type=int, default=2, help='количество фотографий (0 - без фотографий)')
+    parser.add_argument('--city', default='Нью-Йорк')
+    parser.add_argument('--prices', default='1500 30000', help='диапазон цен /bestdeal')
+    parser.add_argument('--distances', default='1 5', help='диапазон расстояний /bestdeal')
+    parser.add_argument('--fixtures', default=os.path.join(BENCH, 'fixtures'),
+                        help='каталог записанных ответов RapidAPI ("" - только сформированные заглушкой)')
+    parser.add_argument('--api-latency', type=float, default=0.1, help='задержка RapidAPI (сек)')
+    parser.add_argument('--api-error-rate', type=float, default=0.0, help='доля ответов RapidAPI 503')
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help='задержка Telegram (сек)')
+    parser.add_argument('--telegram-error-rate', type=float, default=0.0, help='доля ответов Telegram 429')
+    parser.add_argument('--telegram-limits', action='store_true', help='оставить лимиты отправки из settings.py')
+    parser.add_argument('--timeout', type=float, default=30, help='ожидание ответа на шаг диалога (сек)')
+    parser.add_argument('--search-timeout', type=float, default=120, help='ожидание отелей одного поиска (сек)')
+    parser.add_argument('--first-user-id', type=int, default=100000)
+    run(parser.parse_args())
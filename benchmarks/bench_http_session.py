@@ -0,0 +1,75 @@
+"""
+Бенчмарк HTTP-слоя: новые соединения и время на один поиск при вызовах requests.request
+и через общую сессию body.botrequests.api_client на локальной заглушке RapidAPI.
+
+Один поиск: 1 запрос города, 1 запрос списка отелей и 9 запросов фотографий.
+
+Запуск из корня проекта:
+    python benchmarks/bench_http_session.py --searches 100 --latency 0.005
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Union
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('telegram_bot_token', '123456:bench-token')
+os.environ.setdefault('x-rapidapi-key', 'bench-key')
+
+from rapidapi_stub import RapidApiStub  # noqa: E402
+from body.botrequests import api_client  # noqa: E402
+
+NUM_HOTELS = 9
+
+
+def search(get: Callable[[str, Dict[str, Union[str, int]]], dict]) -> None:
+    """ Последовательность вызовов API одного поиска /lowprice с фотографиями. """
+
+    get('/locations/v2/search', {'query': 'Нью-Йорк', 'locale': 'ru_RU'})
+    hotels = get('/properties/list', {'destinationId': '1506246', 'pageSize': NUM_HOTELS, 'pageNumber': 1,
+                                      'sortOrder': 'PRICE', 'locale': 'ru_RU', 'currency': 'RUB'})
+    for hotel in hotels['data']['body']['searchResults']['results']:
+        get('/properties/get-hotel-photos', {'id': hotel['id']})
+
+
+def run(mode: str, stub: RapidApiStub, searches: int) -> None:
+    """ Выполняет заданное количество поисков и печатает статистику. """
+
+    if mode == 'request':
+        def get(path: str, params: Dict[str, Union[str, int]]) -> dict:
+            return requests.request('GET', stub.url + path, params=params, timeout=15).json()
+    else:
+        api_client.api_base_url = stub.url
+        get = api_client.get_json
+
+    stub.reset()
+    durations: List[float] = list()
+    for _ in range(searches):
+        started = time.perf_counter()
+        search(get)
+        durations.append((time.perf_counter() - started) * 1000)
+
+    print('{mode:>8}: соединений на поиск: {conn:.2f}, среднее: {mean:.2f} мс, p99: {p99:.2f} мс'.format(
+        mode=mode, conn=stub.connections / searches, mean=statistics.mean(durations),
+        p99=statistics.quantiles(durations, n=100)[98]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--searches', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub = RapidApiStub(latency=args.latency).start()
+    try:
+        run('request', stub, args.searches)
+        run('session', stub, args.searches)
+    finally:
+        stub.stop()
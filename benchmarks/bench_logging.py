@@ -0,0 +1,98 @@
+"""
+Бенчмарк журнала: задержка, которую запись журнала добавляет обработчику одного обновления.
+
+Один "обработчик" пишет 5 коротких сообщений и ответ /properties/list (страница из 25 отелей, как заглушка RapidAPI).
+Режим "прежний" - синхронный RotatingFileHandler и ответ целиком через .format,
+режим "очередь" - body.botrequests.logs.setup_logging (QueueHandler, JSON, фоновая запись)
+и log_payload (выборка log_payload_sample, обрезка до log_max_payload символов).
+
+Запуск из корня проекта:
+    python benchmarks/bench_logging.py --handlers 2000 --threads 8
+"""
+import argparse
+import logging
+import logging.config
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import List
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('telegram_bot_token', '123456:bench-token')
+os.environ.setdefault('x-rapidapi-key', 'bench-key')
+
+from rapidapi_stub import hotels_payload  # noqa: E402
+from body.botrequests import logs  # noqa: E402
+from settings import LOGGING_CONFIG  # noqa: E402
+
+log = logging.getLogger('bench')
+RESPONSE: dict = hotels_payload(1, 25, 'PRICE')
+
+
+def handler(mode: str, user_id: int) -> None:
+    """ Записи журнала одного обработчика /lowprice. """
+
+    for step in range(5):
+        log.info('Получено {answer}. user_id: {user_id}'.format(answer=step, user_id=user_id))
+    if mode == 'прежний':
+        log.info('Получен ответ: {res}.'.format(res=RESPONSE))
+    else:
+        logs.log_payload(log, 'Получен ответ /properties/list', RESPONSE)
+
+
+def run(mode: str, handlers: int, threads: int) -> None:
+    """ Выполняет обработчики в threads потоках и печатает задержку журнала на один обработчик. """
+
+    config: dict = dict(LOGGING_CONFIG, handlers={'logfile': dict(LOGGING_CONFIG['handlers']['logfile'],
+                                                                   filename=os.path.join(tempfile.mkdtemp(),
+                                                                                         'bench.log'))})
+    if mode == 'прежний':
+        config['formatters'] = {'default': {'format': '%(asctime)s -- %(name)s -- %(levelname)s -- %(message)s'}}
+        logging.config.dictConfig(config)
+    else:
+        logs.setup_logging(config)
+
+    latencies: List[float] = list()
+    lock = threading.Lock()
+
+    def work(num: int) -> None:
+        local: List[float] = list()
+        for i_handler in range(num):
+            started = time.perf_counter()
+            with logs.log_context(user_id=i_handler, command='lowprice'):
+                handler(mode, i_handler)
+            local.append((time.perf_counter() - started) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=work, args=(handlers // threads,)) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed: float = time.perf_counter() - started
+    logs.stop_logging()
+    filename: str = config['handlers']['logfile']['filename']
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print('{mode:>8}: p50: {p50:.3f} мс, p99: {p99:.3f} мс, обработчиков в секунду: {rate:.0f}, '
+          'журнал: {size:.1f} МБ, отброшено записей: {dropped}'.format(
+              mode=mode, p50=quantiles[49], p99=quantiles[98], rate=len(latencies) / elapsed,
+              size=os.path.getsize(filename) / 2 ** 20, dropped=logs.log_stats()['dropped']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handlers', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    run('прежний', args.handlers, args.threads)
+    run('очередь', args.handlers, args.threads)
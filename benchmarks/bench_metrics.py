@@ -0,0 +1,56 @@
+"""
+Бенчмарк накладных расходов метрик (body.botrequests.metrics) на горячем пути:
+замер блока через timer(), счетчик ошибок и запрос SELECT к SQLite через TimedConnection -
+с выключенными (metrics_enabled = False) и включенными метриками.
+
+Запуск из корня проекта:
+    python benchmarks/bench_metrics.py --calls 200000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('telegram_bot_token', '123456:bench-token')
+os.environ.setdefault('x-rapidapi-key', 'bench-key')
+
+from body.botrequests import metrics  # noqa: E402
+
+
+def run(enabled: bool, calls: int) -> None:
+    """ Печатает время на одну операцию (нс) для выключенных или включенных метрик. """
+
+    metrics.metrics_enabled = enabled
+    conn = sqlite3.connect(':memory:', isolation_level=None,
+                           factory=metrics.TimedConnection if enabled else sqlite3.Connection)
+    conn.execute('CREATE TABLE users (user_id INTEGER PRIMARY KEY, name TEXT);')
+    conn.execute('INSERT INTO users VALUES (1, "user");')
+
+    def timed_block() -> None:
+        with metrics.timer(metrics.api_seconds, '/properties/list'):
+            pass
+
+    def select() -> None:
+        conn.execute('SELECT name FROM users WHERE user_id = ?;', (1,)).fetchone()
+
+    results = {'timer()': timed_block,
+               'errors_total.inc()': lambda: metrics.errors_total.inc('api', 'ReadTimeout'),
+               'SELECT': select}
+    print('Метрики {state}:'.format(state='включены' if enabled else 'выключены'))
+    for name, func in results.items():
+        elapsed: float = min(timeit.repeat(func, number=calls, repeat=3))
+        print('    {name:<20} {ns:8.0f} нс'.format(name=name, ns=elapsed / calls * 1e9))
+    conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200000)
+    args = parser.parse_args()
+
+    run(False, args.calls)
+    run(True, args.calls)
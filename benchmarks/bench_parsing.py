@@ -0,0 +1,140 @@
+"""
+Микробенчмарк разбора полей RapidAPI на записанных ответах /properties/list (benchmarks/fixtures).
+
+Сравнивает прежние функции (re.sub и split на каждый вызов, разбор дат через строку timedelta)
+с модулем body.botrequests.parsing: время на один вызов для цены за N ночей, расстояния, количества ночей
+и полного отбора отелей /bestdeal (создание записи, фильтр по расстоянию, оценка, карточка).
+Перед замерами печатает результаты разбора для всех форматов цен, которые отдает API.
+
+Запуск из корня проекта:
+    python benchmarks/bench_parsing.py --repeat 20
+"""
+import argparse
+from datetime import date
+import json
+import os
+import re
+import sys
+import time
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+os.environ.setdefault('telegram_bot_token', '123456:bench-token')
+os.environ.setdefault('x-rapidapi-key', 'bench-key')
+
+from body.botrequests import parsing  # noqa: E402
+from body.botrequests.properties import Hotel, get_total_price  # noqa: E402
+
+FIXTURE = os.path.join(ROOT, 'fixtures', 'properties_list_bestdeal.json')
+PRICE_FORMATS: List[str] = ['999 RUB', '1 234 RUB', '12\u00a0345 RUB', '1 234,56 RUB', 'RUB1,234', '$1,234.50',
+                            '1.234,5 RUB']
+DATES: List[Tuple[str, str]] = [('2026-11-01', '2026-11-05'), ('2026-12-30', '2027-01-08'), ('2026-2-1', '2026-3-1')]
+
+
+def legacy_total_price(price: str, night: int) -> str:
+    """ Прежняя get_total_price: берет из цены только первую группу цифр. """
+
+    price_str: str = price.split(' ')[0]
+    price: str = re.sub(r',', '.', price_str)
+    total: float = round(float(price) * night, 3)
+    total_str: str = re.sub(r'\.', ',', str(total))
+
+    return ' '.join((total_str, 'RUB'))
+
+
+def legacy_distance(distance: str) -> float:
+    """ Прежняя get_distance. """
+
+    distance_str: str = distance.split(' ')[0]
+    distance_str: str = re.sub(r',', '.', distance_str)
+
+    return float(distance_str)
+
+
+def legacy_price_value(price: str) -> float:
+    """ Прежний Hotel.price_value. """
+
+    return float(re.sub(r'[^\d,.]', '', price).replace(',', '.') or 0)
+
+
+def legacy_num_nights(date_1: str, date_2: str) -> int:
+    """ Прежняя num_nights: разность дат через строку timedelta и регулярное выражение. """
+
+    def f_date(date_str: str) -> date:
+        date_tpl: time.struct_time = time.strptime(' '.join(date_str.split('-')), '%Y %m %d')
+        return date(date_tpl[0], date_tpl[1], date_tpl[2])
+
+    num_days: str = str(f_date(date_2) - f_date(date_1))
+
+    return int(re.match(r'\b\d+', num_days)[0])
+
+
+def legacy_bestdeal(results: List[dict], nights: int) -> List[Dict[str, str]]:
+    """ Прежний отбор /bestdeal: цена и расстояние разбираются из строк при каждом обращении. """
+
+    hotels: List[Hotel] = [Hotel.from_api(i_hotel) for i_hotel in results]
+    candidates: List[Hotel] = [hotel for hotel in hotels if 1 <= legacy_distance(hotel.distance) <= 5]
+    max_price: float = max(legacy_price_value(hotel.price) for hotel in candidates)
+    candidates.sort(key=lambda hotel: 0.5 * legacy_price_value(hotel.price) / max_price +
+                    0.5 * legacy_distance(hotel.distance) / 5)
+
+    return [{'Цена за ночь': hotel.price, 'Цена': legacy_total_price(hotel.price, nights)} for hotel in candidates]
+
+
+def new_bestdeal(results: List[dict], nights: int) -> List[Dict[str, str]]:
+    """ Отбор /bestdeal с числами, разобранными при создании записей. """
+
+    hotels: List[Hotel] = [Hotel.from_api(i_hotel) for i_hotel in results]
+    candidates: List[Hotel] = [hotel for hotel in hotels if 1 <= hotel.distance_km <= 5]
+    max_price: float = max(hotel.price_value for hotel in candidates)
+    candidates.sort(key=lambda hotel: 0.5 * hotel.price_value / max_price + 0.5 * hotel.distance_km / 5)
+
+    return [{'Цена за ночь': hotel.price, 'Цена': parsing.format_price(hotel.price_value * nights)}
+            for hotel in candidates]
+
+
+def measure(name: str, legacy: Callable[[], object], new: Callable[[], object], calls: int, repeat: int) -> None:
+    """ Печатает лучшее из repeat время на один вызов прежней и новой реализации. """
+
+    legacy_us: float = min(timeit.repeat(legacy, number=1, repeat=repeat)) / calls * 1e6
+    new_us: float = min(timeit.repeat(new, number=1, repeat=repeat)) / calls * 1e6
+    print('{name:<26} | прежняя: {legacy:7.2f} мкс | новая: {new:7.2f} мкс | x{ratio:.1f}'.format(
+        name=name, legacy=legacy_us, new=new_us, ratio=legacy_us / new_us))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with open(FIXTURE, encoding='utf-8') as fixture_file:
+        sort_orders: Dict[str, Dict[str, dict]] = json.load(fixture_file)['sort_orders']
+    api_hotels: List[dict] = [i_hotel for pages in sort_orders.values() for i_page in pages.values()
+                              for i_hotel in i_page['data']['body']['searchResults']['results']]
+    prices: List[str] = [i_hotel['ratePlan']['price']['current'] for i_hotel in api_hotels]
+    distances: List[str] = [i_hotel['landmarks'][0]['distance'] for i_hotel in api_hotels]
+
+    for i_price in PRICE_FORMATS:
+        try:
+            legacy_result: str = legacy_total_price(i_price, 4)
+        except ValueError:
+            legacy_result = 'ошибка'
+        print('{price!r:<16} x 4 ночи: прежняя {legacy!r:<14} новая {new!r}'.format(
+            price=i_price, legacy=legacy_result, new=get_total_price(i_price, 4)))
+    print()
+
+    measure('цена за 4 ночи', lambda: [legacy_total_price(i_price, 4) for i_price in prices],
+            lambda: [get_total_price(i_price, 4) for i_price in prices], len(prices), args.repeat)
+    measure('расстояние', lambda: [legacy_distance(i_distance) for i_distance in distances],
+            lambda: [parsing.parse_distance(i_distance) for i_distance in distances], len(distances), args.repeat)
+    measure('расстояние без кэша', lambda: [legacy_distance(i_distance) for i_distance in distances],
+            lambda: [parsing.parse_distance.__wrapped__(i_distance) for i_distance in distances],
+            len(distances), args.repeat)
+    measure('количество ночей', lambda: [legacy_num_nights(*i_dates) for i_dates in DATES * 100],
+            lambda: [parsing.nights_between(*i_dates) for i_dates in DATES * 100], len(DATES) * 100, args.repeat)
+    measure('отбор /bestdeal на отель', lambda: legacy_bestdeal(api_hotels, 4), lambda: new_bestdeal(api_hotels, 4),
+            len(api_hotels), args.repeat)
+
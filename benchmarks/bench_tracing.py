@@ -0,0 +1,66 @@
+"""
+Бенчмарк накладных расходов трассировки (body.botrequests.tracing) на горячем пути:
+спан вне трассы (трассировка выключена или запрос вне обработчика), спан внутри трассы обновления
+и обработка обновления целиком - корневой спан, 5 спанов запросов к БД и выгрузка в файл.
+
+Запуск из корня проекта:
+    python benchmarks/bench_tracing.py --calls 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('telegram_bot_token', '123456:bench-token')
+os.environ.setdefault('x-rapidapi-key', 'bench-key')
+
+import settings  # noqa: E402
+
+settings.trace_sample_rate = 1.0
+settings.trace_file = os.path.join(tempfile.mkdtemp(), 'traces.jsonl')
+
+from body.botrequests import logs, tracing  # noqa: E402
+
+
+def update() -> None:
+    """ Обработка одного обновления: трасса со спаном обработчика и 5 спанами запросов. """
+
+    with logs.log_context(user_id=1, request_id=1), tracing.trace_update('update message'):
+        with tracing.span('get_cities'):
+            for _ in range(5):
+                with tracing.span('SQL SELECT', tracing.SPAN_CLIENT, statement='SELECT 1;'):
+                    pass
+
+
+def run(calls: int) -> None:
+    def null_span() -> None:
+        with tracing.span('SQL SELECT'):
+            pass
+
+    print('    {name:<24} {ns:8.0f} нс'.format(
+        name='спан вне трассы', ns=min(timeit.repeat(null_span, number=calls, repeat=3)) / calls * 1e9))
+
+    tracing.setup_tracing()
+    trace = tracing.begin_trace('update message')
+    print('    {name:<24} {ns:8.0f} нс'.format(
+        name='спан в трассе', ns=min(timeit.repeat(null_span, number=calls, repeat=3)) / calls * 1e9))
+    tracing.end_trace(trace)
+
+    updates: int = calls // 10
+    elapsed: float = min(timeit.repeat(update, number=updates, repeat=3))
+    tracing.stop_tracing()
+    print('    {name:<24} {us:8.1f} мкс, файл трасс: {size:.1f} МБ, отброшено: {dropped}'.format(
+        name='обновление (7 спанов)', us=elapsed / updates * 1e6,
+        size=os.path.getsize(settings.trace_file) / 2 ** 20, dropped=tracing.trace_stats()['dropped']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=100000)
+    args = parser.parse_args()
+
+    run(args.calls)
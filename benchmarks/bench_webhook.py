@@ -0,0 +1,145 @@
+"""
+Нагрузочный тест webhook-сервера: клиенты отправляют синтетические обновления Telegram
+(сообщения "/hello_world" от разных пользователей) и измеряется пропускная способность и задержки.
+
+По умолчанию поднимает body.botrequests.webhook.WebhookServer в этом процессе с обработчиком-заглушкой,
+который работает --handler-ms миллисекунд (имитация обработчика бота), и печатает:
+обновлений в секунду, задержку HTTP-ответа и полное время от отправки до окончания обработки (p50/p99),
+ожидание в очереди и количество отклоненных обновлений.
+С --url обновления отправляются на уже запущенный сервер (измеряются только HTTP-ответы).
+
+Запуск из корня проекта:
+    python benchmarks/bench_webhook.py --updates 5000 --clients 16 --handler-ms 5
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('telegram_bot_token', '123456:bench-token')
+os.environ.setdefault('x-rapidapi-key', 'bench-key')
+
+from body.botrequests.webhook import WebhookServer  # noqa: E402
+
+SECRET = 'bench-secret'
+
+
+def make_update(update_id: int, user_id: int) -> str:
+    """ Синтетическое обновление с текстовым сообщением; время отправки передается в поле "sent". """
+
+    return json.dumps({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'text': '/hello_world',
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'User{id}'.format(id=user_id)},
+        'chat': {'id': user_id, 'type': 'private', 'first_name': 'User{id}'.format(id=user_id)},
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 12}],
+    }, 'sent': time.perf_counter()})
+
+
+def percentile(values: List[float], pct: int) -> float:
+    return statistics.quantiles(values, n=100)[pct - 1] if len(values) > 1 else (values or [0.0])[0]
+
+
+def client(url: str, secret: str, updates: List[int], users: int, latencies: List[float],
+           statuses: Dict[int, int], lock: threading.Lock) -> None:
+    """ Один клиент: отправляет обновления по keep-alive соединению, как это делает Telegram. """
+
+    parsed = urlparse(url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=30)
+    local: List[float] = list()
+    local_statuses: Dict[int, int] = dict()
+    for update_id in updates:
+        body: bytes = make_update(update_id, update_id % users).encode('utf-8')
+        started: float = time.perf_counter()
+        conn.request('POST', parsed.path, body=body,
+                     headers={'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret})
+        response = conn.getresponse()
+        response.read()
+        local.append((time.perf_counter() - started) * 1000)
+        local_statuses[response.status] = local_statuses.get(response.status, 0) + 1
+    conn.close()
+
+    with lock:
+        latencies.extend(local)
+        for status, num in local_statuses.items():
+            statuses[status] = statuses.get(status, 0) + num
+
+
+def run(url: str, secret: str, num_updates: int, clients: int, users: int,
+        server: Optional[WebhookServer] = None, done: Optional[List[float]] = None) -> None:
+    """ Отправляет обновления с нескольких клиентов и печатает статистику. """
+
+    latencies: List[float] = list()
+    statuses: Dict[int, int] = dict()
+    lock = threading.Lock()
+    threads = [threading.Thread(target=client, args=(url, secret, list(range(i_client, num_updates, clients)), users,
+                                                     latencies, statuses, lock))
+               for i_client in range(clients)]
+
+    started: float = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sent: float = time.perf_counter() - started
+
+    print('отправлено: {num} за {sec:.2f} с ({rate:.0f} обновлений/с), ответы: {statuses}'.format(
+        num=num_updates, sec=sent, rate=num_updates / sent, statuses=statuses))
+    print('HTTP-ответ: p50 {p50:.2f} мс, p99 {p99:.2f} мс'.format(p50=percentile(latencies, 50),
+                                                                 p99=percentile(latencies, 99)))
+
+    if server is None:
+        return
+
+    accepted: int = statuses.get(200, 0)
+    while server.stats()['processed'] + server.stats()['errors'] < accepted:
+        time.sleep(0.01)
+    total: float = time.perf_counter() - started
+    stats = server.stats()
+    print('обработано: {num} за {sec:.2f} с ({rate:.0f} обновлений/с), отклонено: {rejected:.0f}'.format(
+        num=int(stats['processed']), sec=total, rate=stats['processed'] / total, rejected=stats['rejected']))
+    print('от отправки до обработки: p50 {p50:.2f} мс, p99 {p99:.2f} мс, '
+          'среднее ожидание в очереди {wait:.2f} мс'.format(
+              p50=percentile(done, 50), p99=percentile(done, 99),
+              wait=stats['queue_wait'] / max(stats['processed'], 1) * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--clients', type=int, default=16, help='одновременных соединений')
+    parser.add_argument('--users', type=int, default=500, help='разных пользователей в обновлениях')
+    parser.add_argument('--handler-ms', type=float, default=5.0, help='время работы обработчика-заглушки')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--queue-size', type=int, default=1000)
+    parser.add_argument('--url', help='адрес запущенного webhook-сервера, например http://127.0.0.1:8443/webhook')
+    parser.add_argument('--secret', default=SECRET)
+    args = parser.parse_args()
+
+    if args.url:
+        run(args.url, args.secret, args.updates, args.clients, args.users)
+    else:
+        done_ms: List[float] = list()
+        done_lock = threading.Lock()
+
+        def process(body: str) -> None:
+            sent_at: float = json.loads(body)['sent']
+            time.sleep(args.handler_ms / 1000)
+            with done_lock:
+                done_ms.append((time.perf_counter() - sent_at) * 1000)
+
+        webhook = WebhookServer(process, host='127.0.0.1', port=0, secret=SECRET, queue_size=args.queue_size,
+                                workers=args.workers).start()
+        try:
+            run('http://{host}:{port}/webhook'.format(host=webhook.address[0], port=webhook.address[1]), SECRET,
+                args.updates, args.clients, args.users, webhook, done_ms)
+        finally:
+            webhook.stop()
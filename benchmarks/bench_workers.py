@@ -0,0 +1,210 @@
+"""
+Бенчмарк нескольких процессов бота с общей БД: bot_workers процессов body/main.py (state_backend=sqlite)
+работают с заглушками RapidAPI и Telegram Bot API из bench_e2e. Процесс 0 получает обновления (polling или
+webhook с --mode webhook: заглушка Telegram отправляет их на webhook-сервер процесса) и записывает их в общую
+очередь update_queue, каждый процесс обрабатывает обновления своих пользователей (user_id % bot_workers).
+Симулированные пользователи проходят те же диалоги, что в bench_e2e.
+
+Пока идут диалоги, процессы по очереди перезапускаются каждые --restart-every секунд: SIGINT (остановка
+с дообработкой принятых обновлений и отправкой очереди сообщений) или SIGKILL с --kill (падение процесса).
+Диалоги продолжаются после перезапуска: шаги диалога, состояния и необработанные обновления хранятся в БД.
+SIGKILL теряет сообщения, которые бот успел поставить в очередь отправки, но не отправил, - такие диалоги
+попадают в незавершенные.
+
+Печатает пропускную способность, задержки (p50/p95/p99), количество перезапусков, незавершенные диалоги
+и обновления, оставшиеся в очереди.
+
+Запуск из корня проекта:
+    python benchmarks/bench_workers.py --workers 4 --users 400 --concurrency 80 --restart-every 5
+    python benchmarks/bench_workers.py --mode webhook --workers 4 --users 400 --concurrency 80 --restart-every 5
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import runpy
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH)
+
+os.environ.setdefault('telegram_bot_token', '123456:bench-token')
+os.environ.setdefault('x-rapidapi-key', 'bench-key')
+
+from bench_e2e import DIALOGS, ROOT, Stats, User, percentiles  # noqa: E402
+from rapidapi_stub import RapidApiStub, load_recorded  # noqa: E402
+from telegram_stub import TelegramStub  # noqa: E402
+
+
+def run_worker() -> None:
+    """
+    Процесс бота: подменяет адреса RapidAPI и Telegram, режим и порт webhook, журнал и лимиты отправки
+    из переменных окружения и выполняет body/main.py как __main__ (до SIGINT).
+    """
+
+    import settings
+    import telebot.apihelper
+
+    settings.api_base_url = os.environ['bench_api_url']
+    # bench_e2e при импорте задает bot_mode=polling
+    settings.bot_mode = os.environ['bench_bot_mode']
+    settings.webhook_host = '127.0.0.1'
+    settings.webhook_port = int(os.environ.get('bench_webhook_port') or settings.webhook_port)
+    settings.LOGGING_CONFIG['handlers']['logfile']['filename'] = os.environ['bench_log']
+    if not os.environ.get('bench_telegram_limits'):
+        settings.send_chat_rate = settings.send_chat_burst = 10 ** 6
+        settings.send_global_rate = settings.send_global_burst = 10 ** 6
+    telebot.apihelper.API_URL = os.environ['bench_telegram_api_url']
+    runpy.run_path(os.path.join(ROOT, 'body', 'main.py'), run_name='__main__')
+
+
+def free_port() -> int:
+    """ Свободный локальный порт для webhook-сервера процесса 0. """
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Workers:
+    """ Процессы бота: запуск, остановка и перезапуск по очереди. """
+
+    def __init__(self, args: argparse.Namespace, workdir: str, env: Dict[str, str]) -> None:
+        self.args = args
+        self.workdir = workdir
+        self.env = env
+        self.procs: List[subprocess.Popen] = [self._start(num) for num in range(args.workers)]
+        self.restarts: int = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._restart_loop, name='restarts', daemon=True)
+
+    def _start(self, num: int) -> subprocess.Popen:
+        env: Dict[str, str] = dict(self.env, bot_worker_index=str(num),
+                                   bench_log=os.path.join(self.workdir, 'logfile-{num}.log'.format(num=num)))
+
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker'], env=env,
+                                cwd=os.path.join(ROOT, 'body'))
+
+    def _stop_worker(self, num: int, kill: bool) -> None:
+        proc: subprocess.Popen = self.procs[num]
+        proc.send_signal(signal.SIGKILL if kill else signal.SIGINT)
+        try:
+            proc.wait(self.args.timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    def _restart_loop(self) -> None:
+        num: int = 0
+        while not self._stop.wait(self.args.restart_every):
+            self._stop_worker(num, self.args.kill)
+            time.sleep(self.args.restart_delay)
+            self.procs[num] = self._start(num)
+            self.restarts += 1
+            num = (num + 1) % len(self.procs)
+
+    def start_restarts(self) -> None:
+        if self.args.restart_every:
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        for num in range(len(self.procs)):
+            self._stop_worker(num, kill=False)
+
+
+def run(args: argparse.Namespace) -> None:
+    recorded: Dict[str, dict] = load_recorded(args.fixtures) if args.fixtures else dict()
+    rapidapi = RapidApiStub(latency=args.api_latency, recorded=recorded).start()
+    telegram = TelegramStub(latency=args.telegram_latency).start()
+
+    workdir: str = tempfile.mkdtemp(prefix='bench_workers_')
+    db_name: str = os.path.join(workdir, 'users.db')
+    env: Dict[str, str] = dict(os.environ, db_name=db_name, state_backend='sqlite', bot_workers=str(args.workers),
+                               bench_bot_mode=args.mode, bench_api_url=rapidapi.url,
+                               bench_telegram_api_url=telegram.api_url)
+    if args.mode == 'webhook':
+        port: int = free_port()
+        env.update(webhook_url='http://127.0.0.1:{port}'.format(port=port), webhook_secret='bench-secret',
+                   bench_webhook_port=str(port))
+    if args.telegram_limits:
+        env['bench_telegram_limits'] = '1'
+    workers = Workers(args, workdir, env)
+    receiving: threading.Event = telegram.webhook_set if args.mode == 'webhook' else telegram.polling
+    if not receiving.wait(args.timeout):
+        workers.stop()
+        raise SystemExit('Бот не начал получать обновления, подробности в журналах {workdir}'.format(workdir=workdir))
+    time.sleep(args.startup)
+    print('Процессов бота: {workers} ({mode}), БД и журналы: {workdir}'.format(workers=args.workers, mode=args.mode,
+                                                                             workdir=workdir))
+
+    stats = Stats()
+    dialogs: List[str] = args.dialogs.split(',')
+    users: List[User] = [User(telegram, args.first_user_id + i_user, stats, args) for i_user in range(args.users)]
+    started: float = time.perf_counter()
+    workers.start_restarts()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for _ in executor.map(lambda user: user.run(dialogs), users):
+            pass
+    elapsed: float = time.perf_counter() - started
+    workers.stop()
+    rapidapi.stop()
+    telegram.stop()
+
+    with sqlite3.connect(db_name) as conn:
+        queued: int = conn.execute("SELECT COUNT(*) FROM update_queue;").fetchone()[0]
+
+    completed: int = sum(stats.dialogs.values())
+    print('пользователей: {users}, диалогов: {dialogs} ({by_dialog}) за {sec:.1f} с, перезапусков: {restarts} '
+          '({how})'.format(users=args.users, dialogs=completed, by_dialog=dict(stats.dialogs), sec=elapsed,
+                           restarts=workers.restarts, how='SIGKILL' if args.kill else 'SIGINT'))
+    print('пропускная способность: {dialogs:.1f} диалогов/с, {updates:.1f} обновлений/с'.format(
+        dialogs=completed / elapsed, updates=stats.updates / elapsed))
+    print('ответ на шаг диалога:      {pct}'.format(pct=percentiles(stats.steps)))
+    print('поиск до последнего отеля: {pct}'.format(pct=percentiles(stats.last_hotel)))
+    print('обновлений в очереди после остановки: {queued}'.format(queued=queued))
+    if args.mode == 'webhook':
+        print('повторных доставок на webhook: {retries}'.format(retries=telegram.webhook_retries))
+    if stats.errors:
+        print('незавершенные диалоги: {errors}'.format(errors=dict(stats.errors)))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--worker']:
+        run_worker()
+        raise SystemExit
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help='процессов бота')
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default='polling',
+                        help='получение обновлений процессом 0')
+    parser.add_argument('--users', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=80, help='пользователей в диалоге одновременно')
+    parser.add_argument('--dialogs', default=','.join(DIALOGS), help='диалоги каждого пользователя по порядку')
+    parser.add_argument('--restart-every', type=float, default=5, help='интервал перезапуска процессов (0 - без них)')
+    parser.add_argument('--restart-delay', type=float, default=1, help='пауза между остановкой и запуском (сек)')
+    parser.add_argument('--kill', action='store_true', help='останавливать процессы SIGKILL вместо SIGINT')
+    parser.add_argument('--startup', type=float, default=3, help='ожидание запуска процессов (сек)')
+    parser.add_argument('--hotels', type=int, default=3, help='количество отелей в поиске')
+    parser.add_argument('--photos', type=int, default=2, help='количество фотографий (0 - без фотографий)')
+    parser.add_argument('--city', default='Нью-Йорк')
+    parser.add_argument('--prices', default='1500 30000', help='диапазон цен /bestdeal')
+    parser.add_argument('--distances', default='1 5', help='диапазон расстояний /bestdeal')
+    parser.add_argument('--fixtures', default=os.path.join(BENCH, 'fixtures'),
+                        help='каталог записанных ответов RapidAPI ("" - только сформированные заглушкой)')
+    parser.add_argument('--api-latency', type=float, default=0.1, help='задержка RapidAPI (сек)')
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help='задержка Telegram (сек)')
+    parser.add_argument('--telegram-limits', action='store_true', help='оставить лимиты отправки из settings.py')
+    parser.add_argument('--timeout', type=float, default=30, help='ожидание ответа на шаг диалога (сек)')
+    parser.add_argument('--search-timeout', type=float, default=120, help='ожидание отелей одного поиска (сек)')
+    parser.add_argument('--first-user-id', type=int, default=100000)
+    run(parser.parse_args())
@@ -0,0 +1,200 @@
+"""
+Локальная заглушка RapidAPI (hotels4) для бенчмарков.
+
+Отдает ответы /locations/v2/search, /properties/list и /properties/get-hotel-photos
+в формате настоящего API, с настраиваемой задержкой и долей ошибок.
+Если переданы записанные ответы (load_recorded), отдает их, а недостающие формирует сам.
+Считает количество принятых TCP-соединений и запросов по каждому методу.
+"""
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+def city_payload(query: str) -> dict:
+    """ Ответ /locations/v2/search. """
+
+    return {'suggestions': [{'group': 'CITY_GROUP', 'entities': [
+        {'destinationId': '1506246', 'type': 'CITY',
+         'caption': "<span class='highlighted'>{query}</span>, США".format(query=query)},
+        {'destinationId': '1633379', 'type': 'CITY',
+         'caption': "<span class='highlighted'>{query}</span>-Миллс, США".format(query=query)},
+    ]}]}
+
+
+HOTELS_POOL = 600
+
+
+def hotel_distance(number: int) -> float:
+    """ Расстояние отеля номер number до центра (км). """
+
+    return round(0.3 + (number * 0.37) % 12, 1)
+
+
+def hotels_payload(page: int, page_size: int, sort_order: str) -> dict:
+    """
+    Ответ /properties/list: страница отелей с ценами и расстояниями до центра.
+    DISTANCE_FROM_LANDMARK - те же отели, упорядоченные по расстоянию до центра.
+    """
+
+    numbers = range((page - 1) * page_size, page * page_size)
+    if sort_order == 'DISTANCE_FROM_LANDMARK':
+        numbers = sorted(range(HOTELS_POOL), key=lambda i_number: (hotel_distance(i_number), i_number))[
+            (page - 1) * page_size:page * page_size]
+
+    results = list()
+    for number in numbers:
+        price: int = 1000 + number * 150
+        if sort_order == 'PRICE_HIGHEST_FIRST':
+            price = 100000 - number * 150
+        distance: str = str(hotel_distance(number)).replace('.', ',')
+        results.append({
+            'id': 100000 + number,
+            'name': 'Hotel {number}'.format(number=number),
+            'address': {'streetAddress': '{number} Main street'.format(number=number)},
+            'landmarks': [{'label': 'Центр города', 'distance': '{dist} км'.format(dist=distance)}],
+            'ratePlan': {'price': {'current': '{price:,d} RUB'.format(price=price).replace(',', ' '),
+                                   'exactCurrent': float(price)}},
+        })
+
+    return {'result': 'OK', 'data': {'body': {'searchResults': {'results': results}}}}
+
+
+def photos_payload(hotel_id: str) -> dict:
+    """ Ответ /properties/get-hotel-photos. """
+
+    return {'hotelId': int(hotel_id), 'hotelImages': [
+        {'baseUrl': 'https://exp.cdn-hotels.com/hotels/{hotel}/{photo}_{{size}}.jpg'.format(hotel=hotel_id, photo=i)}
+        for i in range(10)
+    ]}
+
+
+RECORDED_FILES = {'/locations/v2/search': 'locations_search.json',
+                  '/properties/list': 'properties_list_bestdeal.json',
+                  '/properties/get-hotel-photos': 'hotel_photos.json'}
+
+
+def load_recorded(directory: str) -> Dict[str, Any]:
+    """
+    Записанные ответы API из каталога directory (файлы RECORDED_FILES), отсутствующие файлы пропускаются.
+    /properties/list записан страницами по sortOrder: {'page_size': 25, 'sort_orders': {'PRICE': {'1': ...}}}.
+    """
+
+    recorded: Dict[str, Any] = dict()
+    for path, filename in RECORDED_FILES.items():
+        filename = os.path.join(directory, filename)
+        if os.path.exists(filename):
+            with open(filename, encoding='utf-8') as file:
+                recorded[path] = json.load(file)
+
+    return recorded
+
+
+def recorded_hotels(recorded: dict, page: int, page_size: int, sort_order: str) -> Optional[dict]:
+    """
+    Страница /properties/list размера page_size из записанных страниц: записанные отели склеиваются
+    и нарезаются заново. Если записанных отелей не хватает на страницу, возвращает None.
+    """
+
+    pages: Dict[str, dict] = recorded['sort_orders'].get(sort_order, dict())
+    hotels: List[dict] = list()
+    for number in sorted(pages, key=int):
+        hotels.extend(pages[number]['data']['body']['searchResults']['results'])
+    start: int = (page - 1) * page_size
+    if start + page_size > len(hotels):
+        return None
+
+    return {'result': 'OK', 'data': {'body': {'searchResults': {'results': hotels[start:start + page_size]}}}}
+
+
+class RapidApiStub:
+    """ Заглушка RapidAPI в отдельном потоке. """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, port: int = 0,
+                 recorded: Optional[Dict[str, Any]] = None) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.recorded = recorded or dict()
+        self.connections = 0
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{port}'.format(port=self._server.server_address[1])
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # заголовки и тело пишутся отдельно: без TCP_NODELAY keep-alive запрос ждет отложенный ACK (~40 мс)
+            disable_nagle_algorithm = True
+
+            def setup(self) -> None:
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                parsed = urlparse(self.path)
+                params: Dict[str, str] = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                with stub._lock:
+                    stub.calls[parsed.path] += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                status, body = stub.respond(parsed.path, params)
+                data: bytes = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def respond(self, path: str, params: Dict[str, str]) -> Tuple[int, dict]:
+        """ Формирует ответ по пути метода API. """
+
+        if self.error_rate and random.random() < self.error_rate:
+            return 503, {'message': 'Service Unavailable'}
+        recorded: Optional[dict] = self.recorded.get(path)
+        if path == '/locations/v2/search':
+            return 200, recorded or city_payload(params.get('query', ''))
+        if path == '/properties/list':
+            page, page_size = int(params.get('pageNumber', 1)), int(params.get('pageSize', 25))
+            sort_order: str = params.get('sortOrder', 'PRICE')
+            payload: Optional[dict] = recorded and recorded_hotels(recorded, page, page_size, sort_order)
+            return 200, payload or hotels_payload(page, page_size, sort_order)
+        if path == '/properties/get-hotel-photos':
+            if recorded:
+                return 200, dict(recorded, hotelId=int(params.get('id', '0')))
+            return 200, photos_payload(params.get('id', '0'))
+        return 404, {'message': 'Not Found'}
+
+    def start(self) -> 'RapidApiStub':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.connections = 0
+            self.calls.clear()
@@ -0,0 +1,323 @@
+"""
+Локальная заглушка Telegram Bot API для бенчмарков.
+
+Принимает запросы telebot по адресу /bot<token>/<method> (telebot.apihelper.API_URL):
+getUpdates отдает обновления, добавленные put_update (long polling), а после setWebhook обновления
+отправляются POST-запросами на адрес webhook с секретным токеном и повторяются, пока бот не ответит 200,
+sendMessage, sendMediaGroup, sendSticker и editMessageText отвечают сообщениями, как Telegram,
+и записываются по чатам - бенчмарк ждет ответы бота через wait(). Остальные методы отвечают True.
+Задержка ответа и доля ответов 429 (Too Many Requests) настраиваются.
+"""
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import queue
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'MyHotelBot', 'username': 'my_hotel_bot'}
+SEND_METHODS = ('sendMessage', 'sendMediaGroup', 'sendSticker', 'sendPhoto', 'editMessageText')
+JSON_PARAMS = ('reply_markup', 'media')
+
+
+class Sent:
+    """ Вызов метода отправки: время получения (perf_counter), метод, параметры и сообщение из ответа. """
+
+    __slots__ = ('time', 'method', 'params', 'message')
+
+    def __init__(self, method: str, params: Dict[str, Any], message: dict) -> None:
+        self.time = time.perf_counter()
+        self.method = method
+        self.params = params
+        self.message = message
+
+    @property
+    def text(self) -> str:
+        return self.params.get('text', '')
+
+    def buttons(self) -> List[dict]:
+        """ Кнопки клавиатуры сообщения (обычной или инлайновой) по порядку. """
+
+        markup: dict = self.params.get('reply_markup') or dict()
+        rows: List[list] = markup.get('inline_keyboard') or markup.get('keyboard') or list()
+
+        return [button if isinstance(button, dict) else {'text': button} for row in rows for button in row]
+
+
+class _Chat:
+    """ Сообщения бота в одном чате. """
+
+    def __init__(self) -> None:
+        self.condition = threading.Condition()
+        self.sent: List[Sent] = list()
+
+
+class TelegramStub:
+    """ Заглушка Telegram Bot API в отдельном потоке. """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, port: int = 0,
+                 poll_wait: float = 1.0, webhook_connections: int = 8, webhook_retry: float = 0.2) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.poll_wait = poll_wait
+        self.webhook_connections = webhook_connections
+        self.webhook_retry = webhook_retry
+        self.calls: Counter = Counter()
+        self.polling = threading.Event()
+        self.webhook_set = threading.Event()
+        self.webhook_retries: int = 0
+        self._webhook: Optional[Tuple[str, str]] = None
+        self._deliveries: 'queue.Queue[Optional[dict]]' = queue.Queue()
+        self._delivery_threads: List[threading.Thread] = list()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._chats: Dict[int, _Chat] = dict()
+        self._updates: List[dict] = list()
+        self._updates_ready = threading.Condition()
+        self._stopped = False
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{port}'.format(port=self._server.server_address[1])
+
+    @property
+    def api_url(self) -> str:
+        """ Шаблон адреса для telebot.apihelper.API_URL. """
+
+        return self.url + '/bot{0}/{1}'
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # заголовки и тело пишутся отдельно: без TCP_NODELAY keep-alive запрос ждет отложенный ACK (~40 мс)
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def handle(self) -> None:
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    # процесс бота остановлен во время long polling
+                    pass
+
+            def do_GET(self) -> None:
+                self.do_POST()
+
+            def do_POST(self) -> None:
+                parsed = urlparse(self.path)
+                params: Dict[str, Any] = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                length: int = int(self.headers.get('Content-Length') or 0)
+                body: bytes = self.rfile.read(length) if length else b''
+                content_type: str = self.headers.get('Content-Type', '')
+                if body and content_type.startswith('application/json'):
+                    params.update(json.loads(body))
+                elif body and content_type.startswith('application/x-www-form-urlencoded'):
+                    params.update({k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()})
+
+                status, result = stub.respond(parsed.path.rsplit('/', 1)[-1], params)
+                data: bytes = json.dumps(result, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def _chat(self, chat_id: int) -> _Chat:
+        with self._lock:
+            return self._chats.setdefault(chat_id, _Chat())
+
+    def _message(self, chat_id: int, message_id: Optional[int] = None, **fields: Any) -> dict:
+        message: dict = {'message_id': message_id or next(self._ids), 'date': int(time.time()), 'from': BOT_USER,
+                         'chat': {'id': chat_id, 'type': 'private'}}
+        message.update(fields)
+
+        return message
+
+    def respond(self, method: str, params: Dict[str, Any]) -> Tuple[int, dict]:
+        """ Формирует ответ метода Bot API. """
+
+        with self._lock:
+            self.calls[method] += 1
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': self._get_updates(params)}
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': BOT_USER}
+        if method == 'setWebhook':
+            self._set_webhook(params.get('url') or None, params.get('secret_token', ''))
+            return 200, {'ok': True, 'result': True}
+        if method == 'deleteWebhook':
+            self._set_webhook(None, '')
+            return 200, {'ok': True, 'result': True}
+        if method not in SEND_METHODS:
+            return 200, {'ok': True, 'result': True}
+
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return 429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                         'parameters': {'retry_after': 1}}
+
+        for name in JSON_PARAMS:
+            if isinstance(params.get(name), str):
+                params[name] = json.loads(params[name])
+        chat_id: int = int(params['chat_id'])
+        if method == 'sendMediaGroup':
+            result: Any = [self._message(chat_id) for _ in params.get('media', ())]
+            message: dict = result[0] if result else self._message(chat_id)
+        elif method == 'editMessageText':
+            result = message = self._message(chat_id, int(params['message_id']), text=params.get('text', ''))
+        elif method == 'sendMessage':
+            result = message = self._message(chat_id, text=params.get('text', ''))
+        else:
+            result = message = self._message(chat_id)
+
+        chat: _Chat = self._chat(chat_id)
+        with chat.condition:
+            chat.sent.append(Sent(method, params, message))
+            chat.condition.notify_all()
+
+        return 200, {'ok': True, 'result': result}
+
+    def _get_updates(self, params: Dict[str, Any]) -> List[dict]:
+        """ Отдает неподтвержденные обновления (update_id >= offset), ожидая их не дольше poll_wait. """
+
+        self.polling.set()
+        offset: int = int(params.get('offset') or 0)
+        limit: int = int(params.get('limit') or 100)
+        timeout: float = min(float(params.get('timeout') or 0), self.poll_wait)
+        with self._updates_ready:
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            self._updates_ready.wait_for(lambda: self._updates or self._stopped, timeout=timeout)
+
+            return self._updates[:limit]
+
+    def _set_webhook(self, url: Optional[str], secret: str) -> None:
+        """ Включает доставку обновлений на webhook url (None - обратно getUpdates). """
+
+        with self._lock:
+            self._webhook = (url, secret) if url else None
+            if url and not self._delivery_threads:
+                for num in range(self.webhook_connections):
+                    thread = threading.Thread(target=self._deliver, name='webhook-{num}'.format(num=num), daemon=True)
+                    thread.start()
+                    self._delivery_threads.append(thread)
+        if url:
+            self.webhook_set.set()
+        else:
+            self.webhook_set.clear()
+
+    def _deliver(self) -> None:
+        """ Отправляет обновления на webhook, повторяя доставку, пока бот не ответит 200 (как Telegram). """
+
+        session = requests.Session()
+        while True:
+            update: Optional[dict] = self._deliveries.get()
+            if update is None:
+                break
+            while not self._stopped:
+                with self._lock:
+                    webhook: Optional[Tuple[str, str]] = self._webhook
+                try:
+                    response = session.post(webhook[0], json=update, timeout=10,
+                                            headers={'X-Telegram-Bot-Api-Secret-Token': webhook[1]})
+                    if response.status_code == 200:
+                        break
+                except requests.RequestException:
+                    # процесс бота перезапускается
+                    session = requests.Session()
+                with self._lock:
+                    self.webhook_retries += 1
+                time.sleep(self.webhook_retry)
+
+    def put_update(self, update: dict) -> int:
+        """ Добавляет обновление для getUpdates или доставки на webhook и возвращает его update_id. """
+
+        with self._updates_ready:
+            update['update_id'] = next(self._ids)
+            if self._webhook is not None:
+                self._deliveries.put(update)
+            else:
+                self._updates.append(update)
+                self._updates_ready.notify_all()
+
+        return update['update_id']
+
+    @staticmethod
+    def user(user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': 'User', 'last_name': str(user_id),
+                'username': 'user{id}'.format(id=user_id), 'language_code': 'ru'}
+
+    def message_update(self, user_id: int, text: str) -> dict:
+        """ Обновление с текстовым сообщением пользователя user_id (команды - с entities, как у Telegram). """
+
+        message: dict = {'message_id': next(self._ids), 'date': int(time.time()), 'from': self.user(user_id),
+                         'chat': {'id': user_id, 'type': 'private', 'first_name': 'User'}, 'text': text}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+
+        return {'message': message}
+
+    def callback_update(self, user_id: int, data: str, message: dict) -> dict:
+        """ Обновление с нажатием инлайновой кнопки с callback_data data под сообщением бота message. """
+
+        return {'callback_query': {'id': str(next(self._ids)), 'from': self.user(user_id),
+                                   'chat_instance': str(user_id), 'data': data, 'message': message}}
+
+    def position(self, chat_id: int) -> int:
+        """ Количество сообщений бота в чате: ответы на следующий шаг будут после этой позиции. """
+
+        chat: _Chat = self._chat(chat_id)
+        with chat.condition:
+            return len(chat.sent)
+
+    def wait(self, chat_id: int, start: int, predicate: Callable[[Sent], bool],
+             timeout: float) -> Optional[Tuple[int, Sent]]:
+        """
+        Ждет первое сообщение бота в чате, начиная с позиции start, для которого predicate истинно.
+        Возвращает позицию и сообщение или None, если за timeout секунд его не было.
+        """
+
+        chat: _Chat = self._chat(chat_id)
+        deadline: float = time.monotonic() + timeout
+        index: int = start
+        with chat.condition:
+            while True:
+                while index < len(chat.sent):
+                    if predicate(chat.sent[index]):
+                        return index, chat.sent[index]
+                    index += 1
+                remaining: float = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                chat.condition.wait(remaining)
+
+    def start(self) -> 'TelegramStub':
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        with self._updates_ready:
+            self._stopped = True
+            self._updates_ready.notify_all()
+        for _ in self._delivery_threads:
+            self._deliveries.put(None)
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls.clear()
@@ -0,0 +1,294 @@
+"""
+Асинхронный режим бота на AsyncTeleBot: те же команды и шаги диалога, что и в main.py (botrequests.dialog),
+но обработчики - корутины. Шаги диалога с обращениями к БД выполняются в отдельном пуле потоков
+(botrequests.async_db), а все запросы к RapidAPI (города, страницы отелей, фотографии) - через aiohttp
+(botrequests.async_api), поэтому медленный API не занимает потоки БД.
+Запуск: python async_main.py (синхронный режим по-прежнему запускается через main.py).
+"""
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
+
+from decouple import config
+from telebot import types
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_handler_backends import BaseMiddleware
+from telegram_bot_calendar import DetailedTelegramCalendar
+
+import botrequests
+from body.botrequests.async_api import close_async_session, get_cities_async, stream_hotels_async
+from body.botrequests.async_db import run_db
+from settings import (dialog_flush_interval, send_chat_rate, send_chat_burst, send_global_rate, send_global_burst,
+                      send_retries, metrics_enabled, admin_ids, profile_seconds, profile_max_seconds, bot_workers)
+
+botrequests.setup_logging()
+botrequests.setup_tracing()
+log = logging.getLogger(__name__)
+
+token_bot = config('telegram_bot_token')
+bot = AsyncTeleBot(token_bot)
+
+# следующий шаг диалога чата - имя шага общего диалога (botrequests.dialog_step)
+_next_steps: Dict[int, str] = dict()
+_chat_buckets: Dict[int, botrequests.TokenBucket] = dict()
+_global_bucket = botrequests.TokenBucket(send_global_rate, send_global_burst)
+# обработчики выполняются в цикле событий главного потока, шаги диалога и запросы к БД - в потоках "db",
+# фоновое обновление кэша фотографий - в потоках "photos"
+_profile_threads = ('MainThread', 'db', 'photos')
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """
+    Добавляет к записям журнала обработчика user_id и команду сообщения, замеряет время обработчика
+    и ведет трассу обновления. Каждое обновление обрабатывается в своей задаче asyncio,
+    поэтому контекст не смешивается между обновлениями.
+    """
+
+    def __init__(self) -> None:
+        self.update_types = ['message', 'callback_query']
+
+    async def pre_process(self, message: Union[types.Message, types.CallbackQuery], data: dict) -> None:
+        text: str = getattr(message, 'text', None) or ''
+        command: Optional[str] = text.split()[0][1:].split('@')[0] if text.startswith('/') else None
+        botrequests.update_log_context(user_id=message.from_user.id, command=command)
+        data['started'] = time.perf_counter()
+        data['trace'] = botrequests.begin_trace('update ' + self._kind(message))
+
+    async def post_process(self, message: Union[types.Message, types.CallbackQuery], data: dict,
+                           exception: Optional[BaseException]) -> None:
+        botrequests.handler_seconds.observe(time.perf_counter() - data['started'], self._kind(message))
+        if exception is not None:
+            botrequests.errors_total.inc('handler', type(exception).__name__)
+        botrequests.end_trace(data['trace'], exception)
+
+    @staticmethod
+    def _kind(message: Union[types.Message, types.CallbackQuery]) -> str:
+        return 'callback_query' if isinstance(message, types.CallbackQuery) else 'message'
+
+
+bot.setup_middleware(LogContextMiddleware())
+
+
+async def send_limited(method: str, chat_id: int, *args, cost: float = 1, **kwargs):
+    """
+    Функция, которая вызывает метод отправки бота с учетом лимитов Telegram (корзины токенов чата и бота)
+    и повторяет отправку через retry_after секунд при ответе 429.
+    :param method: имя метода бота
+    :param chat_id: id чата
+    :param cost: сколько токенов расходует отправка (альбом - по одному на фотографию)
+    """
+
+    bucket: Optional[botrequests.TokenBucket] = _chat_buckets.get(chat_id)
+    if bucket is None:
+        if len(_chat_buckets) >= 10000:
+            for i_chat in [i_chat for i_chat, i_bucket in _chat_buckets.items() if i_bucket.full()]:
+                del _chat_buckets[i_chat]
+        bucket = _chat_buckets[chat_id] = botrequests.TokenBucket(send_chat_rate, send_chat_burst)
+
+    for attempt in range(send_retries + 1):
+        await asyncio.sleep(max(bucket.reserve(cost), _global_bucket.reserve(cost)))
+        try:
+            with botrequests.timer(botrequests.send_seconds, method):
+                return await getattr(bot, method)(chat_id, *args, **kwargs)
+        except Exception as error:
+            delay: Optional[int] = botrequests.retry_after(error)
+            if delay is None or attempt == send_retries:
+                botrequests.errors_total.inc('telegram', type(error).__name__)
+                raise
+            log.warning('Ответ 429 для чата {chat_id}, повтор через {delay} сек'.format(chat_id=chat_id, delay=delay))
+            await asyncio.sleep(delay)
+
+
+async def lookup_cities(message: types.Message) -> Dict[str, Any]:
+    """ Функция, которая ищет города по ответу пользователя для шага get_cities. """
+
+    return {'cities_dct': await get_cities_async(message.text, message.from_user.id)}
+
+
+# шаги диалога, которым нужен ответ RapidAPI: запрос выполняется через aiohttp до шага,
+# а шаг в потоке БД получает готовый результат (botrequests.dialog_step, аргумент lookup)
+_lookups: Dict[str, Callable[[types.Message], Awaitable[Dict[str, Any]]]] = {'get_cities': lookup_cities}
+
+
+@bot.message_handler(func=lambda msg: msg.chat.id in _next_steps, content_types=['text'])
+async def next_step(message: types.Message) -> None:
+    """ Функция, которая передает сообщение назначенному шагу общего диалога (botrequests.dialog_step). """
+
+    step: str = _next_steps.pop(message.chat.id)
+    lookup: Dict[str, Any] = dict()
+    if step in _lookups and message.text != '/restart':
+        lookup = await _lookups[step](message)
+    await reply(message.from_user.id, await run_db(botrequests.dialog_step, step, message, **lookup))
+
+
+@bot.message_handler(commands=['hello_world', 'start'])
+@bot.message_handler(func=lambda msg: msg.text.lower() == 'привет')
+async def send_welcome(message: types.Message) -> None:
+    """Функция - приветствие. Отправляет пользователю описание команд Бота. """
+
+    log.info('user_id: {user_id}'.format(user_id=message.from_user.id))
+    await reply(message.from_user.id, botrequests.welcome())
+
+
+@bot.message_handler(commands=['restart'])
+async def restart(message: types.Message) -> None:
+    """ Функция, которая отлавливает команду restart и переправляет пользователя в функцию send_welcome """
+
+    _next_steps.pop(message.chat.id, None)
+    await reply(message.from_user.id, botrequests.restart(message.from_user.id))
+
+
+@bot.message_handler(commands=['lowprice', 'highprice', 'bestdeal'])
+async def command_search(message: types.Message) -> None:
+    """ Функция, которая выполняет команды "lowprice", "highprice" и "bestdeal" (botrequests.start_command). """
+
+    command: str = message.text.split()[0][1:].split('@')[0]
+    await reply(message.from_user.id, await run_db(botrequests.start_command, message.from_user, command))
+
+
+@bot.message_handler(commands=['history'])
+async def command_history(message: types.Message) -> None:
+    """ Функция, которая выполняет команду "history". """
+
+    await reply(message.from_user.id, await run_db(botrequests.start_command, message.from_user, None))
+
+
+@bot.message_handler(commands=['profile'], func=lambda msg: msg.from_user.id in admin_ids)
+async def command_profile(message: types.Message) -> None:
+    """
+    Функция, которая выполняет команду администратора "profile [сек]" (только для admin_ids):
+    профилирует цикл событий и потоки БД в фоне и отправляет администратору самые горячие функции.
+    """
+
+    args: List[str] = message.text.split()[1:]
+    seconds: int = min(int(args[0]), profile_max_seconds) if args and args[0].isdigit() else profile_seconds
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    started: bool = botrequests.start_profile(
+        seconds, lambda result: asyncio.run_coroutine_threadsafe(
+            send_limited('send_message', message.from_user.id, result.report()), loop),
+        _profile_threads)
+    if started:
+        await send_limited('send_message', message.from_user.id,
+                           'Профилирование запущено на {sec} сек'.format(sec=seconds))
+    else:
+        await send_limited('send_message', message.from_user.id, 'Профилирование уже выполняется, дождитесь отчета')
+
+
+@bot.callback_query_handler(func=DetailedTelegramCalendar.func())
+async def callback_date(cal: types.CallbackQuery) -> None:
+    """ Функция, получает даты заезда и выезда и после выбора обеих запрашивает количество отелей. """
+
+    await reply(cal.message.chat.id, await run_db(botrequests.calendar_step, cal.message.chat.id,
+                                                  cal.message.message_id, cal.data))
+
+
+@bot.callback_query_handler(func=lambda call: True)
+async def callback_inline(call: types.CallbackQuery) -> None:
+    """ Функция, которая повторяет запрос из истории (сохраненный результат или новый поиск). """
+
+    await reply(call.message.chat.id, await run_db(botrequests.history_step, call.message.chat.id, call.data))
+
+
+@bot.message_handler(content_types=['text'])
+async def bot_help(message: types.Message) -> None:
+    await reply(message.from_user.id, botrequests.bot_help())
+
+
+async def reply(chat_id: int, answer: botrequests.Reply) -> None:
+    """
+    Функция, которая отправляет пользователю ответ общего диалога (botrequests.Reply), как reply в main.py:
+    исправляет календарь, отправляет сообщения, назначает следующий шаг и отправляет отели поиска.
+    :param chat_id: id чата
+    :param answer: ответ
+    """
+
+    # шаг назначается до отправки: обновления обрабатываются в отдельных задачах, и ответ пользователя
+    # на доставленный вопрос может прийти раньше, чем завершится отправка остальных сообщений
+    if answer.next_step:
+        _next_steps[chat_id] = answer.next_step
+    if answer.edit is not None:
+        text, message_id, markup = answer.edit
+        await bot.edit_message_text(text, chat_id, message_id, reply_markup=markup)
+    for method, args, kwargs in answer.messages:
+        await send_limited(method, chat_id, *args, **kwargs)
+    if answer.request_id is not None:
+        await output(chat_id, answer)
+
+
+async def stored_hotels(hotels_dct: Dict[int, dict]) -> AsyncIterator[botrequests.HotelItem]:
+    for item in hotels_dct.items():
+        yield item
+
+
+async def output(user_id: int, answer: botrequests.Reply) -> None:
+    """
+    Функция, которая отправляет пользователю отели ответа: сохраненный результат (answer.hotels)
+    или поиск через API по запросу answer.request_id, каждый отель - как только он готов.
+    """
+
+    botrequests.update_log_context(request_id=answer.request_id)
+    started: float = time.monotonic()
+    if answer.hotels is not None:
+        hotels_stream: AsyncIterator[botrequests.HotelItem] = stored_hotels(answer.hotels)
+    else:
+        hotels_stream: AsyncIterator[botrequests.HotelItem] = stream_hotels_async(user_id, answer.request_id)
+
+    num_sent: int = 0
+    try:
+        async for item in hotels_stream:
+            if type(item) is str:
+                await send_limited('send_message', user_id, item)
+                continue
+
+            hotel_id, hotel = item
+            for method, args, kwargs in botrequests.hotel_messages(hotel):
+                await send_limited(method, user_id, *args, **kwargs)
+
+            num_sent += 1
+            if num_sent == 1:
+                botrequests.search_seconds.observe(time.monotonic() - started, 'first_hotel')
+                log.info('Первый отель отправлен через {sec:.2f} сек. user_id: {user_id}'.format(
+                    sec=time.monotonic() - started, user_id=user_id))
+
+        botrequests.search_seconds.observe(time.monotonic() - started, 'total')
+        log.info('Запрос отправлен пользователю за {sec:.2f} сек. user_id: {user_id}'.format(
+            sec=time.monotonic() - started, user_id=user_id))
+    except Exception as err:
+        log.error('Имя ошибки: {}'.format(err))
+        await send_limited('send_message', user_id, 'Неполадки с телеграмом')
+        await send_limited('send_message', user_id, 'Вы можете повторить свой запрос из истории')
+
+
+async def main() -> None:
+    if dialog_flush_interval:
+        botrequests.start_flusher(botrequests.flush_dialogs, dialog_flush_interval)
+    botrequests.start_cache_purger()
+    metrics_server: Optional[botrequests.MetricsServer] = None
+    if metrics_enabled:
+        botrequests.register_gauge('hotelbot_log_dropped', 'Отброшенные записи журнала',
+                                   lambda: botrequests.log_stats()['dropped'])
+        metrics_server = botrequests.MetricsServer().start()
+    try:
+        await bot.infinity_polling()
+    finally:
+        await close_async_session()
+        if metrics_server is not None:
+            metrics_server.stop()
+
+
+if __name__ == '__main__':
+    # шаги диалога хранятся в памяти цикла событий, общая очередь обновлений есть только у main.py
+    if bot_workers > 1:
+        raise SystemExit('Несколько процессов бота (bot_workers > 1) поддерживает только main.py')
+    if botrequests.migrate():
+        raise SystemExit('Не удалось подготовить БД, подробности в логе')
+
+    botrequests.profile_on_signal(threads=_profile_threads)
+    asyncio.run(main())
+
+    log.info('Кэш фотографий: {stats}'.format(stats=botrequests.photo_cache_stats()))
+    botrequests.flush_dialogs()
+    botrequests.close_connections()
+    botrequests.stop_tracing()
+    botrequests.stop_logging()
@@ -1,5 +1,23 @@
-from body.botrequests.bestdeal import *
+from body.botrequests.api_client import *
+from body.botrequests.cache import *
+from body.botrequests.connection import *
 from body.botrequests.db_functions import *
-from body.botrequests.highprice import *
+from body.botrequests.dialog import *
+from body.botrequests.dialog_state import *
+from body.botrequests.dispatcher import *
 from body.botrequests.history import *
-from body.botrequests.lowprice import *
+from body.botrequests.locations import *
+from body.botrequests.logs import *
+from body.botrequests.metrics import *
+from body.botrequests.migrations import *
+from body.botrequests.next_steps import *
+from body.botrequests.parsing import *
+from body.botrequests.photos import *
+from body.botrequests.profiler import *
+from body.botrequests.properties import *
+from body.botrequests.routing import *
+from body.botrequests.search import *
+from body.botrequests.sender import *
+from body.botrequests.stream import *
+from body.botrequests.tracing import *
+from body.botrequests.webhook import *
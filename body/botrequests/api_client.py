@@ -0,0 +1,71 @@
+import logging
+from typing import Dict, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from body.botrequests.metrics import api_seconds, errors_total, timer
+from body.botrequests.tracing import SPAN_CLIENT, span
+from settings import headers_request, api_base_url, api_timeout, api_pool_size, api_retries, api_backoff
+
+__all__ = ['get_json',
+           'get_session'
+           ]
+
+log = logging.getLogger(__name__)
+
+_session: Optional[requests.Session] = None
+
+
+def _create_session() -> requests.Session:
+    """
+    Функция, которая создает сессию requests с пулом keep-alive соединений к RapidAPI
+    и повторами с экспоненциальной задержкой для ответов 429 и 5xx.
+    """
+
+    retry = Retry(total=api_retries,
+                  backoff_factor=api_backoff,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(['GET']),
+                  respect_retry_after_header=True,
+                  raise_on_status=False
+                  )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=api_pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.headers.update(headers_request)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+def get_session() -> requests.Session:
+    """ Функция, которая возвращает общую для всех модулей сессию RapidAPI. """
+
+    global _session
+    if _session is None:
+        _session = _create_session()
+
+    return _session
+
+
+def get_json(path: str, params: Dict[str, Union[str, int, float]], timeout: float = api_timeout) -> dict:
+    """
+    Функция, которая выполняет GET-запрос к RapidAPI через общую сессию и возвращает разобранный JSON.
+    Исключения requests пробрасываются вызывающей функции.
+    Время запроса и ошибки учитываются в метриках, запрос - спан в трассе текущего обновления.
+    :param path: путь метода API, например "/locations/v2/search"
+    :param params: параметры запроса
+    :param timeout: таймаут запроса (сек)
+    """
+
+    try:
+        with timer(api_seconds, path), span('GET ' + path, SPAN_CLIENT) as current:
+            response = get_session().get(''.join((api_base_url, path)), params=params, timeout=timeout)
+            current.set('http.status_code', response.status_code)
+        return response.json()
+    except Exception as error:
+        errors_total.inc('api', type(error).__name__)
+        raise
@@ -0,0 +1,297 @@
+import asyncio
+import functools
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+import aiohttp
+from telebot import types
+
+from body.botrequests.async_db import run_db
+from body.botrequests.locations import location_cache, location_key, parse_cities
+from body.botrequests.logs import update_log_context
+from body.botrequests.metrics import api_seconds, errors_total, timer
+from body.botrequests.photos import cached_photo_urls, photo_cache, save_photo_urls
+from body.botrequests.properties import Hotel, parse_properties, search_cache, search_key
+from body.botrequests.search import Pager, SearchRequest, SearchStrategy, prepare_search
+from body.botrequests.stream import HotelItem
+from body.botrequests.tracing import SPAN_CLIENT, span
+from settings import (headers_request, api_base_url, api_timeout, api_pool_size, api_retries, api_backoff,
+                      photo_size, photo_deadline, search_prefetch)
+
+__all__ = ['get_json_async',
+           'get_cities_async',
+           'get_properties_async',
+           'pages_async',
+           'with_photos_async',
+           'stream_hotels_async',
+           'close_async_session'
+           ]
+
+log = logging.getLogger(__name__)
+
+_session: Optional[aiohttp.ClientSession] = None
+_flights: Dict[Hashable, asyncio.Task] = dict()
+
+api_errors = (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError, IndexError, TypeError)
+
+
+async def _get_session() -> aiohttp.ClientSession:
+    """ Функция, которая возвращает общую aiohttp-сессию с пулом keep-alive соединений к RapidAPI. """
+
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(headers=headers_request,
+                                         connector=aiohttp.TCPConnector(limit=api_pool_size),
+                                         timeout=aiohttp.ClientTimeout(total=api_timeout)
+                                         )
+
+    return _session
+
+
+async def close_async_session() -> None:
+    """ Функция, которая закрывает aiohttp-сессию при остановке бота. """
+
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+
+async def get_json_async(path: str, params: Dict[str, Union[str, int, float]]) -> dict:
+    """
+    Функция, которая выполняет GET-запрос к RapidAPI без блокировки цикла событий и возвращает JSON.
+    Повторяет запрос с экспоненциальной задержкой при ответах 429 и 5xx (учитывает Retry-After).
+    :param path: путь метода API
+    :param params: параметры запроса
+    """
+
+    session: aiohttp.ClientSession = await _get_session()
+    querystring: Dict[str, str] = {k: str(v) for k, v in params.items()}
+
+    try:
+        for attempt in range(api_retries + 1):
+            with timer(api_seconds, path), span('GET ' + path, SPAN_CLIENT, attempt=attempt) as current:
+                async with session.get(''.join((api_base_url, path)), params=querystring) as response:
+                    current.set('http.status_code', response.status)
+                    retry: bool = response.status in (429, 500, 502, 503, 504) and attempt < api_retries
+                    if not retry:
+                        return await response.json(content_type=None)
+            retry_after: Optional[str] = response.headers.get('Retry-After')
+            delay: float = float(retry_after) if retry_after and retry_after.isdigit() else api_backoff * 2 ** attempt
+            log.warning('Ответ {status} от {path}, повтор через {delay} сек'.format(
+                status=response.status, path=path, delay=delay))
+            await asyncio.sleep(delay)
+    except Exception as error:
+        errors_total.inc('api', type(error).__name__)
+        raise
+
+
+async def _single_flight(key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Функция, которая объединяет одновременные одинаковые запросы к API: первый вызов с ключом key запускает
+    fetch в отдельной задаче, остальные ждут ее результат. Отмена ожидающего (например, по deadline фотографий)
+    не отменяет общий запрос.
+    :param key: ключ запроса
+    :param fetch: функция, возвращающая корутину запроса
+    """
+
+    flight: Optional[asyncio.Task] = _flights.get(key)
+    if flight is None:
+        flight = _flights[key] = asyncio.ensure_future(fetch())
+        flight.add_done_callback(functools.partial(_landed, key))
+
+    return await asyncio.shield(flight)
+
+
+def _landed(key: Hashable, flight: asyncio.Task) -> None:
+    """ Убирает завершенный запрос из _flights и забирает его исключение: ожидающих могло не остаться. """
+
+    _flights.pop(key, None)
+    if not flight.cancelled():
+        flight.exception()
+
+
+async def _fetch_cities(cache_key: str, querystring: Dict[str, str]) -> Optional[Dict[str, str]]:
+    """ Функция, которая запрашивает города через aiohttp и сохраняет найденные в кэш городов. """
+
+    city_dct: Optional[Dict[str, str]] = parse_cities(await get_json_async("/locations/v2/search", querystring))
+    if city_dct is not None:
+        await run_db(location_cache.set, cache_key, city_dct)
+
+    return city_dct
+
+
+async def get_cities_async(city: str, user_id: int) -> Union[Dict[str, str], str]:
+    """
+    Асинхронный вариант get_cities_from_rapidapi: тот же кэш городов и те же ответы "Null" и "Error",
+    запрос к API - через aiohttp, чтобы медленный ответ не занимал поток БД (run_db).
+    :param city: искомый город
+    :param user_id: id пользователя
+    """
+
+    querystring_city = {"query": city, "locale": "ru_RU"}
+    cache_key: str = location_key(city, querystring_city['locale'])
+
+    try:
+        city_dct: Optional[Dict[str, str]] = location_cache.memory.get(cache_key)
+        if city_dct is None:
+            city_dct = await run_db(location_cache.get, cache_key)
+        if city_dct is None:
+            city_dct = await _single_flight(('locations', cache_key),
+                                            lambda: _fetch_cities(cache_key, querystring_city))
+        if city_dct is None:
+            return 'Null'
+
+        return city_dct
+
+    except api_errors as error:
+        log.error('Ошибка с получением города. user_id: {user_id}'.format(user_id=user_id), exc_info=error)
+
+        return 'Error'
+
+
+async def _fetch_properties(key: Tuple[Tuple[str, str], ...], querystring: Dict[str, Union[str, int, float]]
+                            ) -> List[Hotel]:
+    """ Функция, которая запрашивает страницу /properties/list через aiohttp и сохраняет ее в search_cache. """
+
+    hotels_lst: List[Hotel] = parse_properties(await get_json_async("/properties/list", querystring))
+    search_cache.set(key, hotels_lst)
+
+    return hotels_lst
+
+
+async def get_properties_async(querystring: Dict[str, Union[str, int, float]]) -> List[Hotel]:
+    """
+    Асинхронный вариант get_properties: тот же кэш search_cache, одновременные одинаковые запросы
+    объединяются в один запрос к API.
+    :param querystring: параметры запроса к API
+    """
+
+    key: Tuple[Tuple[str, str], ...] = search_key(querystring)
+    hotels_lst: List[Hotel] = search_cache.get(key)
+    if hotels_lst is not None:
+        return hotels_lst
+
+    return await _single_flight(('properties', key), lambda: _fetch_properties(key, querystring))
+
+
+async def pages_async(strategy: SearchStrategy, request: SearchRequest, prefetch: bool = search_prefetch
+                      ) -> AsyncIterator[Dict[int, dict]]:
+    """
+    Асинхронный вариант search._pages: тот же отбор отелей (search.Pager), страницы запрашиваются через aiohttp,
+    следующая страница - заранее (prefetch), пока отели текущей загружают фотографии и отправляются.
+    """
+
+    pager = Pager(strategy, request)
+    next_page: Optional[asyncio.Future] = None
+    while True:
+        if next_page is not None:
+            hotels_lst: List[Hotel] = await next_page
+        else:
+            hotels_lst: List[Hotel] = await get_properties_async(pager.querystring())
+        batch: Dict[int, dict] = pager.feed(hotels_lst)
+
+        if pager.finished:
+            yield batch
+            return
+
+        next_page = asyncio.ensure_future(get_properties_async(pager.querystring())) if prefetch else None
+        if batch:
+            yield batch
+
+
+async def _fetch_photo_urls(hotel_id: int) -> List[str]:
+    """ Функция, которая запрашивает адреса фотографий отеля через aiohttp и сохраняет их в кэш photos.py. """
+
+    response: dict = await get_json_async("/properties/get-hotel-photos", {"id": str(hotel_id)})
+
+    return await run_db(save_photo_urls, hotel_id, response)
+
+
+async def _photos_async(hotel_id: int, num_photos: Union[int, str]) -> List[types.InputMediaPhoto]:
+    """
+    Асинхронный вариант search.get_photos: адреса фотографий - из общего кэша photos.py (память, затем run_db),
+    при промахе - через aiohttp. Кэш, его фоновое обновление и статистика у обеих сред общие.
+    """
+
+    cached: Optional[dict] = photo_cache.memory.get(str(hotel_id))
+    if cached is None:
+        cached = await run_db(photo_cache.get, str(hotel_id))
+    if cached is not None:
+        urls_lst: List[str] = cached_photo_urls(hotel_id, cached)
+    else:
+        urls_lst: List[str] = await _single_flight(('photos', hotel_id), lambda: _fetch_photo_urls(hotel_id))
+
+    return [types.InputMediaPhoto(urls_lst[i_photo].format(size=photo_size)) for i_photo in range(int(num_photos))]
+
+
+async def with_photos_async(batches: AsyncIterator[Dict[int, dict]], num_photos: Union[int, str],
+                            deadline: float = photo_deadline) -> AsyncIterator[Tuple[int, dict]]:
+    """
+    Асинхронный вариант stream.with_photos: для каждой партии отелей сразу запускает загрузку фотографий
+    всех отелей и отдает отели по порядку, как только готовы фотографии очередного отеля.
+    Отели, фотографии которых не успели загрузиться за deadline секунд на весь поиск или с ошибкой,
+    отдаются без фотографий.
+    :param batches: партии отелей - словари id отеля: карточка отеля
+    :param num_photos: количество фотографий (0 - без фотографий)
+    :param deadline: ограничение времени на загрузку всех фотографий (сек)
+    """
+
+    loop = asyncio.get_running_loop()
+    started: float = loop.time()
+    async for batch in batches:
+        if not num_photos:
+            for item in batch.items():
+                yield item
+            continue
+
+        tasks: Dict[int, asyncio.Task] = {hotel_id: asyncio.ensure_future(_photos_async(hotel_id, num_photos))
+                                          for hotel_id in batch}
+        for hotel_id, hotel in batch.items():
+            try:
+                photo_lst: List[types.InputMediaPhoto] = \
+                    await asyncio.wait_for(tasks[hotel_id], max(0.0, started + deadline - loop.time()))
+                if photo_lst:
+                    hotel['photos'] = photo_lst
+            except asyncio.TimeoutError:
+                errors_total.inc('photos', 'TimeoutError')
+                log.warning('Фотографии отеля {hotel} не загружены за {deadline} сек'.format(hotel=hotel_id,
+                                                                                            deadline=deadline))
+            except Exception as error:
+                errors_total.inc('photos', type(error).__name__)
+                log.error('Ошибка с получением фотографий отеля {hotel}'.format(hotel=hotel_id), exc_info=error)
+
+            yield hotel_id, hotel
+
+
+async def stream_hotels_async(user_id: int, request_id: int) -> AsyncIterator[HotelItem]:
+    """
+    Асинхронный вариант search.stream_hotels: те же стратегии и ответы, параметры и результат - в БД (run_db),
+    страницы отелей и фотографии - через aiohttp без блокировки цикла событий.
+    :param user_id: id пользователя
+    :param request_id: id запроса
+    """
+
+    search: Optional[Tuple[SearchRequest, SearchStrategy]] = await run_db(prepare_search, user_id, request_id)
+    if search is None:
+        yield 'Техническая неполадка. Попробуйте еще раз!'
+        return
+
+    request, strategy = search
+    # run_db выполняет функцию в копии контекста, поэтому контекст журнала задачи обновляется здесь
+    update_log_context(request_id=request_id, command=request.command)
+    hotel_dct = dict()
+    try:
+        async for hotel_id, hotel in with_photos_async(pages_async(strategy, request), request.photos):
+            hotel_dct[hotel_id] = hotel
+            yield hotel_id, hotel
+
+        if not hotel_dct:
+            yield 'По вашему запросу ничего не найдено.'
+            return
+
+        await run_db('set_request', user_id, request_id, hotel_dct)
+
+    except api_errors as error:
+        errors_total.inc('search', type(error).__name__)
+        log.error('Ошибка с получением отелей. user_id: {user_id}'.format(user_id=user_id), exc_info=error)
+
+        yield 'Технические неполадки с сайтом, попробуйте еще раз.'
@@ -0,0 +1,32 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+import functools
+import logging
+from typing import Any, Callable, Union
+
+from body.botrequests import db_functions
+from settings import async_db_workers
+
+__all__ = ['run_db']
+
+log = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=async_db_workers, thread_name_prefix='db')
+
+
+async def run_db(func: Union[str, Callable[..., Any]], *args: Any, **kwargs: Any) -> Any:
+    """
+    Функция, которая выполняет функцию БД в отдельном пуле потоков, не блокируя цикл событий.
+    У каждого потока пула свое долгоживущее соединение (connection.get_connection),
+    поэтому размер пула ограничивает и количество соединений.
+    Функция выполняется с контекстом журнала вызывающей задачи.
+    :param func: функция или имя функции из db_functions
+    :param args: аргументы функции
+    """
+
+    if isinstance(func, str):
+        func = getattr(db_functions, func)
+
+    return await asyncio.get_running_loop().run_in_executor(_executor, functools.partial(copy_context().run, func,
+                                                                                           *args, **kwargs))
@@ -0,0 +1,283 @@
+from collections import OrderedDict
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import sqlite3
+
+from body.botrequests.connection import get_connection
+from settings import cache_purge_interval
+
+__all__ = ['TTLCache',
+           'SqliteCache',
+           'TieredCache',
+           'SingleFlight',
+           'purge_caches',
+           'start_cache_purger'
+           ]
+
+log = logging.getLogger(__name__)
+
+_missing = object()
+_persistent: List['SqliteCache'] = list()
+
+
+class TTLCache:
+    """
+    Потокобезопасный LRU-кэш в памяти с ограничением размера и временем жизни записей.
+    Ведет счетчики попаданий и промахов.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ Возвращает значение по ключу или default, если записи нет или она устарела. """
+
+        with self._lock:
+            item: Optional[tuple] = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """ Добавляет значение, вытесняя самые давно использованные записи при переполнении. """
+
+        expires: float = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        """ Возвращает счетчики кэша. """
+
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+
+class SqliteCache:
+    """
+    Постоянный кэш в таблице "api_cache" (переживает перезапуск бота).
+    Значения хранятся в JSON, записи разных кэшей разделены по namespace.
+    Устаревшие записи удаляются purge_caches() из фонового потока.
+    """
+
+    def __init__(self, namespace: str, ttl: float) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # экземпляр общий у потоков поиска и загрузки фотографий
+        self._stats_lock = threading.Lock()
+        _persistent.append(self)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """ Возвращает значение по ключу или default, если записи нет, она устарела или БД недоступна. """
+
+        entry: Optional[Tuple[Any, float]] = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, float]]:
+        """
+        Возвращает значение по ключу и время его устаревания (time.time()) или None,
+        если записи нет, она устарела или БД недоступна.
+        """
+
+        try:
+            row: Optional[tuple] = get_connection().execute(
+                "SELECT value, expires FROM api_cache WHERE namespace = ? AND key = ? AND expires > ?;",
+                (self.namespace, key, time.time())
+            ).fetchone()
+
+        except sqlite3.DatabaseError as error:
+            log.error('SqliteCache.get has not been successful', exc_info=error)
+            row = None
+
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return None if row is None else (json.loads(row[0]), row[1])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """ Сохраняет значение в БД. """
+
+        expires: float = time.time() + (self.ttl if ttl is None else ttl)
+        try:
+            get_connection().execute("INSERT OR REPLACE INTO api_cache (namespace, key, value, expires) "
+                                     "VALUES(?, ?, ?, ?);",
+                                     (self.namespace, key, json.dumps(value, ensure_ascii=False), expires)
+                                     )
+
+        except sqlite3.DatabaseError as error:
+            log.error('SqliteCache.set has not been successful', exc_info=error)
+
+    def purge(self) -> int:
+        """ Удаляет устаревшие записи и возвращает их количество. """
+
+        try:
+            cur = get_connection().execute("DELETE FROM api_cache WHERE namespace = ? AND expires <= ?;",
+                                           (self.namespace, time.time())
+                                           )
+
+        except sqlite3.DatabaseError as error:
+            log.error('SqliteCache.purge has not been successful', exc_info=error)
+            return 0
+
+        return cur.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        """ Возвращает счетчики кэша. """
+
+        with self._stats_lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+class TieredCache:
+    """
+    Двухуровневый кэш: LRU в памяти и (необязательно) постоянный кэш в SQLite.
+    Попадание в постоянный кэш поднимает запись в память на оставшееся время жизни записи,
+    но не дольше времени жизни кэша в памяти.
+    """
+
+    def __init__(self, memory: TTLCache, persistent: Optional[SqliteCache] = None) -> None:
+        self.memory = memory
+        self.persistent = persistent
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value: Any = self.memory.get(key, _missing)
+        if value is not _missing:
+            return value
+
+        if self.persistent is not None:
+            entry: Optional[Tuple[Any, float]] = self.persistent.get_entry(key)
+            if entry is not None:
+                value, expires = entry
+                self.memory.set(key, value, ttl=min(self.memory.ttl, expires - time.time()))
+                return value
+
+        return default
+
+    def set(self, key: str, value: Any) -> None:
+        self.memory.set(key, value)
+        if self.persistent is not None:
+            self.persistent.set(key, value)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """ Возвращает счетчики обоих уровней кэша. """
+
+        result: Dict[str, Dict[str, int]] = {'memory': self.memory.stats()}
+        if self.persistent is not None:
+            result['persistent'] = self.persistent.stats()
+        return result
+
+
+def purge_caches() -> int:
+    """
+    Функция, которая удаляет устаревшие записи всех постоянных кэшей из таблицы "api_cache"
+    и возвращает количество удаленных записей. Без нее таблица растет без ограничений:
+    ключи - произвольные запросы городов и id отелей.
+    """
+
+    removed: int = sum(cache.purge() for cache in _persistent)
+    if removed:
+        log.info('Удалено устаревших записей кэша: {num}'.format(num=removed))
+
+    return removed
+
+
+def start_cache_purger(interval: float = cache_purge_interval, stop: Optional[threading.Event] = None
+                       ) -> threading.Thread:
+    """
+    Функция, которая запускает фоновый поток, раз в interval секунд удаляющий устаревшие записи
+    постоянных кэшей (purge_caches). Поток не зависит от сохранения диалогов (dialog_flush_interval).
+    :param interval: интервал в секундах
+    :param stop: событие остановки (необязательно, иначе поток работает до завершения процесса)
+    """
+
+    stop = stop or threading.Event()
+
+    def run() -> None:
+        while not stop.wait(interval):
+            try:
+                purge_caches()
+            except Exception as error:
+                log.error('Ошибка очистки кэша', exc_info=error)
+
+    thread = threading.Thread(target=run, name='cache-purger', daemon=True)
+    thread.start()
+
+    return thread
+
+
+class _Call:
+    """ Выполняющийся запрос SingleFlight, результат которого ждут остальные потоки. """
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые запросы: функция для ключа выполняется один раз,
+    остальные потоки ждут и получают тот же результат (или то же исключение).
+    """
+
+    def __init__(self) -> None:
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = dict()
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            call: Optional[_Call] = self._calls.get(key)
+            leader: bool = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
@@ -0,0 +1,82 @@
+import logging
+import sqlite3
+import threading
+from typing import List
+
+from body.botrequests.metrics import TimedConnection
+from settings import db_name, db_cached_statements, db_busy_timeout, metrics_enabled, trace_sample_rate
+
+__all__ = ['get_connection',
+           'close_connections',
+           'connections_opened'
+           ]
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+_lock = threading.Lock()
+_connections: List[sqlite3.Connection] = list()
+_stats = {'opened': 0, 'generation': 0}
+
+
+def _open_connection() -> sqlite3.Connection:
+    """
+    Функция, которая открывает новое соединение с БД и настраивает его:
+    режим WAL, synchronous=NORMAL, autocommit (без висящих транзакций у долгоживущего соединения)
+    и кэш подготовленных запросов. При metrics_enabled или включенной трассировке (trace_sample_rate > 0)
+    запросы соединения замеряются (TimedConnection).
+    """
+
+    conn = sqlite3.connect(db_name,
+                           timeout=db_busy_timeout,
+                           cached_statements=db_cached_statements,
+                           check_same_thread=False,
+                           isolation_level=None,
+                           factory=TimedConnection if metrics_enabled or trace_sample_rate > 0 else sqlite3.Connection
+                           )
+    conn.execute('PRAGMA journal_mode=WAL;')
+    conn.execute('PRAGMA synchronous=NORMAL;')
+    conn.execute('PRAGMA foreign_keys=ON;')
+
+    with _lock:
+        _connections.append(conn)
+        _stats['opened'] += 1
+
+    log.info('Открыто соединение с БД {db}. Поток: {thread}'.format(db=db_name,
+                                                                   thread=threading.current_thread().name))
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Функция, которая возвращает долгоживущее соединение с БД для текущего потока.
+    Соединение создается один раз на поток и переиспользуется всеми функциями db_functions,
+    поэтому подготовленные запросы остаются в кэше соединения между вызовами.
+    """
+
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.generation != _stats['generation']:
+        conn = _open_connection()
+        _local.conn = conn
+        _local.generation = _stats['generation']
+
+    return conn
+
+
+def close_connections() -> None:
+    """ Функция, которая закрывает все открытые соединения пула (при остановке бота). """
+
+    with _lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError as error:
+                log.error('Не удалось закрыть соединение с БД', exc_info=error)
+        _connections.clear()
+        _stats['generation'] += 1
+
+
+def connections_opened() -> int:
+    """ Функция, которая возвращает количество соединений, открытых с момента запуска. """
+
+    return _stats['opened']
@@ -1,16 +1,19 @@
 from datetime import datetime
 import logging
 from math import ceil
+import threading
 from typing import Tuple, Dict, List, Union, Optional
 
 import sqlite3
 from telebot import types
 
-from body.botrequests.history import create_request_str
-from settings import num_history_requests, max_num_hotels, max_num_photos
+from body.botrequests.connection import get_connection
+from body.botrequests.dialog_state import DialogState, DialogStore, SqliteDialogStore
+from body.botrequests.history import create_request_str, create_request_json, parse_request_json
+from body.botrequests.tracing import register_request_resolver
+from settings import num_history_requests, max_num_hotels, max_num_photos, dialog_ttl, state_backend
 
-__all__ = ['create_tables',
-           'create_user',
+__all__ = ['create_user',
            'set_command',
            'get_command',
            'get_last_request_id',
@@ -27,54 +30,163 @@ __all__ = ['create_tables',
            'set_max_price',
            'make_min_max_price',
            'make_min_max_distance',
-           'get_request_low_high',
-           'get_request_bestdeal',
-           'get_user_request'
+           'get_search_request',
+           'get_user_request',
+           'get_stored_result',
+           'save_dialog',
+           'flush_dialogs'
            ]
 
 log = logging.getLogger(__name__)
 
+_request_columns = ('city', 'id_city', 'check_in', 'check_out', 'num_hotels', 'photos', 'min_price', 'max_price',
+                    'min_distance', 'max_distance', 'request', 'request_json')
 
-def create_tables() -> Optional[str]:
-    """ Функция, которая создаём БД и 2 таблицы "users" и "history_requests" """
+_search_columns = ('command', 'id_city', 'check_in', 'check_out', 'num_hotels', 'photos', 'min_price', 'max_price',
+                   'min_distance', 'max_distance', 'request')
 
+
+def _save_states(states: List[DialogState]) -> None:
+    """
+    Функция, которая записывает состояния диалогов в таблицу "history_requests" одной транзакцией.
+    В случае ошибки состояния снова помечаются несохраненными.
+    :param states: состояния диалогов
+    """
+
+    if not states:
+        return
+
+    conn = get_connection()
+    query: str = "UPDATE history_requests SET {columns} WHERE request_id = :request_id;".format(
+        columns=', '.join('{field} = :{field}'.format(field=field) for field in DialogState.fields)
+    )
     try:
-        conn = sqlite3.connect('users.db')
-        cur = conn.cursor()
+        conn.execute('BEGIN;')
+        conn.executemany(query, [dict(state.row(), request_id=state.request_id) for state in states])
+        conn.execute('COMMIT;')
 
-        cur.execute("""CREATE TABLE IF NOT EXISTS users(
-                    user_id INTEGER PRIMARY KEY, 
-                    first_name TEXT, 
-                    last_name TEXT, 
-                    username TEXT
-                    );
-        """)
-        conn.commit()
+    except sqlite3.DatabaseError:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK;')
+        _dialogs.mark_dirty(states)
+        raise
 
-        cur.execute("""CREATE TABLE IF NOT EXISTS history_requests(
-           request_id INTEGER PRIMARY KEY AUTOINCREMENT,
-           date_create TEXT,
-           user_id INTEGER,
-           command TEXT,
-           city TEXT,
-           id_city TEXT,
-           check_in TEXT,
-           check_out TEXT,
-           min_price TEXT,
-           max_price TEXT,
-           min_distance TEXT,
-           max_distance TEXT,
-           num_hotels TEXT,
-           photos TEXT,
-           request TEXT);
-        """)
-        conn.commit()
+
+def _save_evicted(states: List[DialogState]) -> None:
+    """ Функция, которая сохраняет в БД состояния диалогов, вытесненные из памяти по TTL. """
+
+    try:
+        _save_states(states)
+    except sqlite3.DatabaseError as error:
+        log.error('_save_evicted has not been successful', exc_info=error)
+
+
+# состояния диалогов в памяти процесса или в общей БД (state_backend = 'sqlite': переживают перезапуск
+# и доступны всем процессам бота)
+_dialogs: Union[DialogStore, SqliteDialogStore] = (SqliteDialogStore if state_backend == 'sqlite' else DialogStore)(
+    dialog_ttl, on_evict=_save_evicted)
+
+
+def _active_request(user_id: int) -> Optional[int]:
+    """
+    Функция, которая возвращает id активного запроса пользователя - запроса его диалога в хранилище _dialogs,
+    или None, если диалога нет (сохранен перед поиском или вытеснен по TTL).
+    :param user_id: id пользователя
+    """
+
+    state: Optional[DialogState] = _dialogs.get(user_id)
+
+    return state.request_id if state else None
+
+
+# шаги диалога до поиска относятся к активному запросу пользователя
+register_request_resolver(_active_request)
+
+# фоновое сохранение снимает отметку "не сохранено" до записи в БД, поэтому сохранение перед поиском
+# ждет его завершения и записывает диалог само, не полагаясь на отметку
+_save_lock = threading.Lock()
+
+
+def save_dialog(request_id: int) -> Optional[str]:
+    """
+    Функция, которая записывает собранный в памяти диалог в таблицу "history_requests" одной транзакцией
+    и удаляет его из памяти. Вызывается перед поиском отелей. Диалог записывается всегда, даже если фоновое
+    сохранение уже сняло с него отметку "не сохранено", и удаляется из памяти только после записи.
+    :param request_id: id запроса
+    """
+
+    try:
+        with _save_lock:
+            state: Optional[DialogState] = _dialogs.get_by_request(request_id)
+            if state is None:
+                return
+            _save_states([state])
+            _dialogs.pop(request_id)
 
     except sqlite3.DatabaseError as error:
-        log.error('create_tables has not been successful', exc_info=error)
-        return 'Ошибка в create_tables'
-    finally:
-        conn.close()
+        log.error('save_dialog has not been successful', exc_info=error)
+        return 'ошибка в БД'
+
+
+def flush_dialogs() -> None:
+    """ Функция, которая сохраняет в БД все несохраненные диалоги, оставляя их в памяти (фоновое сохранение). """
+
+    _dialogs.evict_expired()
+    try:
+        with _save_lock:
+            _save_states(_dialogs.dirty_states())
+    except sqlite3.DatabaseError as error:
+        log.error('flush_dialogs has not been successful', exc_info=error)
+
+
+def _update_request(column: str, value: Union[int, float, str], request_id: int) -> None:
+    """
+    Функция, которая записывает значение в столбец запроса: в состояние диалога, если оно в памяти,
+    иначе напрямую в БД.
+    :param column: столбец таблицы "history_requests"
+    :param value: значение
+    :param request_id: id запроса
+    """
+
+    if column not in _request_columns:
+        raise ValueError('Неизвестный столбец {column}'.format(column=column))
+
+    if _dialogs.update(_dialogs.get_by_request(request_id), **{column: value}):
+        return
+
+    get_connection().execute("UPDATE history_requests SET {column} = ? WHERE request_id = ?;".format(column=column),
+                             (value, request_id)
+                             )
+
+
+def _update_last_request(user_id: int, **values: Union[int, float, str]) -> None:
+    """
+    Функция, которая одним запросом записывает значения в столбцы последнего запроса пользователя.
+    Если у пользователя есть диалог в _dialogs, обновление идет по первичному ключу его запроса,
+    иначе последний запрос находится подзапросом по индексу (user_id, request_id) в том же UPDATE.
+    :param user_id: id пользователя
+    :param values: столбцы таблицы "history_requests" и их значения
+    """
+
+    for column in values:
+        if column not in _request_columns:
+            raise ValueError('Неизвестный столбец {column}'.format(column=column))
+
+    state: Optional[DialogState] = _dialogs.get(user_id)
+    if all(column in DialogState.fields for column in values) and _dialogs.update(state, **values):
+        return
+
+    columns: str = ', '.join('{column} = ?'.format(column=column) for column in values)
+    cur = get_connection().cursor()
+    if state:
+        cur.execute("UPDATE history_requests SET {columns} WHERE request_id = ?;".format(columns=columns),
+                    (*values.values(), state.request_id)
+                    )
+    else:
+        cur.execute("UPDATE history_requests SET {columns} WHERE request_id = "
+                    "(SELECT MAX(request_id) FROM history_requests WHERE user_id = ?);".format(columns=columns),
+                    (*values.values(), user_id)
+                    )
 
 
 def create_user(user_id: int, first_name: str, last_name: str, username: str) -> Optional[str]:
@@ -86,7 +198,7 @@ def create_user(user_id: int, first_name: str, last_name: str, username: str) ->
     :param username: никнейм пользователя
     """
     try:
-        conn = sqlite3.connect('users.db')
+        conn = get_connection()
         cur = conn.cursor()
         cur.execute("SELECT * FROM users WHERE user_id = ?;", (user_id,))
         user_result = cur.fetchone()
@@ -99,8 +211,6 @@ def create_user(user_id: int, first_name: str, last_name: str, username: str) ->
     except sqlite3.DatabaseError as error:
         log.error('create_user has not been successful', exc_info=error)
         return 'Ошибка в create_user'
-    finally:
-        conn.close()
 
 
 def set_command(user_id: int, command: str) -> Optional[str]:
@@ -115,18 +225,17 @@ def set_command(user_id: int, command: str) -> Optional[str]:
         date = datetime.today()
         date_str = date.replace(microsecond=0)
 
-        conn = sqlite3.connect('users.db')
+        conn = get_connection()
         cur = conn.cursor()
         cur.execute("INSERT INTO history_requests (date_create, user_id, command) VALUES(?, ?, ?);",
                     (date_str, user_id, command)
                     )
         conn.commit()
+        _dialogs.start(user_id, cur.lastrowid, command)
 
     except sqlite3.DatabaseError as error:
         log.error('set_command has not been successful', exc_info=error)
         return 'Ошибка в set_command'
-    finally:
-        conn.close()
 
 
 def get_command(request_id: int) -> str:
@@ -135,8 +244,12 @@ def get_command(request_id: int) -> str:
     :param request_id: id запроса
     """
 
+    state: Optional[DialogState] = _dialogs.get_by_request(request_id)
+    if state:
+        return state.command
+
     try:
-        conn = sqlite3.connect('users.db')
+        conn = get_connection()
         cur = conn.cursor()
         cur.execute("SELECT command FROM history_requests WHERE request_id = ?;", (request_id,))
         command: str = cur.fetchone()[0]
@@ -144,8 +257,6 @@ def get_command(request_id: int) -> str:
 
     except sqlite3.DatabaseError as error:
         log.error('get_last_request_id has not been successful', exc_info=error)
-    finally:
-        conn.close()
 
 
 def get_last_request_id(user_id: int) -> int:
@@ -154,8 +265,12 @@ def get_last_request_id(user_id: int) -> int:
     :param user_id: id пользователя
     """
 
+    id_request: Optional[int] = _active_request(user_id)
+    if id_request:
+        return id_request
+
     try:
-        conn = sqlite3.connect('users.db')
+        conn = get_connection()
         cur = conn.cursor()
         cur.execute("SELECT request_id FROM history_requests WHERE user_id = ? "
                     "ORDER BY request_id DESC LIMIT 1;", (user_id,)
@@ -166,8 +281,6 @@ def get_last_request_id(user_id: int) -> int:
 
     except sqlite3.DatabaseError as error:
         log.error('get_last_request_id has not been successful', exc_info=error)
-    finally:
-        conn.close()
 
 
 def set_city(city: str, user_id: int) -> None:
@@ -178,16 +291,10 @@ def set_city(city: str, user_id: int) -> None:
     """
 
     try:
-        conn = sqlite3.connect('users.db')
-        cur = conn.cursor()
-        id_request: int = get_last_request_id(user_id)
-        cur.execute("UPDATE history_requests SET city = ? WHERE request_id = ?;", (city, id_request))
-        conn.commit()
+        _update_last_request(user_id, city=city)
 
     except sqlite3.DatabaseError as error:
         log.error('set_city has not been successful', exc_info=error)
-    finally:
-        conn.close()
 
 
 def get_city(user_id: int) -> str:
@@ -196,8 +303,12 @@ def get_city(user_id: int) -> str:
     :param user_id: id пользователя
     """
 
+    state: Optional[DialogState] = _dialogs.get(user_id)
+    if state:
+        return state.city
+
     try:
-        conn = sqlite3.connect('users.db')
+        conn = get_connection()
         cur = conn.cursor()
         cur.execute("SELECT city FROM history_requests WHERE user_id = ? "
                     "ORDER BY request_id DESC LIMIT 1;", (user_id,)
@@ -207,8 +318,6 @@ def get_city(user_id: int) -> str:
 
     except sqlite3.DatabaseError as error:
         log.error('get_city has not been successful', exc_info=error)
-    finally:
-        conn.close()
 
 
 def get_last_request(user_id: int) -> Tuple[Union[int, str]]:
@@ -217,8 +326,12 @@ def get_last_request(user_id: int) -> Tuple[Union[int, str]]:
     :param user_id: id пользователя
     """
 
+    state: Optional[DialogState] = _dialogs.get(user_id)
+    if state:
+        return state.request_id, state.city, state.check_in
+
     try:
-        conn = sqlite3.connect('users.db')
+        conn = get_connection()
         cur = conn.cursor()
         cur.execute("SELECT request_id, city, check_in FROM history_requests "
                     "WHERE user_id = ? "
@@ -230,8 +343,6 @@ def get_last_request(user_id: int) -> Tuple[Union[int, str]]:
 
     except sqlite3.DatabaseError as error:
         log.error('get_last_request has not been successful', exc_info=error)
-    finally:
-        conn.close()
 
 
 def set_id_city(id_city: str, user_id: int) -> None:
@@ -242,18 +353,10 @@ def set_id_city(id_city: str, user_id: int) -> None:
     """
 
     try:
-        conn = sqlite3.connect('users.db')
-        cur = conn.cursor()
-        id_request: int = get_last_request_id(user_id)
-        cur.execute("UPDATE history_requests SET id_city = ? WHERE request_id = ?;",
-                    (id_city, id_request)
-                    )
-        conn.commit()
+        _update_last_request(user_id, id_city=id_city)
 
     except sqlite3.DatabaseError as error:
         log.error('set_id_city has not been successful', exc_info=error)
-    finally:
-        conn.close()
 
 
 def set_check_in(date: str, request_id: int) -> None:
@@ -264,17 +367,10 @@ def set_check_in(date: str, request_id: int) -> None:
     """
 
     try:
-        conn = sqlite3.connect('users.db')
-        cur = conn.cursor()
-        cur.execute("UPDATE history_requests SET check_in = ? WHERE request_id = ?;",
-                    (date, request_id)
-                    )
-        conn.commit()
+        _update_request('check_in', str(date), request_id)
 
     except sqlite3.DatabaseError as error:
         log.error('set_check_in has not been successful', exc_info=error)
-    finally:
-        conn.close()
 
 
 def set_check_out(date: str, request_id: int) -> None:
@@ -285,17 +381,10 @@ def set_check_out(date: str, request_id: int) -> None:
     """
 
     try:
-        conn = sqlite3.connect('users.db')
-        cur = conn.cursor()
-        cur.execute("UPDATE history_requests SET check_out = ? WHERE request_id = ?;",
-                    (date, request_id)
-                    )
-        conn.commit()
+        _update_request('check_out', str(date), request_id)
 
     except sqlite3.DatabaseError as error:
         log.error('set_check_out has not been successful', exc_info=error)
-    finally:
-        conn.close()
 
 
 def set_num_hotels(user_id: int, num_hotels: str) -> Optional[str]:
@@ -306,15 +395,8 @@ def set_num_hotels(user_id: int, num_hotels: str) -> Optional[str]:
     """
 
     try:
-        conn = sqlite3.connect('users.db')
-        conn = sqlite3.connect('users.db')
-        request_id: int = get_last_request_id(user_id)
         if 0 < int(num_hotels) < max_num_hotels + 1:
-            cur = conn.cursor()
-            cur.execute("UPDATE history_requests SET num_hotels = ? WHERE request_id = ?;",
-                        (num_hotels, request_id)
-                        )
-            conn.commit()
+            _update_last_request(user_id, num_hotels=int(num_hotels))
         else:
             raise ValueError
 
@@ -324,8 +406,6 @@ def set_num_hotels(user_id: int, num_hotels: str) -> Optional[str]:
     except ValueError as error:
         log.error('Введена не цифра', exc_info=error)
         return 'Неверный ввод'
-    finally:
-        conn.close()
 
 
 def set_num_photos(num_photos: str, request_id: int) -> Optional[str]:
@@ -336,13 +416,8 @@ def set_num_photos(num_photos: str, request_id: int) -> Optional[str]:
     """
 
     try:
-        conn = sqlite3.connect('users.db')
-        cur = conn.cursor()
         if 0 < int(num_photos) < max_num_photos + 1:
-            cur.execute("UPDATE history_requests SET photos = ? WHERE request_id = ?;",
-                        (num_photos, request_id)
-                        )
-            conn.commit()
+            _update_request('photos', int(num_photos), request_id)
         else:
             raise ValueError
 
@@ -352,54 +427,28 @@ def set_num_photos(num_photos: str, request_id: int) -> Optional[str]:
     except ValueError as error:
         log.error('Введена не цифра', exc_info=error)
         return 'Неверный ввод'
-    finally:
-        conn.close()
 
 
-def set_request(user_id: int, req_dct: Dict[int, dict[Union[str, str]]]) -> None:
+def set_request(user_id: int, request_id: int, req_dct: Dict[int, dict[Union[str, str]]]) -> None:
     """
-    Функция, которая добавляет полученный результат в последний запрос таблицы "history_requests"
+    Функция, которая записывает полученный результат в запрос request_id пользователя таблицы "history_requests"
+    (при обновлении цен из истории - заменяет сохраненный результат этого запроса)
     :param user_id: id пользователя
+    :param request_id: id запроса
     :param req_dct: полученный результат
     """
 
     try:
-        conn = sqlite3.connect('users.db')
-        cur = conn.cursor()
         request_str: str = create_request_str(req_dct)
-        request_id: int = get_last_request_id(user_id)
-        cur.execute("UPDATE history_requests SET request = ? WHERE request_id = ?;",
-                    (request_str, request_id)
-                    )
-        conn.commit()
+        request_json: str = create_request_json(req_dct)
+        get_connection().execute("UPDATE history_requests SET request = ?, request_json = ? "
+                                 "WHERE request_id = ? AND user_id = ?;",
+                                 (request_str, request_json, request_id, user_id)
+                                 )
 
     except sqlite3.DatabaseError as error:
         log.error('set_request has not been successful', exc_info=error)
 
-    finally:
-        conn.close()
-
-
-def get_request(user_id: int) -> str:
-    """
-    Функция, возвращающая последний результат запроса пользователя
-    :param user_id:id пользователя
-    """
-
-    try:
-        conn = sqlite3.connect('users.db')
-        cur = conn.cursor()
-        cur.execute("SELECT request FROM history_requests "
-                    "WHERE user_id = ? ORDER BY request_id DESC LIMIT 1;", (user_id,)
-                    )
-        result: str = cur.fetchone()
-        return result
-
-    except sqlite3.DatabaseError as error:
-        log.error('get_request has not been successful', exc_info=error)
-    finally:
-        conn.close()
-
 
 def make_min_max_price(message: types.Message) -> Union[str, Tuple[float, float]]:
     """
@@ -435,17 +484,11 @@ def set_min_price(min_price: int, user_id: int) -> Optional[bool]:
     """
 
     try:
-        conn = sqlite3.connect('users.db')
-        cur = conn.cursor()
-        id_request: int = get_last_request_id(user_id)
-        cur.execute("UPDATE history_requests SET min_price = ? WHERE request_id = ?;", (str(min_price), id_request))
-        conn.commit()
+        _update_last_request(user_id, min_price=min_price)
 
     except sqlite3.DatabaseError as error:
         log.error('set_city has not been successful', exc_info=error)
         return True
-    finally:
-        conn.close()
 
 
 def set_max_price(max_price: int, user_id: int) -> Optional[bool]:
@@ -456,17 +499,11 @@ def set_max_price(max_price: int, user_id: int) -> Optional[bool]:
     """
 
     try:
-        conn = sqlite3.connect('users.db')
-        cur = conn.cursor()
-        id_request: int = get_last_request_id(user_id)
-        cur.execute("UPDATE history_requests SET max_price = ? WHERE request_id = ?;", (str(max_price), id_request))
-        conn.commit()
+        _update_last_request(user_id, max_price=max_price)
 
     except sqlite3.DatabaseError as error:
         log.error('set_city has not been successful', exc_info=error)
         return True
-    finally:
-        conn.close()
 
 
 def make_min_max_distance(message: types.Message) -> Union[str, Tuple[float, float]]:
@@ -503,17 +540,11 @@ def set_min_distance(min_distance: float, user_id: int) -> Optional[bool]:
     """
 
     try:
-        conn = sqlite3.connect('users.db')
-        cur = conn.cursor()
-        id_request: int = get_last_request_id(user_id)
-        cur.execute("UPDATE history_requests SET min_distance = ? WHERE request_id = ?;", (str(min_distance), id_request))
-        conn.commit()
+        _update_last_request(user_id, min_distance=min_distance)
 
     except sqlite3.DatabaseError as error:
         log.error('set_city has not been successful', exc_info=error)
         return True
-    finally:
-        conn.close()
 
 
 def set_max_distance(max_distance: float, user_id: int) -> Optional[bool]:
@@ -524,84 +555,75 @@ def set_max_distance(max_distance: float, user_id: int) -> Optional[bool]:
     """
 
     try:
-        conn = sqlite3.connect('users.db')
-        cur = conn.cursor()
-        id_request: int = get_last_request_id(user_id)
-        cur.execute("UPDATE history_requests SET max_distance = ? WHERE request_id = ?;",
-                    (str(max_distance), id_request)
-                    )
-        conn.commit()
+        _update_last_request(user_id, max_distance=max_distance)
 
     except sqlite3.DatabaseError as error:
         log.error('set_city has not been successful', exc_info=error)
         return True
-    finally:
-        conn.close()
 
 
-def get_request_low_high(request_id: int) -> Union[Tuple[Optional[str]], str]:
+def get_search_request(user_id: int, request_id: int) -> Union[Dict[str, Union[int, float, str, None]], str, None]:
     """
-    Функция, которая возвращает последний запрос пользователя для команд lowprice и highprice.
+    Функция, которая возвращает параметры запроса пользователя для поиска отелей: команду, город, даты,
+    количество отелей и фотографий, диапазоны цен и расстояний и сохраненный результат (history_requests [request]).
+    Если запроса нет (или он другого пользователя), возвращает None, в случае ошибки с БД - строку "ошибка".
+    :param user_id: id пользователя
     :param request_id: id запроса
     """
 
     try:
-        conn = sqlite3.connect('users.db')
+        conn = get_connection()
         cur = conn.cursor()
-        cur.execute("SELECT id_city, check_in, check_out, num_hotels, photos, request FROM history_requests "
-                    "WHERE request_id = ?;", (request_id,)
-                    )
-        result = cur.fetchone()
-        log.info(result)
-        return result
+        cur.execute("SELECT {columns} FROM history_requests WHERE request_id = ? AND user_id = ?;".format(
+            columns=', '.join(_search_columns)), (request_id, user_id)
+        )
+        result: Optional[tuple] = cur.fetchone()
+        if result is None:
+            return None
+        return dict(zip(_search_columns, result))
 
     except sqlite3.DatabaseError as error:
-        log.error('get_request_lowprice has not been successful', exc_info=error)
+        log.error('get_search_request has not been successful', exc_info=error)
         return 'ошибка'
-    finally:
-        conn.close()
 
 
-def get_request_bestdeal(request_id: int) -> Union[Tuple[Optional[str]], str]:
+def get_user_request(user_id: int) -> List[Tuple[Union[int, str]]]:
     """
-    Функция, которая возвращает последний запрос пользователя для команды bestdeal.
-    :param request_id: id запроса
+    Возвращает все запросы пользователя, у которых заполнен столбец history_requests [request] в обратном порядке
+    :param user_id: id пользователя
     """
 
     try:
-        conn = sqlite3.connect('users.db')
+        conn = get_connection()
         cur = conn.cursor()
-        cur.execute("SELECT id_city, check_in, check_out, min_price, max_price, "
-                    "min_distance, max_distance, num_hotels, photos, request "
-                    "FROM history_requests "
-                    "WHERE request_id = ?;", (request_id,)
+        cur.execute("SELECT * FROM history_requests WHERE user_id = ? and request IS NOT NULL "
+                    "ORDER BY request_id DESC;", (user_id,)
                     )
-        result = cur.fetchone()
+        result: List[Tuple[Union[int, str]]] = cur.fetchmany(num_history_requests)
         return result
 
     except sqlite3.DatabaseError as error:
-        log.error('get_request_bestdeal has not been successful', exc_info=error)
-        return 'ошибка'
-    finally:
-        conn.close()
+        log.error('get_request_lowprice has not been successful', exc_info=error)
 
 
-def get_user_request(user_id: int) -> List[Tuple[Union[int, str]]]:
+def get_stored_result(user_id: int, request_id: int) -> Optional[Dict[int, dict]]:
     """
-    Возвращает все запросы пользователя, у которых заполнен столбец history_requests [request] в обратном порядке
+    Функция, которая возвращает сохраненный результат запроса пользователя (history_requests [request_json])
+    в том же виде, что и функции поиска отелей, для повтора запроса из истории без обращения к API.
+    Если результат не сохранен (старые запросы), запрос другого пользователя или произошла ошибка, возвращает None.
     :param user_id: id пользователя
+    :param request_id: id запроса
     """
 
     try:
-        conn = sqlite3.connect('users.db')
+        conn = get_connection()
         cur = conn.cursor()
-        cur.execute("SELECT * FROM history_requests WHERE user_id = ? and request IS NOT NULL "
-                    "ORDER BY request_id DESC;", (user_id,)
-                    )
-        result: List[Tuple[Union[int, str]]] = cur.fetchmany(num_history_requests)
-        return result
-
-    except sqlite3.DatabaseError as error:
-        log.error('get_request_lowprice has not been successful', exc_info=error)
-    finally:
-        conn.close()
+        cur.execute("SELECT request_json FROM history_requests WHERE request_id = ? AND user_id = ?;",
+                    (request_id, user_id))
+        result: Optional[tuple] = cur.fetchone()
+        if not result or not result[0]:
+            return None
+        return parse_request_json(result[0])
+
+    except (sqlite3.DatabaseError, ValueError) as error:
+        log.error('get_stored_result has not been successful', exc_info=error)
@@ -0,0 +1,401 @@
+from datetime import date
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from telebot import types
+from telegram_bot_calendar import DetailedTelegramCalendar
+
+from body.botrequests.db_functions import (create_user, set_command, get_city, set_id_city, set_city, get_last_request,
+                                           set_check_in, set_check_out, set_num_hotels, set_num_photos,
+                                           get_last_request_id, make_min_max_price, make_min_max_distance,
+                                           get_user_request, get_stored_result, save_dialog)
+from body.botrequests.history import (history_txt, markup_hotels, markup_photos, markup_repeat_request, markup_url,
+                                      markup_yes_no, next_day)
+from body.botrequests.locations import get_cities_from_rapidapi
+from body.botrequests.tracing import span
+from settings import max_num_hotels, max_num_photos, id_sticker_time
+
+__all__ = ['Reply',
+           'welcome',
+           'restart',
+           'start_command',
+           'show_history',
+           'dialog_step',
+           'calendar_step',
+           'history_step',
+           'bot_help',
+           'hotel_messages'
+           ]
+
+log = logging.getLogger(__name__)
+
+_welcome_text = "Вас приветствует ТелеграмБот 'MyHotelBot'." \
+                "\nЯ могу помочь Вам подобрать отель. Выберите команду:" \
+                "\n/lowprice - поиск самых дешевых отелей в городе" \
+                "\n/highprice - поиск самых дорогих отелей в городе" \
+                "\n/bestdeal - поиск отелей, наиболее подходящих по цене и расположению от центра" \
+                "\n/history - вывод истории поиска отелей" \
+                "\n/restart - перезапуск поиска."
+_service_error = 'Возникла неполадка c сервисом, попробуйте еще раз'
+
+Message = Tuple[str, Tuple[Any, ...], Dict[str, Any]]
+
+
+class Reply:
+    """
+    Ответ бота на обновление: сообщения (метод бота, аргументы после id чата), следующий шаг диалога,
+    исправление сообщения-календаря и поиск, результат которого нужно отправить после сообщений.
+    Шаги диалога только готовят ответ, а отправляет его среда выполнения (main.py или async_main.py),
+    поэтому диалог у обеих сред один.
+    """
+
+    __slots__ = ('messages', 'next_step', 'edit', 'request_id', 'hotels')
+
+    def __init__(self) -> None:
+        self.messages: List[Message] = list()
+        self.next_step: Optional[str] = None
+        self.edit: Optional[Tuple[str, int, types.InlineKeyboardMarkup]] = None
+        self.request_id: Optional[int] = None
+        self.hotels: Optional[Dict[int, dict]] = None
+
+    def send(self, method: str, *args: Any, **kwargs: Any) -> 'Reply':
+        """ Добавляет вызов метода бота, первый аргумент которого - id чата. """
+
+        self.messages.append((method, args, kwargs))
+        return self
+
+    def text(self, text: str, **kwargs: Any) -> 'Reply':
+        return self.send('send_message', text, **kwargs)
+
+    def ask(self, text: str, step: str, **kwargs: Any) -> 'Reply':
+        """ Добавляет вопрос, ответ на который обработает шаг диалога step (dialog_step). """
+
+        self.next_step = step
+        return self.text(text, **kwargs)
+
+    def extend(self, other: 'Reply') -> 'Reply':
+        """ Добавляет сообщения и следующий шаг другого ответа. """
+
+        self.messages.extend(other.messages)
+        self.next_step = other.next_step
+        return self
+
+    def search(self, request_id: int) -> 'Reply':
+        """ Сохраняет диалог в БД и добавляет поиск отелей запроса request_id через API. """
+
+        save_dialog(request_id)
+        self.send('send_sticker', id_sticker_time)
+        self.text('Поиск займет несколько секунд, пожалуйста, подождите!')
+        self.request_id = request_id
+        return self
+
+
+def welcome(reply: Optional[Reply] = None) -> Reply:
+    """ Функция - приветствие. Добавляет к ответу описание команд Бота. """
+
+    return (reply or Reply()).text(_welcome_text)
+
+
+def restart(user_id: int) -> Reply:
+    """ Функция, которая отлавливает команду restart и возвращает приветствие. """
+
+    log.info('Выполнен restart. user_id: {user_id}'.format(user_id=user_id))
+    return welcome()
+
+
+def start_command(user: types.User, command: Optional[str]) -> Reply:
+    """
+    Функция, которая начинает команду: добавляет пользователя в таблицу users, а для команд поиска
+    создает новый запрос в "history_requests" [user_id, command].
+    lowprice и highprice запрашивают город, bestdeal - диапазон цен, без команды (history) - показывает историю.
+    В случае возникновения ошибки уведомляет пользователя и возвращает приветствие.
+    :param user: пользователь
+    :param command: команда без "/" (None - history)
+    """
+
+    log.info('Запрос. user_id: {user_id}'.format(user_id=user.id))
+
+    result_user: Optional[str] = create_user(user.id, user.first_name, user.last_name, user.username)
+    result_command: Optional[str] = set_command(user.id, command) if command else None
+    if result_user or result_command:
+        return welcome(Reply().text(_service_error))
+
+    if not command:
+        return show_history(user.id)
+
+    log.info('Отработал успешно. user_id: {user_id}'.format(user_id=user.id))
+    if command == 'bestdeal':
+        return Reply().ask('Введите диапазон желаемых цен через пробел (пример: 1500 3000):', 'min_max_price')
+
+    return Reply().ask('Выберите город:', 'get_cities')
+
+
+def show_history(user_id: int) -> Reply:
+    """
+    Функция, которая возвращает последние запросы пользователя с кнопками повтора.
+    Если запросов не было, то сообщает об этом пользователю и возвращает приветствие.
+    """
+
+    result: List[Tuple[Optional[Union[int, str]]]] = get_user_request(user_id)
+    if not result:
+        log.info('Список запросов пуст. user_id: {user_id}'.format(user_id=user_id))
+        return welcome(Reply().text('Вы еще не сделали ниодного запроса.\nДавайте это исправим!'))
+
+    reply = Reply()
+    for i_req in result:
+        reply.text(history_txt(i_req), reply_markup=markup_repeat_request(str(i_req[0])),
+                   disable_web_page_preview=True)
+    log.info('отправил историю. user_id: {user_id}'.format(user_id=user_id))
+
+    return reply
+
+
+def _min_max_price(message: types.Message) -> Reply:
+    """
+    Обрабатывает минимальную и максимальную цены и, если они корректные, добавляет их в БД
+    (history_requests [min_price, max_price]) и запрашивает диапазон расстояний,
+    в противном случае предлагает еще раз ввести данные. В случае ошибки с БД начинает bestdeal заново.
+    """
+
+    result: Union[str, Tuple[int, int]] = make_min_max_price(message)
+    if result == 'Ошибка с БД':
+        return Reply().text(_service_error).extend(start_command(message.from_user, 'bestdeal'))
+    if result == 'Ошибка ввода':
+        return Reply().ask('Некорректный ввод, введите еще раз', 'min_max_price')
+
+    return Reply().ask('Введите диапазон расстояния, на котором находится отель от центра '
+                       'в км через пробел (пример: 2 5):', 'min_max_distance')
+
+
+def _min_max_distance(message: types.Message) -> Reply:
+    """
+    Обрабатывает минимальную и максимальную дистанции и, если они корректные, добавляет их в БД
+    (history_requests [min_distance, max_distance]) и запрашивает город,
+    в противном случае предлагает еще раз ввести данные. В случае ошибки с БД начинает bestdeal заново.
+    """
+
+    result: Union[str, Tuple[float, float]] = make_min_max_distance(message)
+    if result == 'Ошибка с БД':
+        return Reply().text(_service_error).extend(start_command(message.from_user, 'bestdeal'))
+    if result == 'Ошибка ввода':
+        return Reply().ask('Некорректный ввод, введите еще раз', 'min_max_distance')
+
+    return Reply().ask('Выберите город:', 'get_cities')
+
+
+def _get_cities(message: types.Message, cities_dct: Union[Dict[str, str], str, None] = None) -> Reply:
+    """
+    Ищет города по введенной строке (get_cities_from_rapidapi), записывает найденные в запрос пользователя
+    (history_requests [city]) и предлагает выбрать один из них на клавиатуре.
+    Асинхронная среда ищет города сама (async_api.get_cities_async) и передает результат в cities_dct.
+    Если ничего не найдено, запрашивает город еще раз. В случае ошибки с API возвращает приветствие.
+    """
+
+    if cities_dct is None:
+        cities_dct = get_cities_from_rapidapi(message.text, message.from_user.id)
+    if cities_dct == 'Error':
+        return welcome(Reply().text('Технические неполадки с сайтом. Повторите запрос!'))
+    if cities_dct == 'Null':
+        return Reply().ask('Ничего не найдено. Повторите запрос!', 'get_cities')
+
+    set_city(str(cities_dct)[1:-1], message.from_user.id)
+
+    cities_markup = types.ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
+    for i_city in cities_dct.values():
+        cities_markup.add(types.KeyboardButton(i_city))
+
+    return Reply().ask('Уточните, пожалуйста:', 'selecting_city', reply_markup=cities_markup)
+
+
+def _selecting_city(message: types.Message) -> Reply:
+    """
+    Записывает id и название выбранного города в БД (history_requests [id_city, city])
+    и запрашивает дату заезда клавиатурой-календарем.
+    """
+
+    city: str = get_city(message.from_user.id)
+    cities_lst: List[Tuple[str]] = re.findall(r"'(\d+)': '([^']+)'", city)
+    for i_city in cities_lst:
+        if i_city[1] == message.text:
+            set_id_city(i_city[0], message.from_user.id)
+            set_city(i_city[1], message.from_user.id)
+            break
+
+    return _calendar(Reply(), 'Выберите дату заезда')
+
+
+def _calendar(reply: Reply, message_date: str) -> Reply:
+    """ Добавляет к ответу клавиатуру-календарь. """
+
+    calendar_markup, step = DetailedTelegramCalendar(one_time_keyboard=True, min_date=date.today(), locale='ru').build()
+
+    return reply.text(message_date, reply_markup=calendar_markup)
+
+
+def _number_hotels(message: types.Message) -> Reply:
+    """
+    Проверяет полученное число отелей, если корректно, то добавляет в БД (history_requests [num_hotels])
+    и спрашивает, нужны ли фотографии. В случае некорректного ответа переспрашивает о количестве отелей.
+    """
+
+    result: Optional[str] = set_num_hotels(message.from_user.id, message.text)
+    if result == 'ошибка в БД':
+        return Reply().text('Технические неполадки с сервисом').ask(
+            'Выберите количество отелей (max={num}):'.format(num=max_num_hotels), 'number_hotels',
+            reply_markup=markup_hotels())
+    if result == 'Неверный ввод':
+        return Reply().ask('Введен некорректный ответ. \nВыберите количество отелей на клавиатуре '
+                           '(max={num}):'.format(num=max_num_hotels), 'number_hotels', reply_markup=markup_hotels())
+
+    return Reply().ask('Нужны фотографии?', 'ask_photos', reply_markup=markup_yes_no())
+
+
+def _ask_photos(message: types.Message) -> Reply:
+    """
+    Если получен ответ "Нет", запускает поиск, если "Да" - запрашивает количество фотографий.
+    В случае некорректного ответа переспрашивает о необходимости фотографий.
+    """
+
+    if message.text.lower() == 'нет':
+        return Reply().search(get_last_request_id(message.from_user.id))
+    if message.text.lower() == 'да':
+        return Reply().ask('Введите количество(max={num}):'.format(num=max_num_photos), 'ask_num_photos',
+                           reply_markup=markup_photos())
+
+    return Reply().ask('Введен некорректный ответ.\nВыберите ответ на клавиатуре:', 'ask_photos',
+                       reply_markup=markup_yes_no())
+
+
+def _ask_num_photos(message: types.Message) -> Reply:
+    """
+    Проверяет количество фотографий, если корректно, то записывает в БД (history_requests [photos])
+    и запускает поиск. В случае некорректного ответа переспрашивает о количестве фотографий.
+    """
+
+    request_id: int = get_last_request_id(message.from_user.id)
+    result: Optional[str] = set_num_photos(message.text, request_id)
+    if not result:
+        return Reply().search(request_id)
+
+    reply = Reply()
+    if result == 'ошибка в БД':
+        reply.text('Технические неполадки с сервисом')
+
+    return reply.ask('Введите количество(max={num}):'.format(num=max_num_photos), 'ask_num_photos',
+                     reply_markup=markup_photos())
+
+
+_steps: Dict[str, Callable[..., Reply]] = {'min_max_price': _min_max_price,
+                                           'min_max_distance': _min_max_distance,
+                                           'get_cities': _get_cities,
+                                           'selecting_city': _selecting_city,
+                                           'number_hotels': _number_hotels,
+                                           'ask_photos': _ask_photos,
+                                           'ask_num_photos': _ask_num_photos
+                                           }
+
+
+def dialog_step(step: str, message: types.Message, **lookup: Any) -> Reply:
+    """
+    Функция, которая обрабатывает ответ пользователя на шаге диалога step (имя из Reply.next_step).
+    В случае получения текста "/restart" возвращает приветствие.
+    :param step: шаг диалога
+    :param message: сообщение пользователя
+    :param lookup: результаты запросов к API, выполненных средой до шага (cities_dct для get_cities)
+    """
+
+    if message.text == '/restart':
+        return restart(message.from_user.id)
+
+    log.info('Получено {answer}. user_id: {user_id}'.format(answer=message.text, user_id=message.from_user.id))
+    with span(step):
+        return _steps[step](message, **lookup)
+
+
+def calendar_step(chat_id: int, message_id: int, data: str) -> Reply:
+    """
+    Функция, которая обрабатывает нажатие в календаре: переключает календарь (исправляет сообщение message_id)
+    или записывает дату заезда и выезда в БД (history_requests [check_in, check_out]).
+    После выбора обеих дат запрашивает количество отелей.
+    :param chat_id: id чата
+    :param message_id: id сообщения с календарем
+    :param data: callback_data кнопки календаря
+    """
+
+    result: Tuple[Optional[Union[int, str]]] = get_last_request(chat_id)
+    request_id, check_in = result[0], result[2]
+
+    if check_in:
+        message_date: str = 'Выберите дату выезда'
+        answer, key, step = DetailedTelegramCalendar(min_date=next_day(check_in), locale='ru').process(data)
+    else:
+        message_date: str = 'Выберите дату заезда'
+        answer, key, step = DetailedTelegramCalendar(min_date=date.today(), locale='ru').process(data)
+
+    reply = Reply()
+    if not answer and key:
+        reply.edit = (message_date, message_id, key)
+    elif answer and check_in:
+        set_check_out(answer, request_id)
+        reply.ask('Выберите количество отелей (max={num}):'.format(num=max_num_hotels), 'number_hotels',
+                  reply_markup=markup_hotels())
+        log.info('Даты добавлены. user_id: {user_id}'.format(user_id=chat_id))
+    elif answer:
+        set_check_in(answer, request_id)
+        _calendar(reply, 'Выберите дату выезда:')
+
+    return reply
+
+
+def history_step(chat_id: int, data: Optional[str]) -> Reply:
+    """
+    Функция, которая обрабатывает кнопки под запросом из истории: "Повторить запрос" (id запроса) -
+    сохраненный результат без обращения к API, если он есть в БД, "Обновить цены" (refresh:<id>) - новый поиск.
+    Иначе предлагает пользователю нажать на необходимый запрос.
+    :param chat_id: id чата
+    :param data: callback_data кнопки
+    """
+
+    log.info('Id запрашиваемого запроса {answer} от пользователя {user_id}'.format(answer=data, user_id=chat_id))
+    if not data:
+        return Reply().text('Нажмите на интересующий вас запрос')
+    if data.startswith('refresh:'):
+        return Reply().search(int(data.split(':')[1]))
+
+    request_id = int(data)
+    hotels_dct: Optional[Dict[int, dict]] = get_stored_result(chat_id, request_id)
+    if hotels_dct is None:
+        return Reply().search(request_id)
+
+    log.info('Повтор сохраненного результата {request_id}. user_id: {user_id}'.format(request_id=request_id,
+                                                                                     user_id=chat_id))
+    reply = Reply()
+    reply.request_id, reply.hotels = request_id, hotels_dct
+
+    return reply
+
+
+def bot_help() -> Reply:
+    """ Функция, которая отвечает на сообщение вне диалога. """
+
+    return Reply().text('Чтобы начать поиск сайтов напишите "привет" или нажмите на команду /hello_world')
+
+
+def hotel_messages(hotel: dict) -> List[Message]:
+    """
+    Функция, которая возвращает сообщения одного отеля: альбом фотографий (если есть)
+    и карточку с кнопкой "Перейти на сайт". Каждая фотография альбома считается Telegram отдельным
+    сообщением, поэтому альбом расходует len(фотографий) токенов лимита отправки (аргумент cost).
+    :param hotel: словарь с данными отеля
+    """
+
+    messages: List[Message] = list()
+    if hotel.get('photos'):
+        messages.append(('send_media_group', (hotel['photos'],),
+                         {'disable_notification': True, 'cost': len(hotel['photos'])}))
+
+    msg_lst: List[str] = [': '.join((k, str(v))) for k, v in hotel.items() if k != 'photos' and k != 'url']
+    messages.append(('send_message', ('\n'.join(msg_lst),), {'reply_markup': markup_url(hotel['url'])}))
+
+    return messages
@@ -0,0 +1,349 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from body.botrequests.connection import get_connection
+
+__all__ = ['DialogState',
+           'DialogStore',
+           'SqliteDialogStore',
+           'start_flusher'
+           ]
+
+log = logging.getLogger(__name__)
+
+
+class DialogState:
+    """
+    Состояние диалога поиска одного пользователя: значения, которые раньше записывались в БД после каждого шага.
+    Хранится в памяти до вызова output(), затем одной транзакцией записывается в "history_requests".
+    """
+
+    __slots__ = ('user_id', 'request_id', 'command', 'city', 'id_city', 'check_in', 'check_out',
+                 'min_price', 'max_price', 'min_distance', 'max_distance', 'num_hotels', 'photos',
+                 'touched', 'dirty')
+
+    fields = ('city', 'id_city', 'check_in', 'check_out', 'min_price', 'max_price',
+              'min_distance', 'max_distance', 'num_hotels', 'photos')
+
+    def __init__(self, user_id: int, request_id: int, command: str) -> None:
+        self.user_id = user_id
+        self.request_id = request_id
+        self.command = command
+        for field in self.fields:
+            setattr(self, field, None)
+        self.touched: float = time.monotonic()
+        self.dirty: bool = False
+
+    def row(self) -> Dict[str, Union[int, float, str, None]]:
+        """ Возвращает значения столбцов "history_requests" для записи в БД. """
+
+        return {field: getattr(self, field) for field in self.fields}
+
+
+class DialogStore:
+    """
+    Потокобезопасное хранилище состояний диалогов с вытеснением по TTL.
+    При вытеснении несохраненные состояния передаются в on_evict, чтобы их можно было записать в БД.
+    Вытеснение выполняется периодически (фоновым сохранением и не чаще раза в минуту при создании диалога),
+    а не при каждом чтении: шаги диалога не просматривают все состояния.
+    """
+
+    _eviction_interval = 60
+
+    def __init__(self, ttl: float, on_evict: Optional[Callable[[List[DialogState]], None]] = None) -> None:
+        self._ttl = ttl
+        self._on_evict = on_evict
+        self._lock = threading.Lock()
+        self._by_user: Dict[int, DialogState] = dict()
+        self._by_request: Dict[int, DialogState] = dict()
+        self._next_eviction: float = time.monotonic() + min(ttl, self._eviction_interval)
+
+    def start(self, user_id: int, request_id: int, command: str) -> DialogState:
+        """ Создает новое состояние диалога, заменяя предыдущее состояние пользователя. """
+
+        if time.monotonic() >= self._next_eviction:
+            self.evict_expired()
+
+        state = DialogState(user_id, request_id, command)
+        with self._lock:
+            previous: Optional[DialogState] = self._by_user.get(user_id)
+            if previous:
+                self._by_request.pop(previous.request_id, None)
+            self._by_user[user_id] = state
+            self._by_request[request_id] = state
+        if previous and previous.dirty and self._on_evict:
+            self._on_evict([previous])
+
+        return state
+
+    def get(self, user_id: int) -> Optional[DialogState]:
+        """ Возвращает состояние диалога пользователя или None. """
+
+        with self._lock:
+            state: Optional[DialogState] = self._by_user.get(user_id)
+            if state:
+                state.touched = time.monotonic()
+            return state
+
+    def get_by_request(self, request_id: int) -> Optional[DialogState]:
+        """ Возвращает состояние диалога по id запроса или None. """
+
+        with self._lock:
+            state: Optional[DialogState] = self._by_request.get(request_id)
+            if state:
+                state.touched = time.monotonic()
+            return state
+
+    def update(self, state: Optional[DialogState], **values: Union[int, float, str, None]) -> bool:
+        """
+        Записывает значения в состояние диалога. Возвращает False, если состояния нет
+        (например, оно было вытеснено) и значение нужно записать напрямую в БД.
+        """
+
+        if state is None:
+            return False
+        with self._lock:
+            for field, value in values.items():
+                setattr(state, field, value)
+            state.touched = time.monotonic()
+            state.dirty = True
+
+        return True
+
+    def pop(self, request_id: int) -> Optional[DialogState]:
+        """ Удаляет состояние диалога по id запроса и возвращает его. """
+
+        with self._lock:
+            state: Optional[DialogState] = self._by_request.pop(request_id, None)
+            if state and self._by_user.get(state.user_id) is state:
+                del self._by_user[state.user_id]
+            return state
+
+    def dirty_states(self) -> List[DialogState]:
+        """ Возвращает состояния с несохраненными изменениями и помечает их сохраненными. """
+
+        with self._lock:
+            states: List[DialogState] = [state for state in self._by_user.values() if state.dirty]
+            for state in states:
+                state.dirty = False
+            return states
+
+    def mark_dirty(self, states: List[DialogState]) -> None:
+        """ Снова помечает состояния несохраненными (после ошибки записи в БД). """
+
+        with self._lock:
+            for state in states:
+                state.dirty = True
+
+    def evict_expired(self) -> None:
+        """ Удаляет состояния, к которым не обращались дольше TTL. """
+
+        deadline: float = time.monotonic() - self._ttl
+        with self._lock:
+            self._next_eviction = time.monotonic() + min(self._ttl, self._eviction_interval)
+            expired: List[DialogState] = [state for state in self._by_user.values() if state.touched < deadline]
+            for state in expired:
+                del self._by_user[state.user_id]
+                self._by_request.pop(state.request_id, None)
+
+        expired_dirty: List[DialogState] = [state for state in expired if state.dirty]
+        if expired_dirty and self._on_evict:
+            self._on_evict(expired_dirty)
+
+
+class SqliteDialogStore:
+    """
+    Хранилище состояний диалогов в общей БД (таблица "dialog_states") с интерфейсом DialogStore.
+    Каждое изменение сразу записывается в таблицу, поэтому состояние переживает перезапуск процесса
+    и доступно всем процессам бота, работающим с одной БД. В "history_requests" состояния переносятся так же,
+    как из памяти: фоновым сохранением, при вытеснении по TTL и перед поиском.
+    Время последнего обращения - время системы, общее для процессов.
+    """
+
+    _columns = 'user_id, request_id, command, state, dirty'
+
+    def __init__(self, ttl: float, on_evict: Optional[Callable[[List[DialogState]], None]] = None) -> None:
+        self._ttl = ttl
+        self._on_evict = on_evict
+
+    @staticmethod
+    def _state(row: Tuple[int, int, str, str, int]) -> DialogState:
+        user_id, request_id, command, values, dirty = row
+        state = DialogState(user_id, request_id, command)
+        for field, value in json.loads(values).items():
+            setattr(state, field, value)
+        state.dirty = bool(dirty)
+
+        return state
+
+    def start(self, user_id: int, request_id: int, command: str) -> DialogState:
+        """ Создает новое состояние диалога, заменяя предыдущее состояние пользователя. """
+
+        state = DialogState(user_id, request_id, command)
+        conn = get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE;')
+            previous: Optional[tuple] = conn.execute(
+                "SELECT {columns} FROM dialog_states WHERE user_id = ?;".format(columns=self._columns), (user_id,)
+            ).fetchone()
+            conn.execute("INSERT OR REPLACE INTO dialog_states (user_id, request_id, command, state, touched, dirty) "
+                         "VALUES(?, ?, ?, ?, ?, 0);",
+                         (user_id, request_id, command, json.dumps(state.row()), time.time())
+                         )
+            conn.execute('COMMIT;')
+
+        except sqlite3.DatabaseError:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK;')
+            raise
+
+        if previous and previous[4] and self._on_evict:
+            self._on_evict([self._state(previous)])
+
+        return state
+
+    def _get(self, column: str, value: int) -> Optional[DialogState]:
+        """ Возвращает непросроченное состояние по user_id или request_id и обновляет время обращения. """
+
+        now: float = time.time()
+        try:
+            conn = get_connection()
+            cur = conn.execute("UPDATE dialog_states SET touched = ? WHERE {column} = ? AND touched >= ?;".format(
+                column=column), (now, value, now - self._ttl))
+            if not cur.rowcount:
+                return None
+            row: Optional[tuple] = conn.execute("SELECT {columns} FROM dialog_states WHERE {column} = ?;".format(
+                columns=self._columns, column=column), (value,)).fetchone()
+
+        except sqlite3.DatabaseError as error:
+            log.error('SqliteDialogStore.get has not been successful', exc_info=error)
+            return None
+
+        return self._state(row) if row else None
+
+    def get(self, user_id: int) -> Optional[DialogState]:
+        """ Возвращает состояние диалога пользователя или None. """
+
+        return self._get('user_id', user_id)
+
+    def get_by_request(self, request_id: int) -> Optional[DialogState]:
+        """ Возвращает состояние диалога по id запроса или None. """
+
+        return self._get('request_id', request_id)
+
+    def update(self, state: Optional[DialogState], **values: Union[int, float, str, None]) -> bool:
+        """
+        Записывает значения в состояние диалога и в таблицу. Возвращает False, если состояния нет
+        (например, оно было вытеснено другим процессом) и значение нужно записать напрямую в БД.
+        """
+
+        if state is None:
+            return False
+        for field, value in values.items():
+            setattr(state, field, value)
+        state.dirty = True
+        try:
+            cur = get_connection().execute(
+                "UPDATE dialog_states SET state = ?, touched = ?, dirty = 1 WHERE request_id = ?;",
+                (json.dumps(state.row()), time.time(), state.request_id)
+            )
+
+        except sqlite3.DatabaseError as error:
+            log.error('SqliteDialogStore.update has not been successful', exc_info=error)
+            return False
+
+        return cur.rowcount > 0
+
+    def pop(self, request_id: int) -> Optional[DialogState]:
+        """ Удаляет состояние диалога по id запроса и возвращает его. """
+
+        conn = get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE;')
+            row: Optional[tuple] = conn.execute(
+                "SELECT {columns} FROM dialog_states WHERE request_id = ?;".format(columns=self._columns),
+                (request_id,)
+            ).fetchone()
+            conn.execute("DELETE FROM dialog_states WHERE request_id = ?;", (request_id,))
+            conn.execute('COMMIT;')
+
+        except sqlite3.DatabaseError:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK;')
+            raise
+
+        return self._state(row) if row else None
+
+    def dirty_states(self) -> List[DialogState]:
+        """ Возвращает состояния с несохраненными изменениями и помечает их сохраненными. """
+
+        conn = get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE;')
+            rows: List[tuple] = conn.execute(
+                "SELECT {columns} FROM dialog_states WHERE dirty = 1;".format(columns=self._columns)
+            ).fetchall()
+            conn.execute("UPDATE dialog_states SET dirty = 0 WHERE dirty = 1;")
+            conn.execute('COMMIT;')
+
+        except sqlite3.DatabaseError:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK;')
+            raise
+
+        return [self._state(row) for row in rows]
+
+    def mark_dirty(self, states: List[DialogState]) -> None:
+        """ Снова помечает состояния несохраненными (после ошибки записи в БД). """
+
+        get_connection().executemany("UPDATE dialog_states SET dirty = 1 WHERE request_id = ?;",
+                                     [(state.request_id,) for state in states])
+
+    def evict_expired(self) -> None:
+        """ Удаляет состояния, к которым не обращались дольше TTL (в любом процессе). """
+
+        deadline: float = time.time() - self._ttl
+        conn = get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE;')
+            rows: List[tuple] = conn.execute(
+                "SELECT {columns} FROM dialog_states WHERE touched < ?;".format(columns=self._columns), (deadline,)
+            ).fetchall()
+            conn.execute("DELETE FROM dialog_states WHERE touched < ?;", (deadline,))
+            conn.execute('COMMIT;')
+
+        except sqlite3.DatabaseError as error:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK;')
+            log.error('SqliteDialogStore.evict_expired has not been successful', exc_info=error)
+            return
+
+        expired_dirty: List[DialogState] = [self._state(row) for row in rows if row[4]]
+        if expired_dirty and self._on_evict:
+            self._on_evict(expired_dirty)
+
+
+def start_flusher(flush: Callable[[], None], interval: float) -> threading.Thread:
+    """
+    Функция, которая запускает фоновый поток, периодически сохраняющий состояния диалогов в БД.
+    Ограничивает потерю данных при падении процесса интервалом сохранения.
+    :param flush: функция сохранения
+    :param interval: интервал в секундах
+    """
+
+    def run() -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                flush()
+            except Exception as error:
+                log.error('Ошибка фонового сохранения диалогов', exc_info=error)
+
+    thread = threading.Thread(target=run, name='dialog-flusher', daemon=True)
+    thread.start()
+
+    return thread
@@ -0,0 +1,184 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import telebot
+from telebot import types
+
+from body.botrequests.logs import log_context
+from body.botrequests.metrics import errors_total, handler_seconds, timer
+from body.botrequests.tracing import span, trace_update
+from settings import handler_workers, handler_queue_size
+
+__all__ = ['Dispatcher',
+           'ShardedTeleBot',
+           'update_user_id'
+           ]
+
+log = logging.getLogger(__name__)
+
+_update_fields = ('message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+                  'shipping_query', 'pre_checkout_query', 'poll_answer', 'my_chat_member', 'chat_member',
+                  'channel_post', 'edited_channel_post')
+
+
+def update_user_id(update: types.Update) -> int:
+    """
+    Функция, которая возвращает id пользователя (или чата), от которого пришло обновление.
+    Если определить его нельзя, возвращает update_id.
+    :param update: обновление Telegram
+    """
+
+    for field in _update_fields:
+        event: Any = getattr(update, field, None)
+        if event is None:
+            continue
+        user: Optional[types.User] = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+        if user is not None:
+            return user.id
+        chat: Optional[types.Chat] = getattr(event, 'chat', None)
+        if chat is not None:
+            return chat.id
+
+    return update.update_id
+
+
+def _update_kind(update: types.Update) -> str:
+    """ Возвращает тип обновления (message, callback_query, ...) для метрик и трассировки. """
+
+    for field in _update_fields:
+        if getattr(update, field, None) is not None:
+            return field
+
+    return 'other'
+
+
+def _update_command(update: types.Update) -> Optional[str]:
+    """ Возвращает команду сообщения ("/lowprice" -> "lowprice") или None. """
+
+    text: Optional[str] = getattr(update.message, 'text', None)
+    if not text or not text.startswith('/'):
+        return None
+
+    return text.split()[0][1:].split('@')[0]
+
+
+class Dispatcher:
+    """
+    Пул обработчиков с распределением по пользователям: у каждого потока своя ограниченная очередь,
+    обновления пользователя всегда попадают в одну и ту же очередь (user_id % workers).
+    Поэтому обновления одного пользователя обрабатываются строго по очереди,
+    а обновления разных пользователей - параллельно.
+    Если очередь потока заполнена, submit() ждет, то есть получение обновлений замедляется вместе с обработкой.
+    """
+
+    def __init__(self, process: Callable[[Any], None], workers: int = handler_workers,
+                 queue_size: int = handler_queue_size) -> None:
+        """
+        :param process: функция, которая обрабатывает одно обновление
+        :param workers: количество потоков
+        :param queue_size: максимальная длина очереди одного потока
+        """
+
+        self._process = process
+        self._queues: List['queue.Queue[Optional[Tuple[float, Any]]]'] = [queue.Queue(maxsize=queue_size)
+                                                                          for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._stats: Dict[str, float] = {'submitted': 0, 'processed': 0, 'errors': 0,
+                                         'queue_wait': 0.0, 'queue_wait_max': 0.0}
+        self._threads: List[threading.Thread] = list()
+        for i_worker, i_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._work, args=(i_queue,), name='handler-{num}'.format(num=i_worker),
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, user_id: int, item: Any) -> None:
+        """ Ставит обновление в очередь потока пользователя. """
+
+        self._queues[user_id % len(self._queues)].put((time.monotonic(), item))
+        with self._lock:
+            self._stats['submitted'] += 1
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Возвращает счетчики: поставлено, обработано, ошибок, суммарное и максимальное ожидание в очереди (сек),
+        среднее ожидание и текущая длина очередей.
+        """
+
+        with self._lock:
+            stats: Dict[str, float] = dict(self._stats)
+        stats['queue_wait_avg'] = stats['queue_wait'] / stats['processed'] if stats['processed'] else 0.0
+        stats['queued'] = sum(i_queue.qsize() for i_queue in self._queues)
+
+        return stats
+
+    def _work(self, work_queue: 'queue.Queue[Optional[Tuple[float, Any]]]') -> None:
+        while True:
+            task: Optional[Tuple[float, Any]] = work_queue.get()
+            if task is None:
+                break
+            queued, item = task
+            wait: float = time.monotonic() - queued
+            try:
+                self._process(item)
+                failed: bool = False
+            except Exception as error:
+                failed = True
+                errors_total.inc('handler', type(error).__name__)
+                log.error('Ошибка обработки обновления', exc_info=error)
+
+            with self._lock:
+                self._stats['processed'] += 1
+                self._stats['errors'] += failed
+                self._stats['queue_wait'] += wait
+                self._stats['queue_wait_max'] = max(self._stats['queue_wait_max'], wait)
+
+    def stop(self) -> None:
+        """ Дожидается обработки поставленных обновлений и останавливает потоки. """
+
+        for i_queue in self._queues:
+            i_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        log.info('Обработчики остановлены: {stats}'.format(stats=self.stats()))
+
+
+class ShardedTeleBot(telebot.TeleBot):
+    """
+    TeleBot, который обрабатывает обновления в Dispatcher вместо собственного пула потоков:
+    размер пула и глубина очередей задаются в settings.py, обновления одного пользователя
+    (например, двойное нажатие "Повторить запрос") не обрабатываются одновременно.
+    Если задана функция on_processed, она получает update_id каждого обработанного обновления
+    (в том числе с ошибкой) - так общая очередь обновлений узнает, что обновление можно удалить.
+    """
+
+    def __init__(self, token: str, workers: int = handler_workers, queue_size: int = handler_queue_size,
+                 on_processed: Optional[Callable[[int], None]] = None, **kwargs: Any) -> None:
+        super().__init__(token, threaded=False, **kwargs)
+        self.dispatcher = Dispatcher(self._process_update, workers, queue_size)
+        self._on_processed = on_processed
+
+    def process_new_updates(self, updates: List[types.Update]) -> None:
+        for update in updates:
+            # polling запрашивает следующие обновления с last_update_id, поэтому он сдвигается сразу
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            self.dispatcher.submit(update_user_id(update), update)
+
+    def _process_update(self, update: types.Update) -> None:
+        kind: str = _update_kind(update)
+        with log_context(user_id=update_user_id(update), command=_update_command(update)), \
+                timer(handler_seconds, kind), trace_update('update ' + kind, update_id=update.update_id):
+            try:
+                super().process_new_updates([update])
+            finally:
+                if self._on_processed is not None:
+                    self._on_processed(update.update_id)
+
+    def _exec_task(self, task: Callable, *args: Any, **kwargs: Any) -> None:
+        # спан с именем обработчика (get_cities, callback_date, ...) внутри трассы обновления
+        with span(getattr(task, '__name__', 'handler')):
+            super()._exec_task(task, *args, **kwargs)
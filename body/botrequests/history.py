@@ -1,12 +1,13 @@
-from datetime import date, datetime, timedelta
+from datetime import date, timedelta
+import json
 import logging
-import re
-import time
 from typing import Dict, List, Tuple, Union
 
 import emoji
 from telebot import types
 
+from body.botrequests.parsing import nights_between, parse_date
+
 __all__ = ['f_date',
            'num_nights',
            'markup_hotels',
@@ -16,7 +17,9 @@ __all__ = ['f_date',
            'next_day',
            'markup_repeat_request',
            'history_txt',
-           'create_request_str']
+           'create_request_str',
+           'create_request_json',
+           'parse_request_json']
 
 log = logging.getLogger(__name__)
 
@@ -27,11 +30,7 @@ def f_date(date_str: str) -> date:
     :param date_str: дата
     """
 
-    date_str: str = ' '.join(date_str.split('-'))
-    date_tpl: time = time.strptime(date_str, '%Y %m %d')
-    my_date: date = date(date_tpl[0], date_tpl[1], date_tpl[2])
-
-    return my_date
+    return parse_date(date_str)
 
 
 def next_day(date_str: str) -> date:
@@ -40,12 +39,7 @@ def next_day(date_str: str) -> date:
     :param date_str: дата
     """
 
-    date_str: str = ' '.join(date_str.split('-'))
-    date_tpl: datetime = datetime.strptime(date_str, '%Y %m %d')
-    next_date_tpl: time = datetime.timetuple(date_tpl + timedelta(1))
-    next_date: date = date(next_date_tpl[0], next_date_tpl[1], next_date_tpl[2])
-
-    return next_date
+    return parse_date(date_str) + timedelta(1)
 
 
 def num_nights(date_1: str, date_2: str) -> int:
@@ -55,11 +49,7 @@ def num_nights(date_1: str, date_2: str) -> int:
     :param date_2: дата выезда
     """
 
-    num_days: str = str(f_date(date_2) - f_date(date_1))
-    pattern_days: str = r'\b\d+'
-    nights: int = int(re.match(pattern_days, num_days)[0])
-
-    return nights
+    return nights_between(date_1, date_2)
 
 
 def markup_hotels() -> types.ReplyKeyboardMarkup:
@@ -118,13 +108,16 @@ def markup_url(url: str) -> types.InlineKeyboardMarkup:
 
 def markup_repeat_request(id_req: str) -> types.InlineKeyboardMarkup:
     """
-    Функция, которая возвращает инлайновую кнопку "Повторить запрос"
+    Функция, которая возвращает инлайновые кнопки "Повторить запрос" (показ сохраненного результата)
+    и "Обновить цены" (новый поиск через API)
     """
 
     keyboard = types.InlineKeyboardMarkup()
     callback_button = types.InlineKeyboardButton(text="Повторить запрос " + emoji.emojize(':repeat_button:'),
                                                  callback_data=id_req)
-    keyboard.add(callback_button)
+    refresh_text: str = "Обновить цены " + emoji.emojize(':counterclockwise_arrows_button:')
+    refresh_button = types.InlineKeyboardButton(text=refresh_text, callback_data=''.join(('refresh:', id_req)))
+    keyboard.add(callback_button, refresh_button)
     log.info('создал клавиатуру')
     return keyboard
 
@@ -183,3 +176,35 @@ def create_request_str(req_dct: Dict[int, dict[Union[str, str]]]) -> str:
 
     except (ValueError, KeyError) as error:
         log.error('Проблема с полученным словарем', exc_info=error)
+
+
+def create_request_json(req_dct: Dict[int, dict]) -> str:
+    """
+    Функция, которая преобразует словарь полученного результата в JSON для повтора запроса из истории.
+    Фотографии сохраняются адресами, порядок отелей сохраняется.
+    :param req_dct: полученный результат
+    """
+
+    request_lst = list()
+    for hotel_id, hotel in req_dct.items():
+        hotel_json = {k: v for k, v in hotel.items() if k != 'photos'}
+        if hotel.get('photos'):
+            hotel_json['photos'] = [photo.media for photo in hotel['photos']]
+        request_lst.append([hotel_id, hotel_json])
+
+    return json.dumps(request_lst, ensure_ascii=False)
+
+
+def parse_request_json(request_json: str) -> Dict[int, dict]:
+    """
+    Функция, которая восстанавливает словарь результата из JSON, сохраненного create_request_json.
+    :param request_json: сохраненный результат
+    """
+
+    req_dct = dict()
+    for hotel_id, hotel in json.loads(request_json):
+        if hotel.get('photos'):
+            hotel['photos'] = [types.InputMediaPhoto(url_photo) for url_photo in hotel['photos']]
+        req_dct[hotel_id] = hotel
+
+    return req_dct
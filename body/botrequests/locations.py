@@ -0,0 +1,89 @@
+import logging
+import re
+from typing import Dict, List, Optional, Union
+
+import requests
+
+from body.botrequests.api_client import get_json
+from body.botrequests.cache import SqliteCache, TieredCache, TTLCache
+from body.botrequests.metrics import register_cache
+from settings import location_cache_size, location_cache_ttl, location_cache_persistent
+
+__all__ = ['get_cities_from_rapidapi',
+           'location_cache',
+           'location_key',
+           'parse_cities'
+           ]
+
+log = logging.getLogger(__name__)
+
+location_cache = TieredCache(TTLCache(location_cache_size, location_cache_ttl),
+                             SqliteCache('locations', location_cache_ttl) if location_cache_persistent else None
+                             )
+register_cache('locations', location_cache)
+
+
+def location_key(query: str, locale: str) -> str:
+    """
+    Функция, которая возвращает ключ кэша городов: запрос в нижнем регистре без лишних пробелов и локаль.
+    :param query: искомый город
+    :param locale: локаль
+    """
+
+    return '|'.join((locale, ' '.join(query.lower().replace('ё', 'е').split())))
+
+
+def parse_cities(response: dict) -> Optional[Dict[str, str]]:
+    """
+    Функция, которая из ответа /locations/v2/search выбирает города. Возвращает словарь - id города: название.
+    Если в ответе нет ни одного совпадения, возвращает None.
+    :param response: ответ API
+    """
+
+    city_dct = dict()
+    cities_lst: List[Dict[int: str]] = response['suggestions'][0]['entities']
+    if not cities_lst:
+        return None
+
+    for i_city in cities_lst:
+        if i_city['type'] == 'CITY':
+            city: str = re.sub(r"<span class='highlighted'>", '', i_city['caption'])
+            city: str = re.sub(r"</span>", '', city)
+            city_dct[i_city["destinationId"]] = city
+
+    return city_dct
+
+
+def get_cities_from_rapidapi(city: str, user_id: int) -> Union[Dict[str, str], str]:
+    """
+    Функция, которая принимает строку и ищет на rapidapi все города с совпадением по строке.
+    Возвращает словарь - id города: название (записывает его в запрос пользователя шаг диалога).
+    Если ничего не найдено, возвращает строку "Null".
+    В случае ошибки с API возвращает строку "Error"
+    Найденные города кэшируются (location_cache) по нормализованному запросу и локали.
+    :param city: искомый город
+    :param user_id: id пользователя
+    """
+
+    path = "/locations/v2/search"
+
+    querystring_city = {"query": city, "locale": "ru_RU"}
+    cache_key: str = location_key(city, querystring_city['locale'])
+
+    try:
+        city_dct: Dict[str, str] = location_cache.get(cache_key)
+        if city_dct is None:
+            response = get_json(path, querystring_city)
+            city_dct = parse_cities(response)
+            if city_dct is None:
+                return 'Null'
+
+            location_cache.set(cache_key, city_dct)
+
+        return city_dct
+
+    except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout, TypeError, KeyError,
+            requests.exceptions.JSONDecodeError, requests.exceptions.ReadTimeout, IndexError) as error:
+        log.error('Ошибка с получением города. user_id: {user_id}'.format(user_id=user_id), exc_info=error)
+
+        return 'Error'
@@ -0,0 +1,214 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import atexit
+import copy
+import json
+import logging
+import logging.config
+import logging.handlers
+import queue
+import random
+from typing import Any, Dict, Iterator, List, Optional
+
+from settings import LOGGING_CONFIG, log_format, log_queue_size, log_max_payload, log_payload_sample
+
+__all__ = ['JsonFormatter',
+           'Payload',
+           'log_context',
+           'update_log_context',
+           'get_log_context',
+           'log_payload',
+           'log_stats',
+           'setup_logging',
+           'stop_logging'
+           ]
+
+_context_fields = ('user_id', 'request_id', 'command')
+_log_context: ContextVar[Dict[str, Any]] = ContextVar('log_context', default=dict())
+_encoder = json.JSONEncoder(ensure_ascii=False, default=str)
+
+_queue_handler: Optional['_QueueHandler'] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """
+    Контекстный менеджер, который добавляет поля (user_id, request_id, command) ко всем записям журнала
+    внутри блока: в том же потоке или задаче asyncio. По выходу из блока прежние поля восстанавливаются.
+    Поля со значением None не добавляются.
+    """
+
+    token = _log_context.set(dict(_log_context.get(), **{k: v for k, v in fields.items() if v is not None}))
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def update_log_context(**fields: Any) -> None:
+    """
+    Функция, которая добавляет поля к текущему контексту журнала до конца обработки обновления
+    (до выхода из внешнего log_context).
+    """
+
+    _log_context.set(dict(_log_context.get(), **{k: v for k, v in fields.items() if v is not None}))
+
+
+def get_log_context() -> Dict[str, Any]:
+    """ Функция, которая возвращает поля текущего контекста журнала (user_id, request_id, command). """
+
+    return _log_context.get()
+
+
+class _ContextFilter(logging.Filter):
+    """ Добавляет к записи поля контекста потока или задачи, в которой она создана. """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context: Dict[str, Any] = _log_context.get()
+        for field in _context_fields:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field, '-'))
+
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """ Форматирует запись журнала в одну строку JSON с полями контекста запроса. """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {'time': self.formatTime(record, self.datefmt), 'level': record.levelname,
+                                 'logger': record.name, 'func': record.funcName, 'line': record.lineno,
+                                 'message': record.getMessage()}
+        for field in _context_fields:
+            value: Any = getattr(record, field, '-')
+            if value != '-':
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class Payload:
+    """
+    Большой объект (ответ API) для записи в журнал: строка строится только при записи
+    и не длиннее limit символов - JSON кодируется по частям, пока не наберется limit.
+    """
+
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value: Any, limit: int = log_max_payload) -> None:
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text: str = self.value if isinstance(self.value, str) else ''
+        if not text:
+            chunks: List[str] = list()
+            size: int = 0
+            for chunk in _encoder.iterencode(self.value):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > self.limit:
+                    break
+            text = ''.join(chunks)
+        if len(text) <= self.limit:
+            return text
+
+        return '{text}... (обрезано до {limit} символов)'.format(text=text[:self.limit], limit=self.limit)
+
+
+def log_payload(logger: logging.Logger, message: str, payload: Any, level: int = logging.INFO,
+                sample: float = log_payload_sample) -> None:
+    """
+    Функция, которая записывает в журнал большой объект (ответ API) обрезанным до log_max_payload символов
+    и только для доли sample вызовов: строка не строится, если уровень журнала отключен или вызов не попал в выборку.
+    :param logger: журнал
+    :param message: сообщение перед объектом
+    :param payload: объект
+    :param level: уровень записи
+    :param sample: доля вызовов, для которых объект записывается (0..1)
+    """
+
+    if logger.isEnabledFor(level) and random.random() < sample:
+        logger.log(level, '%s: %s', message, Payload(payload), stacklevel=2)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Кладет записи в ограниченную очередь, из которой их пишет фоновый поток.
+    Сообщение форматируется сразу (аргументы могут измениться после вызова),
+    а запись в файл не задерживает обработчики. Если очередь заполнена, запись отбрасывается и учитывается.
+    """
+
+    def __init__(self, log_queue: 'queue.Queue[logging.LogRecord]') -> None:
+        super().__init__(log_queue)
+        self.dropped: int = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def log_stats() -> Dict[str, int]:
+    """ Возвращает длину очереди журнала и количество отброшенных записей. """
+
+    if _queue_handler is None:
+        return {'queued': 0, 'dropped': 0}
+
+    return {'queued': _queue_handler.queue.qsize(), 'dropped': _queue_handler.dropped}
+
+
+def setup_logging(config: dict = LOGGING_CONFIG) -> None:
+    """
+    Функция, которая настраивает журнал по config (LOGGING_CONFIG) и переносит запись в фоновый поток:
+    обработчики корневого журнала заменяются ограниченной очередью (log_queue_size), из которой их вызывает
+    QueueListener. Если log_format = 'json', записи пишутся строками JSON. К каждой записи добавляются
+    поля контекста: user_id, request_id, command.
+    :param config: настройки журнала для logging.config.dictConfig
+    """
+
+    global _queue_handler, _listener
+
+    config = copy.deepcopy(config)
+    if log_format == 'json':
+        for name, formatter in config.get('formatters', dict()).items():
+            config['formatters'][name] = {'()': JsonFormatter, 'datefmt': formatter.get('datefmt')}
+    logging.config.dictConfig(config)
+
+    root: logging.Logger = logging.getLogger()
+    handlers: List[logging.Handler] = list(root.handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+        handler.addFilter(_ContextFilter())
+
+    _queue_handler = _QueueHandler(queue.Queue(maxsize=log_queue_size))
+    _queue_handler.addFilter(_ContextFilter())
+    root.addHandler(_queue_handler)
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """ Функция, которая дописывает накопленные в очереди записи и останавливает фоновый поток журнала. """
+
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,323 @@
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Sequence, Tuple
+
+from body.botrequests.tracing import SPAN_CLIENT, span
+from settings import metrics_enabled, metrics_host, metrics_port, metrics_buckets
+
+__all__ = ['Counter',
+           'Histogram',
+           'MetricsServer',
+           'TimedConnection',
+           'register_cache',
+           'register_gauge',
+           'render_metrics',
+           'timer',
+           'api_seconds',
+           'db_seconds',
+           'handler_seconds',
+           'send_seconds',
+           'search_seconds',
+           'errors_total',
+           'photo_requests_total'
+           ]
+
+log = logging.getLogger(__name__)
+
+_registry: List['_Metric'] = list()
+_caches: Dict[str, Any] = dict()
+_gauges: List[Tuple[str, str, Callable[[], float]]] = list()
+_null_timer = nullcontext()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs: List[str] = ['{name}="{value}"'.format(name=name, value=_escape(value))
+                        for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return '{{{pairs}}}'.format(pairs=','.join(pairs)) if pairs else ''
+
+
+class _Metric:
+    """ Метрика с метками: значения хранятся по кортежу значений меток. """
+
+    kind: str = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = dict()
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        lines: List[str] = ['# HELP {name} {doc}'.format(name=self.name, doc=self.documentation),
+                            '# TYPE {name} {kind}'.format(name=self.name, kind=self.kind)]
+        with self._lock:
+            values: List[Tuple[Tuple[str, ...], Any]] = [(key, self._copy(value))
+                                                         for key, value in self._values.items()]
+        for key, value in sorted(values):
+            lines.extend(self._lines(key, value))
+
+        return lines
+
+    def _copy(self, value: Any) -> Any:
+        return value
+
+    def _lines(self, key: Tuple[str, ...], value: Any) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """ Счетчик событий (например, ошибок по типу). """
+
+    kind = 'counter'
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        """ Увеличивает счетчик с метками labels. Если метрики выключены, ничего не делает. """
+
+        if not metrics_enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def _lines(self, key: Tuple[str, ...], value: float) -> List[str]:
+        return ['{name}{labels} {value}'.format(name=self.name, labels=_labels(self.labels, key), value=value)]
+
+
+class Histogram(_Metric):
+    """ Гистограмма длительностей (сек) с границами корзин metrics_buckets. """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = metrics_buckets) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        """ Добавляет наблюдение value с метками labels. Если метрики выключены, ничего не делает. """
+
+        if not metrics_enabled:
+            return
+        with self._lock:
+            state: Optional[list] = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _copy(self, value: list) -> list:
+        return [list(value[0]), value[1], value[2]]
+
+    def _lines(self, key: Tuple[str, ...], value: list) -> List[str]:
+        counts, total, count = value
+        lines: List[str] = list()
+        cumulative: int = 0
+        for bound, num in zip(self.buckets + (float('inf'),), counts):
+            cumulative += num
+            le: str = '+Inf' if bound == float('inf') else repr(float(bound))
+            lines.append('{name}_bucket{labels} {value}'.format(
+                name=self.name, labels=_labels(self.labels, key, 'le="{le}"'.format(le=le)), value=cumulative))
+        lines.append('{name}_sum{labels} {value}'.format(name=self.name, labels=_labels(self.labels, key), value=total))
+        lines.append('{name}_count{labels} {value}'.format(name=self.name, labels=_labels(self.labels, key),
+                                                           value=count))
+
+        return lines
+
+
+class _Timer:
+    """ Контекстный менеджер, который записывает длительность блока в гистограмму. """
+
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> '_Timer':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+def timer(histogram: Histogram, *labels: str) -> ContextManager:
+    """
+    Функция, которая возвращает контекстный менеджер, измеряющий длительность блока.
+    Если метрики выключены, возвращает общий пустой контекстный менеджер без замеров времени.
+    :param histogram: гистограмма
+    :param labels: значения меток
+    """
+
+    if not metrics_enabled:
+        return _null_timer
+
+    return _Timer(histogram, labels)
+
+
+def register_cache(name: str, cache: Any) -> None:
+    """
+    Функция, которая добавляет кэш (TTLCache, SqliteCache или TieredCache) в /metrics:
+    попадания и промахи читаются из cache.stats() только при запросе метрик.
+    :param name: имя кэша в метке cache
+    :param cache: кэш
+    """
+
+    _caches[name] = cache
+
+
+def register_gauge(name: str, documentation: str, func: Callable[[], float]) -> None:
+    """
+    Функция, которая добавляет в /metrics текущее значение func() (длина очереди, количество ожидающих отправок).
+    func вызывается только при запросе метрик.
+    :param name: имя метрики
+    :param documentation: описание
+    :param func: функция, которая возвращает значение
+    """
+
+    _gauges.append((name, documentation, func))
+
+
+def _cache_lines() -> List[str]:
+    lines: List[str] = list()
+    for result in ('hits', 'misses'):
+        lines.extend(['# HELP hotelbot_cache_{result}_total Обращения к кэшу: {result}'.format(result=result),
+                      '# TYPE hotelbot_cache_{result}_total counter'.format(result=result)])
+        for name, cache in sorted(_caches.items()):
+            stats: Dict[str, Any] = cache.stats()
+            # у TieredCache счетчики по уровням: {'memory': {...}, 'persistent': {...}}
+            levels: Dict[str, Dict[str, int]] = {'memory': stats} if result in stats else stats
+            for level, level_stats in sorted(levels.items()):
+                lines.append('hotelbot_cache_{result}_total{labels} {value}'.format(
+                    result=result, labels=_labels(('cache', 'level'), (name, level)), value=level_stats[result]))
+
+    return lines
+
+
+def render_metrics() -> str:
+    """ Функция, которая возвращает все метрики в текстовом формате Prometheus. """
+
+    lines: List[str] = list()
+    for metric in _registry:
+        lines.extend(metric.render())
+    lines.extend(_cache_lines())
+    for name, documentation, func in _gauges:
+        try:
+            value: float = func()
+        except Exception as error:
+            log.error('Ошибка получения метрики {name}'.format(name=name), exc_info=error)
+            continue
+        lines.extend(['# HELP {name} {doc}'.format(name=name, doc=documentation),
+                      '# TYPE {name} gauge'.format(name=name), '{name} {value}'.format(name=name, value=value)])
+
+    return '\n'.join(lines) + '\n'
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """
+    Курсор, который записывает длительность каждого запроса в db_seconds с меткой - первым словом запроса,
+    и создает спан запроса в трассе текущего обновления.
+    """
+
+    def execute(self, sql: str, *args: Any) -> '_TimedCursor':
+        statement: str = sql.split(None, 1)[0].upper().rstrip(';')
+        with _Timer(db_seconds, (statement,)), span('SQL ' + statement, SPAN_CLIENT, statement=sql):
+            return super().execute(sql, *args)
+
+    def executemany(self, sql: str, *args: Any) -> '_TimedCursor':
+        statement: str = sql.split(None, 1)[0].upper().rstrip(';')
+        with _Timer(db_seconds, (statement,)), span('SQL ' + statement, SPAN_CLIENT, statement=sql):
+            return super().executemany(sql, *args)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Соединение sqlite3, курсоры которого замеряют запросы
+    (factory для sqlite3.connect при metrics_enabled или включенной трассировке).
+    """
+
+    def cursor(self, factory: Callable[..., sqlite3.Cursor] = _TimedCursor) -> sqlite3.Cursor:
+        return super().cursor(factory)
+
+    def execute(self, sql: str, *args: Any) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql: str, *args: Any) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, *args)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """ Отдает метрики по GET /metrics. """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] != '/metrics':
+            body: bytes = b''
+            self.send_response(404)
+        else:
+            body = render_metrics().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        log.debug(format % args)
+
+
+class _HttpServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """ Локальный HTTP-сервер метрик: GET /metrics в текстовом формате Prometheus. """
+
+    def __init__(self, host: str = metrics_host, port: int = metrics_port) -> None:
+        self._httpd = _HttpServer((host, port), _MetricsHandler)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """ Адрес, на котором слушает сервер (порт 0 при создании - любой свободный). """
+
+        return self._httpd.server_address[:2]
+
+    def start(self) -> 'MetricsServer':
+        """ Запускает сервер в фоновом потоке. """
+
+        threading.Thread(target=self._httpd.serve_forever, name='metrics-http', daemon=True).start()
+        log.info('Метрики доступны на http://{host}:{port}/metrics'.format(host=self.address[0],
+                                                                            port=self.address[1]))
+        return self
+
+    def stop(self) -> None:
+        """ Останавливает сервер. """
+
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+api_seconds = Histogram('hotelbot_api_request_seconds', 'Время запроса к RapidAPI', ('endpoint',))
+db_seconds = Histogram('hotelbot_db_statement_seconds', 'Время запроса к БД', ('statement',))
+handler_seconds = Histogram('hotelbot_handler_seconds', 'Время обработки обновления Telegram', ('update',))
+send_seconds = Histogram('hotelbot_telegram_send_seconds', 'Время запроса отправки в Telegram', ('method',))
+search_seconds = Histogram('hotelbot_search_seconds', 'Время поиска: до первого отеля и полное', ('stage',))
+errors_total = Counter('hotelbot_errors_total', 'Ошибки по компонентам и типам', ('component', 'type'))
+photo_requests_total = Counter('hotelbot_photo_requests_total',
+                               'Адреса фотографий отелей: запросы к RapidAPI, из них фоновые обновления, '
+                               'и сэкономленные кэшем запросы', ('result',))
@@ -0,0 +1,146 @@
+import logging
+from typing import List, Optional, Tuple
+
+import sqlite3
+
+from body.botrequests.connection import get_connection
+
+__all__ = ['migrate']
+
+log = logging.getLogger(__name__)
+
+MIGRATIONS: List[Tuple[int, str, Tuple[str, ...]]] = [
+    (1, 'Таблицы users и history_requests', (
+        """CREATE TABLE IF NOT EXISTS users(
+           user_id INTEGER PRIMARY KEY,
+           first_name TEXT,
+           last_name TEXT,
+           username TEXT
+           );""",
+        """CREATE TABLE IF NOT EXISTS history_requests(
+           request_id INTEGER PRIMARY KEY AUTOINCREMENT,
+           date_create TEXT,
+           user_id INTEGER,
+           command TEXT,
+           city TEXT,
+           id_city TEXT,
+           check_in TEXT,
+           check_out TEXT,
+           min_price TEXT,
+           max_price TEXT,
+           min_distance TEXT,
+           max_distance TEXT,
+           num_hotels TEXT,
+           photos TEXT,
+           request TEXT);""",
+    )),
+    (2, 'Индекс history_requests(user_id, request_id)', (
+        "CREATE INDEX IF NOT EXISTS idx_history_requests_user_request ON history_requests(user_id, request_id);",
+    )),
+    (3, 'Числовые столбцы цен, расстояний и количеств, даты в формате ISO', (
+        """CREATE TABLE history_requests_typed(
+           request_id INTEGER PRIMARY KEY AUTOINCREMENT,
+           date_create TEXT,
+           user_id INTEGER NOT NULL,
+           command TEXT,
+           city TEXT,
+           id_city TEXT,
+           check_in TEXT,
+           check_out TEXT,
+           min_price INTEGER,
+           max_price INTEGER,
+           min_distance REAL,
+           max_distance REAL,
+           num_hotels INTEGER,
+           photos INTEGER,
+           request TEXT);""",
+        """INSERT INTO history_requests_typed
+           SELECT request_id, date_create, user_id, command, city, id_city,
+                  date(check_in), date(check_out),
+                  CAST(NULLIF(min_price, '') AS INTEGER), CAST(NULLIF(max_price, '') AS INTEGER),
+                  CAST(NULLIF(min_distance, '') AS REAL), CAST(NULLIF(max_distance, '') AS REAL),
+                  CAST(NULLIF(num_hotels, '') AS INTEGER), CAST(NULLIF(photos, '') AS INTEGER),
+                  request
+           FROM history_requests;""",
+        "DROP TABLE history_requests;",
+        "ALTER TABLE history_requests_typed RENAME TO history_requests;",
+        "CREATE INDEX IF NOT EXISTS idx_history_requests_user_request ON history_requests(user_id, request_id);",
+    )),
+    (4, 'Таблица api_cache для постоянного кэша ответов API', (
+        """CREATE TABLE IF NOT EXISTS api_cache(
+           namespace TEXT NOT NULL,
+           key TEXT NOT NULL,
+           value TEXT NOT NULL,
+           expires REAL NOT NULL,
+           PRIMARY KEY (namespace, key)
+           ) WITHOUT ROWID;""",
+    )),
+    (5, 'Результат запроса в JSON для повтора из истории', (
+        "ALTER TABLE history_requests ADD COLUMN request_json TEXT;",
+    )),
+    (6, 'Общее состояние процессов бота: диалоги, обработчики следующего шага, очередь обновлений', (
+        """CREATE TABLE IF NOT EXISTS dialog_states(
+           user_id INTEGER PRIMARY KEY,
+           request_id INTEGER NOT NULL UNIQUE,
+           command TEXT,
+           state TEXT NOT NULL,
+           touched REAL NOT NULL,
+           dirty INTEGER NOT NULL DEFAULT 0
+           );""",
+        """CREATE TABLE IF NOT EXISTS next_steps(
+           chat_id INTEGER PRIMARY KEY,
+           handlers TEXT NOT NULL,
+           updated REAL NOT NULL
+           );""",
+        """CREATE TABLE IF NOT EXISTS update_queue(
+           update_id INTEGER PRIMARY KEY,
+           shard INTEGER NOT NULL,
+           body TEXT NOT NULL,
+           received REAL NOT NULL,
+           taken INTEGER NOT NULL DEFAULT 0
+           );""",
+        "CREATE INDEX IF NOT EXISTS idx_update_queue_shard ON update_queue(shard, taken, update_id);",
+        """CREATE TABLE IF NOT EXISTS update_offset(
+           id INTEGER PRIMARY KEY CHECK (id = 0),
+           next_update_id INTEGER NOT NULL
+           );""",
+    )),
+]
+
+
+def migrate() -> Optional[str]:
+    """
+    Функция, которая приводит схему БД к последней версии. Вызывается один раз при запуске бота.
+    Применяет по порядку миграции, номер которых больше записанного в таблице "schema_version",
+    каждую в отдельной транзакции. Транзакция блокирует запись в БД (BEGIN IMMEDIATE), и номер проверяется
+    внутри нее, поэтому процессы бота, запущенные одновременно с одной БД, не применяют миграцию дважды.
+    """
+
+    conn = get_connection()
+    try:
+        conn.execute("""CREATE TABLE IF NOT EXISTS schema_version(
+                     version INTEGER PRIMARY KEY,
+                     description TEXT,
+                     applied TEXT DEFAULT (datetime('now'))
+                     );""")
+        current: int = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;").fetchone()[0]
+
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+
+            conn.execute('BEGIN IMMEDIATE;')
+            if conn.execute("SELECT 1 FROM schema_version WHERE version = ?;", (version,)).fetchone():
+                conn.execute('COMMIT;')
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute("INSERT INTO schema_version (version, description) VALUES(?, ?);", (version, description))
+            conn.execute('COMMIT;')
+            log.info('Применена миграция {version}: {description}'.format(version=version, description=description))
+
+    except sqlite3.DatabaseError as error:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK;')
+        log.error('migrate has not been successful', exc_info=error)
+        return 'Ошибка в migrate'
@@ -0,0 +1,89 @@
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from telebot.handler_backends import HandlerBackend, MemoryHandlerBackend
+
+from body.botrequests.connection import get_connection
+from settings import state_backend
+
+__all__ = ['SqliteHandlerBackend',
+           'next_step_backend'
+           ]
+
+log = logging.getLogger(__name__)
+
+
+class SqliteHandlerBackend(HandlerBackend):
+    """
+    Хранилище обработчиков следующего шага (register_next_step_handler) в общей БД (таблица "next_steps"):
+    шаг диалога переживает перезапуск процесса и доступен всем процессам бота, работающим с одной БД.
+    Обработчик хранится по имени функции и находится через resolve при получении, аргументы - в JSON.
+    """
+
+    def __init__(self, resolve: Callable[[str], Callable]) -> None:
+        """
+        :param resolve: функция, которая возвращает функцию-обработчик бота по ее имени
+        """
+
+        super().__init__()
+        self._resolve = resolve
+
+    def register_handler(self, handler_group_id: int, handler: Any) -> None:
+        conn = get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE;')
+            row: Optional[tuple] = conn.execute("SELECT handlers FROM next_steps WHERE chat_id = ?;",
+                                                (handler_group_id,)).fetchone()
+            handlers: List[Dict[str, Any]] = json.loads(row[0]) if row else list()
+            handlers.append({'callback': handler['callback'].__name__, 'args': list(handler['args']),
+                             'kwargs': handler['kwargs']})
+            conn.execute("INSERT OR REPLACE INTO next_steps (chat_id, handlers, updated) VALUES(?, ?, ?);",
+                         (handler_group_id, json.dumps(handlers), time.time()))
+            conn.execute('COMMIT;')
+
+        except sqlite3.DatabaseError:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK;')
+            raise
+
+    def clear_handlers(self, handler_group_id: int) -> None:
+        get_connection().execute("DELETE FROM next_steps WHERE chat_id = ?;", (handler_group_id,))
+
+    def get_handlers(self, handler_group_id: int) -> Optional[List[Dict[str, Any]]]:
+        """ Возвращает и удаляет обработчики чата: словари с ключами callback, args и kwargs, как у telebot. """
+
+        conn = get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE;')
+            row: Optional[tuple] = conn.execute("SELECT handlers FROM next_steps WHERE chat_id = ?;",
+                                                (handler_group_id,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM next_steps WHERE chat_id = ?;", (handler_group_id,))
+            conn.execute('COMMIT;')
+
+        except sqlite3.DatabaseError:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK;')
+            raise
+
+        if not row:
+            return None
+
+        return [{'callback': self._resolve(handler['callback']), 'args': handler['args'],
+                 'kwargs': handler['kwargs']} for handler in json.loads(row[0])]
+
+
+def next_step_backend(resolve: Callable[[str], Callable]) -> HandlerBackend:
+    """
+    Функция, которая возвращает хранилище обработчиков следующего шага для TeleBot по настройке state_backend:
+    'memory' - в памяти процесса (как по умолчанию в telebot), 'sqlite' - в общей БД.
+    :param resolve: функция, которая возвращает функцию-обработчик бота по ее имени
+    """
+
+    if state_backend == 'sqlite':
+        return SqliteHandlerBackend(resolve)
+
+    return MemoryHandlerBackend()
@@ -0,0 +1,120 @@
+from datetime import date
+from functools import lru_cache
+import re
+
+__all__ = ['parse_number',
+           'parse_price',
+           'parse_distance',
+           'parse_date',
+           'format_price',
+           'nights_between'
+           ]
+
+# число с разделителями разрядов (пробел, неразрывный пробел, точка, запятая) и дробной частью
+_number_re = re.compile(r'\d(?:[\d.,\s]*\d)?')
+_separators_re = re.compile(r'[.,\s]')
+_spaces_re = re.compile(r'\s')
+_miles_re = re.compile(r'mile|мил', re.IGNORECASE)
+_date_re = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+
+_km_in_mile = 1.609344
+
+
+def parse_number(text: str, decimal: str = ',', max_fraction: int = 3) -> float:
+    """
+    Функция, которая выделяет из строки первое число с учетом разделителей:
+    пробелы всегда разделяют разряды, последняя точка или запятая считается десятичной,
+    если встречается один раз, после нее не больше max_fraction цифр и это разделитель
+    локали (decimal) или после нее не ровно 3 цифры ("1 234,5" и "1,234.50" -> 1234.5, "RUB1,234" -> 1234.0).
+    Если числа в строке нет, вызывает ValueError.
+    :param text: строка с числом
+    :param decimal: десятичный разделитель локали (ru_RU - запятая)
+    :param max_fraction: максимальное количество цифр дробной части
+    """
+
+    match = _number_re.search(text)
+    if match is None:
+        raise ValueError('Нет числа в строке {text!r}'.format(text=text))
+
+    number: str = match.group()
+    if number.isdigit():
+        return float(number)
+
+    number = _spaces_re.sub('', number)
+    last: int = max(number.rfind(','), number.rfind('.'))
+    if last == -1:
+        return float(number)
+
+    separator: str = number[last]
+    integer: str = number[:last]
+    fraction: str = number[last + 1:]
+    if len(fraction) <= max_fraction and (separator == decimal or len(fraction) != 3) and \
+            separator not in integer:
+        if integer.isdigit():
+            return float(''.join((integer, '.', fraction)))
+        return float(''.join((_separators_re.sub('', integer), '.', fraction)))
+
+    return float(_separators_re.sub('', number))
+
+
+@lru_cache(maxsize=4096)
+def parse_price(price: str) -> float:
+    """
+    Функция, которая возвращает цену числом: "1 234 RUB" -> 1234.0, "1 234,56 RUB" -> 1234.56,
+    "RUB1,234" -> 1234.0. Цены повторяются от отеля к отелю, поэтому результат кэшируется.
+    :param price: цена из ответа API
+    """
+
+    return parse_number(price, max_fraction=2)
+
+
+@lru_cache(maxsize=4096)
+def parse_distance(distance: str) -> float:
+    """
+    Функция, которая возвращает расстояние в км: "1,2 км" -> 1.2, "0,5 мили" -> 0.8.
+    :param distance: расстояние из ответа API
+    """
+
+    distance_km: float = parse_number(distance)
+    if _miles_re.search(distance):
+        distance_km = round(distance_km * _km_in_mile, 1)
+
+    return distance_km
+
+
+@lru_cache(maxsize=1024)
+def parse_date(date_str: str) -> date:
+    """
+    Функция, которая преобразует дату 'yyyy-mm-dd' (в том числе без ведущих нулей) в datetime.date.
+    Даты заезда и выезда повторяются во всех запросах поиска, поэтому результат кэшируется.
+    :param date_str: дата
+    """
+
+    match = _date_re.fullmatch(date_str.strip())
+    if match is None:
+        raise ValueError('Неверный формат даты {date!r}'.format(date=date_str))
+
+    return date(int(match[1]), int(match[2]), int(match[3]))
+
+
+def nights_between(check_in: str, check_out: str) -> int:
+    """
+    Функция, которая возвращает количество ночей между датами заезда и выезда.
+    :param check_in: дата заезда
+    :param check_out: дата выезда
+    """
+
+    return (parse_date(check_out) - parse_date(check_in)).days
+
+
+def format_price(value: float, currency: str = 'RUB') -> str:
+    """
+    Функция, которая форматирует цену для пользователя: 12345.5 -> "12 345,5 RUB", 4000.0 -> "4 000 RUB".
+    :param value: цена
+    :param currency: валюта
+    """
+
+    price_str: str = '{value:,.2f}'.format(value=value).rstrip('0').rstrip('.')
+    price_str = price_str.replace(',', ' ').replace('.', ',')
+
+    return ' '.join((price_str, currency))
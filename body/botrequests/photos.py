@@ -0,0 +1,135 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Set, Union
+
+from telebot import types
+
+from body.botrequests.api_client import get_json
+from body.botrequests.cache import SqliteCache, TieredCache, TTLCache
+from body.botrequests.metrics import photo_requests_total, register_cache
+from settings import photo_workers, photo_cache_size, photo_cache_ttl, photo_cache_refresh
+
+__all__ = ['get_photo_urls',
+           'cached_photo_urls',
+           'save_photo_urls',
+           'photo_cache',
+           'submit_photos',
+           'photo_cache_stats'
+           ]
+
+log = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=photo_workers, thread_name_prefix='photos')
+
+photo_cache = TieredCache(TTLCache(photo_cache_size, photo_cache_ttl), SqliteCache('hotel_photos', photo_cache_ttl))
+register_cache('photos', photo_cache)
+_refreshing: Set[int] = set()
+_refresh_lock = threading.Lock()
+# счетчики меняются из потоков обработчиков и пула загрузки фотографий
+_stats_lock = threading.Lock()
+_stats = {'api_calls': 0, 'api_calls_saved': 0, 'refreshes': 0}
+
+
+def _count(name: str, result: str) -> None:
+    """ Увеличивает счетчик статистики кэша и метрику hotelbot_photo_requests_total. """
+
+    with _stats_lock:
+        _stats[name] += 1
+    photo_requests_total.inc(result)
+
+
+def save_photo_urls(hotel_id: int, response: dict) -> List[str]:
+    """
+    Функция, которая выбирает из ответа /properties/get-hotel-photos адреса фотографий отеля (baseUrl с шаблоном
+    {size}), сохраняет их в кэш вместе со временем получения и учитывает запрос к API в статистике.
+    :param hotel_id: id отеля
+    :param response: ответ API
+    """
+
+    _count('api_calls', 'api_call')
+    urls_lst: List[str] = [i_photo['baseUrl'] for i_photo in response['hotelImages']]
+    photo_cache.set(str(hotel_id), {'urls': urls_lst, 'fetched': time.time()})
+
+    return urls_lst
+
+
+def _load_photo_urls(hotel_id: int) -> List[str]:
+    """ Функция, которая запрашивает на rapidapi адреса фотографий отеля и сохраняет их в кэш. """
+
+    return save_photo_urls(hotel_id, get_json("/properties/get-hotel-photos", {"id": str(hotel_id)}))
+
+
+def _refresh(hotel_id: int) -> None:
+    """ Функция фонового обновления адресов фотографий отеля в кэше. """
+
+    try:
+        _load_photo_urls(hotel_id)
+        _count('refreshes', 'refresh')
+    except Exception as error:
+        log.error('Не удалось обновить фотографии отеля {hotel}'.format(hotel=hotel_id), exc_info=error)
+    finally:
+        with _refresh_lock:
+            _refreshing.discard(hotel_id)
+
+
+def get_photo_urls(hotel_id: int) -> List[str]:
+    """
+    Функция, которая возвращает адреса фотографий отеля из кэша (память и таблица api_cache),
+    а при промахе запрашивает их на rapidapi. Записи старше photo_cache_refresh отдаются из кэша
+    и обновляются в фоне. Исключения запроса к API пробрасываются вызывающей функции.
+    :param hotel_id: id отеля
+    """
+
+    cached: dict = photo_cache.get(str(hotel_id))
+    if cached is None:
+        return _load_photo_urls(hotel_id)
+
+    return cached_photo_urls(hotel_id, cached)
+
+
+def cached_photo_urls(hotel_id: int, cached: dict) -> List[str]:
+    """
+    Функция, которая возвращает адреса фотографий из записи кэша отеля: учитывает сэкономленный запрос
+    и запускает фоновое обновление записи старше photo_cache_refresh.
+    :param hotel_id: id отеля
+    :param cached: запись кэша (адреса и время получения)
+    """
+
+    _count('api_calls_saved', 'saved')
+    if time.time() - cached['fetched'] > photo_cache_refresh:
+        with _refresh_lock:
+            start_refresh: bool = hotel_id not in _refreshing
+            _refreshing.add(hotel_id)
+        if start_refresh:
+            _executor.submit(_refresh, hotel_id)
+
+    return cached['urls']
+
+
+def photo_cache_stats() -> Dict[str, Union[int, dict]]:
+    """
+    Функция, которая возвращает статистику кэша фотографий: запросы к API, сэкономленные запросы
+    (попадания в кэш) и фоновые обновления.
+    """
+
+    with _stats_lock:
+        stats: Dict[str, Union[int, dict]] = dict(_stats)
+
+    return dict(stats, cache=photo_cache.stats())
+
+
+def submit_photos(hotel_ids: Iterable[int], num_photos: Union[int, str],
+                  fetch: Callable[[int, Union[int, str]], Union[List[types.InputMediaPhoto], str]]
+                  ) -> Dict[int, Future]:
+    """
+    Функция, которая запускает загрузку фотографий отелей в общем ограниченном пуле потоков
+    и возвращает словарь id отеля: Future с результатом fetch.
+    :param hotel_ids: id отелей
+    :param num_photos: количество фотографий
+    :param fetch: функция загрузки фотографий одного отеля
+    """
+
+    return {hotel_id: _executor.submit(copy_context().run, fetch, hotel_id, num_photos) for hotel_id in hotel_ids}
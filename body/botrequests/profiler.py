@@ -0,0 +1,193 @@
+from collections import Counter
+from datetime import datetime
+import logging
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from types import FrameType
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from settings import profile_seconds, profile_interval, profile_threads, profile_dir, profile_top
+
+__all__ = ['ProfileResult',
+           'sample_threads',
+           'start_profile',
+           'profile_on_signal'
+           ]
+
+log = logging.getLogger(__name__)
+
+_running = threading.Lock()
+
+# файлы, кадры которых пропускаются при поиске функции, в которой поток ждет работу
+_wait_files = ('threading.py', 'queue.py', 'selectors.py')
+# циклы пулов потоков и цикл событий asyncio: поток, ждущий в них, простаивает
+_idle_functions = frozenset(('_worker', '_work', '_run', '_run_once'))
+_thread_number_re = re.compile(r'[-_]?\d+$')
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+
+    return '{func} ({file}:{line})'.format(func=code.co_name, file=os.path.basename(code.co_filename),
+                                           line=code.co_firstlineno)
+
+
+def _is_idle(frame: FrameType) -> bool:
+    """ Ждет ли поток новую работу: ближайшая к вершине стека функция вне threading/queue - цикл пула. """
+
+    while frame is not None and os.path.basename(frame.f_code.co_filename) in _wait_files:
+        frame = frame.f_back
+
+    return frame is not None and frame.f_code.co_name in _idle_functions
+
+
+class ProfileResult:
+    """
+    Результат профилирования: свернутые стеки (поток;функция;...;функция -> количество выборок),
+    количество выборок занятых потоков и простаивающих потоков, длительность и файл со стеками.
+    """
+
+    def __init__(self, stacks: Counter, samples: int, idle: int, seconds: float) -> None:
+        self.stacks = stacks
+        self.samples = samples
+        self.idle = idle
+        self.seconds = seconds
+        self.filename: Optional[str] = None
+
+    def top(self, num: int = profile_top) -> List[Tuple[str, int, int]]:
+        """
+        Возвращает num самых горячих по собственному времени функций: имя, выборки, в которых функция
+        на вершине стека (собственное время), и выборки, в которых функция есть в стеке (общее время,
+        с вызванными функциями).
+        """
+
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames: List[str] = stack.split(';')[1:]
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+
+        return [(frame, count, total[frame]) for frame, count in own.most_common(num)]
+
+    def dump(self, directory: str = profile_dir) -> str:
+        """
+        Записывает свернутые стеки в файл profile-<дата-время>.collapsed в directory (формат flamegraph.pl
+        и speedscope) и возвращает его имя.
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        self.filename = os.path.join(directory, 'profile-{time}.collapsed'.format(
+            time=datetime.now().strftime('%Y%m%d-%H%M%S')))
+        with open(self.filename, 'w', encoding='utf-8') as file:
+            for stack, count in self.stacks.most_common():
+                file.write('{stack} {count}\n'.format(stack=stack, count=count))
+
+        return self.filename
+
+    def report(self, num: int = profile_top) -> str:
+        """ Текстовый отчет для администратора: самые горячие функции в процентах выборок занятых потоков. """
+
+        lines: List[str] = ['Профиль за {sec:.0f} сек: выборок занятых потоков {samples}, простоя {idle}'.format(
+            sec=self.seconds, samples=self.samples, idle=self.idle)]
+        if self.filename:
+            lines.append('Стеки: {file}'.format(file=self.filename))
+        if self.samples:
+            lines.append('Функция: собственное / общее время')
+            for frame, own, total in self.top(num):
+                lines.append('{frame}: {own:.1f}% / {total:.1f}%'.format(
+                    frame=frame, own=own * 100 / self.samples, total=total * 100 / self.samples))
+
+        return '\n'.join(lines)
+
+
+def sample_threads(seconds: float, interval: float = profile_interval,
+                   threads: Sequence[str] = profile_threads) -> ProfileResult:
+    """
+    Функция, которая seconds секунд с интервалом interval снимает стеки потоков, имена которых начинаются
+    с threads (обработчики, отправка, фотографии), и возвращает свернутые стеки.
+    Выборки потоков, ждущих работу в цикле пула, не учитываются в стеках, а считаются простоем.
+    Профилирование не требует перезапуска и ничего не стоит, пока не запущено.
+    :param seconds: длительность (сек)
+    :param interval: интервал между выборками (сек)
+    :param threads: префиксы имен потоков
+    """
+
+    stacks: Counter = Counter()
+    samples: int = 0
+    idle: int = 0
+    own_id: int = threading.get_ident()
+    started: float = time.monotonic()
+    deadline: float = started + seconds
+    while time.monotonic() < deadline:
+        names: Dict[int, str] = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            name: str = names.get(thread_id, '')
+            if thread_id == own_id or not name.startswith(tuple(threads)):
+                continue
+            if _is_idle(frame):
+                idle += 1
+                continue
+
+            frames: List[str] = list()
+            while frame is not None:
+                frames.append(_frame_name(frame))
+                frame = frame.f_back
+            frames.append(_thread_number_re.sub('', name))
+            stacks[';'.join(reversed(frames))] += 1
+            samples += 1
+        time.sleep(interval)
+
+    return ProfileResult(stacks, samples, idle, time.monotonic() - started)
+
+
+def start_profile(seconds: float, on_done: Callable[[ProfileResult], None],
+                  threads: Sequence[str] = profile_threads) -> bool:
+    """
+    Функция, которая запускает профилирование на seconds секунд в фоновом потоке: стеки записываются
+    в profile_dir, отчет передается в on_done. Одновременно выполняется только одно профилирование:
+    если оно уже идет, возвращает False.
+    :param seconds: длительность (сек)
+    :param on_done: функция, которая получает результат
+    :param threads: префиксы имен профилируемых потоков
+    """
+
+    if not _running.acquire(blocking=False):
+        return False
+
+    def run() -> None:
+        try:
+            log.info('Профилирование потоков {threads} на {sec} сек'.format(threads=threads, sec=seconds))
+            result: ProfileResult = sample_threads(seconds, threads=threads)
+            result.dump()
+            log.info(result.report())
+            on_done(result)
+        except Exception as error:
+            log.error('Ошибка профилирования', exc_info=error)
+        finally:
+            _running.release()
+
+    threading.Thread(target=run, name='profiler', daemon=True).start()
+
+    return True
+
+
+def profile_on_signal(signum: Optional[int] = getattr(signal, 'SIGUSR1', None),
+                      threads: Sequence[str] = profile_threads) -> None:
+    """
+    Функция, которая назначает сигнал (по умолчанию SIGUSR1, kill -USR1 <pid>) запуском профилирования
+    на profile_seconds секунд: стеки записываются в profile_dir, отчет - в журнал.
+    Если сигнала нет (Windows) или бот запущен не в главном потоке (например, бенчмарком), ничего не делает.
+    :param signum: номер сигнала
+    :param threads: префиксы имен профилируемых потоков
+    """
+
+    if signum is None or threading.current_thread() is not threading.main_thread():
+        return
+
+    signal.signal(signum, lambda *args: start_profile(profile_seconds, lambda result: None, threads))
@@ -0,0 +1,151 @@
+from dataclasses import dataclass
+import logging
+from typing import Dict, List, Tuple, Union
+
+from body.botrequests.api_client import get_json
+from body.botrequests.cache import SingleFlight, TTLCache
+from body.botrequests.logs import log_payload
+from body.botrequests.metrics import register_cache
+from body.botrequests.parsing import format_price, parse_distance, parse_price
+from settings import search_cache_size, search_cache_ttl
+
+__all__ = ['Hotel',
+           'get_distance',
+           'get_properties',
+           'get_total_price',
+           'parse_properties',
+           'search_cache',
+           'search_key'
+           ]
+
+log = logging.getLogger(__name__)
+
+search_cache = TTLCache(search_cache_size, search_cache_ttl)
+register_cache('search', search_cache)
+_flights = SingleFlight()
+
+
+def get_total_price(price: str, night: int) -> str:
+    """
+    Функция, которая из строки с ценой выделяет число, умножает на количество ночей,
+    трансформирует в строку с валютой
+    :param price: цена за ночь
+    :param night: количество ночей
+    """
+
+    return format_price(parse_price(price) * night)
+
+
+def get_distance(distance: str) -> float:
+    """
+    Функция, которая из строки с расстоянием до центра ("1,2 км") выделяет число
+    :param distance: растояние до центра
+    """
+
+    return parse_distance(distance)
+
+
+@dataclass(frozen=True)
+class Hotel:
+    """
+    Нормализованная запись отеля из ответа /properties/list: только поля, нужные боту.
+    Цена и расстояние переводятся в числа один раз, при создании записи.
+    Записи хранятся в общем кэше search_cache, поэтому неизменяемые.
+    """
+
+    __slots__ = ('id', 'name', 'address', 'distance', 'price', 'distance_km', 'price_value')
+
+    id: int
+    name: str
+    address: str
+    distance: str
+    price: str
+    distance_km: float
+    price_value: float
+
+    @classmethod
+    def from_api(cls, i_hotel: dict) -> 'Hotel':
+        """
+        Создает запись из отеля в ответе API.
+        Если цену или расстояние не удалось разобрать, цена считается равной 0,
+        а расстояние - бесконечным (отель не попадет ни в один диапазон расстояний /bestdeal).
+        :param i_hotel: отель из ответа API
+        """
+
+        try:
+            address: str = i_hotel['address']['streetAddress']
+        except KeyError:
+            address = 'None'
+        distance: str = i_hotel['landmarks'][0]['distance']
+        price_dct: dict = i_hotel['ratePlan']['price']
+
+        try:
+            distance_km: float = parse_distance(distance)
+        except ValueError:
+            log.warning('Не удалось разобрать расстояние {distance!r}'.format(distance=distance))
+            distance_km = float('inf')
+        try:
+            price_value: float = float(price_dct.get('exactCurrent') or parse_price(price_dct['current']))
+        except ValueError:
+            log.warning('Не удалось разобрать цену {price!r}'.format(price=price_dct['current']))
+            price_value = 0.0
+
+        return cls(i_hotel['id'], i_hotel['name'], address, distance, price_dct['current'], distance_km, price_value)
+
+    def card(self, nights: int) -> Dict[str, str]:
+        """
+        Возвращает словарь для вывода пользователю.
+        :param nights: количество ночей
+        """
+
+        i_hotel_dct = dict()
+        i_hotel_dct['Название отеля']: str = self.name
+        i_hotel_dct['Адрес']: str = self.address
+        i_hotel_dct['Расстояние до центра']: str = self.distance
+        i_hotel_dct['Цена за ночь']: str = self.price
+        i_hotel_dct[f'Цена за {nights} ночей']: str = format_price(self.price_value * nights)
+        i_hotel_dct['url']: str = ''.join(('https://hotels.com/ho', str(self.id)))
+
+        return i_hotel_dct
+
+
+def search_key(querystring: Dict[str, Union[str, int, float]]) -> Tuple[Tuple[str, str], ...]:
+    """
+    Функция, которая возвращает ключ кэша search_cache: параметры запроса, упорядоченные по имени.
+    :param querystring: параметры запроса к API
+    """
+
+    return tuple(sorted((k, str(v)) for k, v in querystring.items()))
+
+
+def parse_properties(response: dict) -> List[Hotel]:
+    """
+    Функция, которая переводит ответ /properties/list в список нормализованных записей (Hotel).
+    :param response: ответ API
+    """
+
+    log_payload(log, 'Получен ответ /properties/list', response)
+
+    return [Hotel.from_api(i_hotel) for i_hotel in response['data']['body']['searchResults']['results']]
+
+
+def get_properties(querystring: Dict[str, Union[str, int, float]]) -> List[Hotel]:
+    """
+    Функция, которая возвращает страницу отелей /properties/list в виде списка нормализованных записей (Hotel).
+    Результаты кэшируются по параметрам поиска (search_cache) и общие для lowprice, highprice и bestdeal.
+    Одновременные одинаковые запросы объединяются в один запрос к API.
+    Записи в кэше общие для всех пользователей, изменять их нельзя.
+    :param querystring: параметры запроса к API
+    """
+
+    key: Tuple[Tuple[str, str], ...] = search_key(querystring)
+    hotels_lst: List[Hotel] = search_cache.get(key)
+    if hotels_lst is not None:
+        return hotels_lst
+
+    def fetch() -> List[Hotel]:
+        result: List[Hotel] = parse_properties(get_json("/properties/list", querystring))
+        search_cache.set(key, result)
+        return result
+
+    return _flights.do(key, fetch)
@@ -0,0 +1,207 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from telebot import apihelper, types
+
+from body.botrequests.connection import get_connection
+from body.botrequests.dispatcher import update_user_id
+from settings import bot_workers, bot_worker_index, route_poll_interval, route_batch
+
+__all__ = ['UpdateQueue',
+           'poll_updates'
+           ]
+
+log = logging.getLogger(__name__)
+
+
+class UpdateQueue:
+    """
+    Общая очередь обновлений в БД (таблица "update_queue") для нескольких процессов бота.
+    Процесс-получатель (bot_worker_index = 0) записывает обновления от Telegram с номером процесса-обработчика
+    user_id % workers: обновления одного пользователя всегда обрабатывает один процесс, по очереди.
+    Процесс-обработчик забирает обновления своего номера по порядку update_id и удаляет их после обработки,
+    поэтому обновления, не обработанные до остановки или падения процесса, обрабатываются после его перезапуска.
+    """
+
+    def __init__(self, workers: int = bot_workers, worker_index: int = bot_worker_index,
+                 batch: int = route_batch) -> None:
+        """
+        :param workers: количество процессов-обработчиков
+        :param worker_index: номер этого процесса
+        :param batch: максимальное количество обновлений, забираемых за раз
+        """
+
+        self._workers = workers
+        self._worker_index = worker_index
+        self._batch = batch
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {'put': 0, 'taken': 0, 'done': 0}
+
+    def put(self, updates: List[dict], offset: Optional[int] = None) -> None:
+        """
+        Записывает обновления (JSON от Telegram) в очередь одной транзакцией вместе со следующим offset getUpdates:
+        после перезапуска получатель продолжит с него, не теряя и не повторяя обновления.
+        Повторно полученные обновления (тот же update_id) пропускаются.
+        :param updates: обновления
+        :param offset: следующий offset getUpdates (для webhook - None)
+        """
+
+        rows: List[tuple] = [(update['update_id'], update_user_id(types.Update.de_json(update)) % self._workers,
+                              json.dumps(update, ensure_ascii=False), time.time()) for update in updates]
+        conn = get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE;')
+            conn.executemany("INSERT OR IGNORE INTO update_queue (update_id, shard, body, received) "
+                             "VALUES(?, ?, ?, ?);", rows)
+            if offset is not None:
+                conn.execute("INSERT OR REPLACE INTO update_offset (id, next_update_id) VALUES(0, ?);", (offset,))
+            conn.execute('COMMIT;')
+
+        # put выполняется в главном потоке процесса 0, куда приходит KeyboardInterrupt (SIGINT):
+        # незавершенная транзакция держала бы блокировку записи БД до закрытия соединения
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK;')
+            raise
+
+        with self._lock:
+            self._stats['put'] += len(rows)
+
+    def offset(self) -> Optional[int]:
+        """ Возвращает сохраненный offset getUpdates или None, если обновления еще не получались. """
+
+        row: Optional[tuple] = get_connection().execute("SELECT next_update_id FROM update_offset WHERE id = 0;"
+                                                        ).fetchone()
+
+        return row[0] if row else None
+
+    def release(self) -> int:
+        """
+        Возвращает в очередь обновления этого процесса, взятые до перезапуска, но не обработанные.
+        Возвращает их количество.
+        """
+
+        cur = get_connection().execute("UPDATE update_queue SET taken = 0 WHERE shard = ? AND taken = 1;",
+                                       (self._worker_index,))
+
+        return cur.rowcount
+
+    def take(self) -> List[dict]:
+        """
+        Забирает до batch необработанных обновлений этого процесса по порядку update_id.
+        Пустая очередь проверяется обычным чтением: транзакция записи (BEGIN IMMEDIATE) начинается,
+        только если обновления есть, и не блокирует остальные процессы при каждом опросе.
+        """
+
+        conn = get_connection()
+        if conn.execute("SELECT 1 FROM update_queue WHERE shard = ? AND taken = 0 LIMIT 1;",
+                        (self._worker_index,)).fetchone() is None:
+            return list()
+
+        try:
+            conn.execute('BEGIN IMMEDIATE;')
+            rows: List[tuple] = conn.execute("SELECT update_id, body FROM update_queue "
+                                             "WHERE shard = ? AND taken = 0 ORDER BY update_id LIMIT ?;",
+                                             (self._worker_index, self._batch)).fetchall()
+            conn.executemany("UPDATE update_queue SET taken = 1 WHERE update_id = ?;",
+                             [(update_id,) for update_id, _ in rows])
+            conn.execute('COMMIT;')
+
+        except sqlite3.DatabaseError:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK;')
+            raise
+
+        with self._lock:
+            self._stats['taken'] += len(rows)
+
+        return [json.loads(body) for _, body in rows]
+
+    def done(self, update_id: int) -> None:
+        """ Удаляет обработанное обновление из очереди. """
+
+        try:
+            get_connection().execute("DELETE FROM update_queue WHERE update_id = ?;", (update_id,))
+        except sqlite3.DatabaseError as error:
+            log.error('UpdateQueue.done has not been successful', exc_info=error)
+            return
+
+        with self._lock:
+            self._stats['done'] += 1
+
+    def pending(self) -> int:
+        """ Возвращает количество обновлений этого процесса в очереди (ожидающих и обрабатываемых). """
+
+        return get_connection().execute("SELECT COUNT(*) FROM update_queue WHERE shard = ?;",
+                                        (self._worker_index,)).fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        """ Возвращает счетчики процесса: записано в очередь, забрано, обработано. """
+
+        with self._lock:
+            return dict(self._stats)
+
+    def start_consumer(self, process: Callable[[dict], None], stop: threading.Event,
+                       interval: float = route_poll_interval) -> threading.Thread:
+        """
+        Функция, которая запускает фоновый поток, передающий обновления этого процесса в process.
+        Сначала возвращает в очередь обновления, взятые до перезапуска, затем опрашивает очередь
+        с интервалом interval, пока не установлен stop.
+        :param process: функция, которая получает обновление (JSON от Telegram)
+        :param stop: событие остановки
+        :param interval: интервал опроса пустой очереди (сек)
+        """
+
+        def run() -> None:
+            log.info('Процесс {num} из {workers}: возвращено в очередь необработанных обновлений {released}'.format(
+                num=self._worker_index, workers=self._workers, released=self.release()))
+            while not stop.is_set():
+                try:
+                    updates: List[dict] = self.take()
+                except sqlite3.DatabaseError as error:
+                    log.error('Ошибка чтения очереди обновлений', exc_info=error)
+                    updates = list()
+                for update in updates:
+                    try:
+                        process(update)
+                    except Exception as error:
+                        log.error('Ошибка разбора обновления {update_id}'.format(update_id=update.get('update_id')),
+                                  exc_info=error)
+                        self.done(update.get('update_id'))
+                if len(updates) < self._batch:
+                    stop.wait(interval)
+
+        thread = threading.Thread(target=run, name='router', daemon=True)
+        thread.start()
+
+        return thread
+
+
+def poll_updates(token: str, updates: UpdateQueue, stop: threading.Event, timeout: int = 20) -> None:
+    """
+    Функция, которая получает обновления от Telegram (getUpdates) и записывает их в общую очередь,
+    пока не установлен stop. Offset хранится в БД вместе с обновлениями, поэтому после перезапуска
+    получение продолжается с первого незаписанного обновления. Выполняется в процессе с bot_worker_index = 0.
+    :param token: токен бота
+    :param updates: общая очередь обновлений
+    :param stop: событие остановки
+    :param timeout: время ожидания обновлений в одном запросе (сек)
+    """
+
+    offset: Optional[int] = updates.offset()
+    log.info('Получение обновлений в общую очередь с offset {offset}'.format(offset=offset))
+    while not stop.is_set():
+        try:
+            result: List[dict] = apihelper.get_updates(token, offset=offset, timeout=timeout,
+                                                       long_polling_timeout=timeout)
+            if result:
+                updates.put(result, result[-1]['update_id'] + 1)
+                offset = result[-1]['update_id'] + 1
+
+        except Exception as error:
+            log.error('Ошибка получения обновлений', exc_info=error)
+            stop.wait(3)
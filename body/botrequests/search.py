@@ -0,0 +1,379 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import requests
+from telebot import types
+
+from body.botrequests.db_functions import get_search_request, set_request
+from body.botrequests.history import num_nights
+from body.botrequests.logs import update_log_context
+from body.botrequests.metrics import errors_total
+from body.botrequests.photos import get_photo_urls
+from body.botrequests.properties import Hotel, get_properties
+from body.botrequests.stream import HotelItem, with_photos
+from settings import (photo_size, bestdeal_max_pages, bestdeal_page_size, bestdeal_mode, bestdeal_candidates,
+                      bestdeal_price_weight, search_prefetch, search_prefetch_workers)
+
+__all__ = ['SearchRequest',
+           'SearchStrategy',
+           'LowPriceStrategy',
+           'HighPriceStrategy',
+           'BestDealStrategy',
+           'BestDealDistanceStrategy',
+           'strategies',
+           'register_strategy',
+           'load_search_request',
+           'Pager',
+           'prepare_search',
+           'stream_hotels',
+           'get_photos'
+           ]
+
+log = logging.getLogger(__name__)
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=search_prefetch_workers, thread_name_prefix='search')
+
+api_errors = (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout,
+              requests.exceptions.JSONDecodeError, TypeError, KeyError, IndexError, ValueError)
+
+
+@dataclass
+class SearchRequest:
+    """ Параметры поиска отелей из "history_requests". """
+
+    __slots__ = ('user_id', 'request_id', 'command', 'id_city', 'check_in', 'check_out', 'num_hotels', 'photos',
+                 'min_price', 'max_price', 'min_distance', 'max_distance', 'request')
+
+    user_id: int
+    request_id: int
+    command: str
+    id_city: str
+    check_in: str
+    check_out: str
+    num_hotels: int
+    photos: Optional[int]
+    min_price: Optional[int]
+    max_price: Optional[int]
+    min_distance: Optional[float]
+    max_distance: Optional[float]
+    request: Optional[str]
+
+    @property
+    def nights(self) -> int:
+        return num_nights(self.check_in, self.check_out)
+
+
+class SearchStrategy:
+    """
+    Стратегия поиска одной команды. Общий конвейер (stream_hotels) запрашивает страницы /properties/list
+    с параметрами querystring() и оставляет отели, прошедшие accept(), пока не наберется num_hotels
+    или не закончатся страницы (не больше max_pages).
+    Если ranked, подходящие отели со всех страниц собираются как кандидаты и упорядочиваются rank().
+    Новая команда - подкласс с нужной сортировкой, параметрами и отбором, зарегистрированный register_strategy().
+    """
+
+    sort_order: str = 'PRICE'
+    max_pages: int = 1
+    ranked: bool = False
+
+    def page_size(self, request: SearchRequest) -> int:
+        """ Размер страницы API: по умолчанию столько, сколько отелей запросил пользователь. """
+
+        return int(request.num_hotels)
+
+    def querystring(self, request: SearchRequest, page: int) -> Dict[str, Union[str, int, float]]:
+        """ Параметры запроса страницы page к /properties/list. """
+
+        return {"destinationId": request.id_city, "checkIn": request.check_in, "checkOut": request.check_out,
+                "pageSize": self.page_size(request), "pageNumber": str(page), "adults1": "1",
+                "sortOrder": self.sort_order, "locale": "ru_RU", "currency": "RUB"
+                }
+
+    def accept(self, hotel: Hotel, request: SearchRequest) -> bool:
+        """ Подходит ли отель под запрос. """
+
+        return True
+
+    def select(self, hotels_lst: List[Hotel], request: SearchRequest, found: int) -> List[Hotel]:
+        """
+        Отбирает подходящие отели страницы с учетом уже найденных (found), не больше num_hotels всего.
+        """
+
+        selected = list()
+        for hotel in hotels_lst:
+            if found + len(selected) >= int(request.num_hotels):
+                break
+            if self.accept(hotel, request):
+                selected.append(hotel)
+
+        return selected
+
+    def finished(self, hotels_lst: List[Hotel], request: SearchRequest, found: int, page: int) -> bool:
+        """ Нужно ли закончить поиск после страницы page. """
+
+        return found >= int(request.num_hotels) or page >= self.max_pages or \
+            len(hotels_lst) < self.page_size(request)
+
+    def rank(self, candidates: List[Hotel], request: SearchRequest) -> List[Hotel]:
+        """ Выбирает num_hotels лучших отелей из кандидатов (для ranked-стратегий). """
+
+        return candidates[:int(request.num_hotels)]
+
+
+class LowPriceStrategy(SearchStrategy):
+    """ /lowprice: самые дешевые отели. """
+
+    sort_order = 'PRICE'
+
+
+class HighPriceStrategy(SearchStrategy):
+    """ /highprice: самые дорогие отели. """
+
+    sort_order = 'PRICE_HIGHEST_FIRST'
+
+
+class BestDealStrategy(SearchStrategy):
+    """
+    /bestdeal: отели в диапазоне цен, подходящие по расстоянию от центра.
+    Подходящих по расстоянию отелей на странице может быть мало, поэтому страниц запрашивается
+    столько, сколько нужно для num_hotels, но не больше max_pages.
+    """
+
+    sort_order = 'PRICE'
+
+    def __init__(self, max_pages: int = bestdeal_max_pages, page_size: int = bestdeal_page_size) -> None:
+        self.max_pages = max_pages
+        self._page_size = page_size
+
+    def page_size(self, request: SearchRequest) -> int:
+        return self._page_size
+
+    def querystring(self, request: SearchRequest, page: int) -> Dict[str, Union[str, int, float]]:
+        querystring: Dict[str, Union[str, int, float]] = super().querystring(request, page)
+        querystring.update({"priceMin": request.min_price, "priceMax": request.max_price})
+
+        return querystring
+
+    def accept(self, hotel: Hotel, request: SearchRequest) -> bool:
+        return float(request.min_distance) <= hotel.distance_km <= float(request.max_distance)
+
+
+class BestDealDistanceStrategy(BestDealStrategy):
+    """
+    /bestdeal с сортировкой API по расстоянию до ориентира (центра города): отели ближе min_distance
+    пропускаются, страницы перестают запрашиваться, как только отели на странице дальше max_distance
+    или набрано candidates * num_hotels кандидатов. Кандидаты упорядочиваются по общей оценке
+    цены и расстояния: price_weight * цена / максимальная цена + (1 - price_weight) * расстояние / max_distance.
+    Страницы читаются от центра, поэтому для далекого редкого диапазона (min_distance дальше отелей
+    первых max_pages страниц) ничего не находится - режим включается только настройкой bestdeal_mode.
+    """
+
+    sort_order = 'DISTANCE_FROM_LANDMARK'
+    ranked = True
+
+    def __init__(self, max_pages: int = bestdeal_max_pages, page_size: int = bestdeal_page_size,
+                 candidates: int = bestdeal_candidates, price_weight: float = bestdeal_price_weight) -> None:
+        super().__init__(max_pages, page_size)
+        self.candidates = candidates
+        self.price_weight = price_weight
+
+    def select(self, hotels_lst: List[Hotel], request: SearchRequest, found: int) -> List[Hotel]:
+        return [hotel for hotel in hotels_lst if self.accept(hotel, request)]
+
+    def finished(self, hotels_lst: List[Hotel], request: SearchRequest, found: int, page: int) -> bool:
+        return found >= int(request.num_hotels) * self.candidates or page >= self.max_pages or \
+            len(hotels_lst) < self.page_size(request) or hotels_lst[-1].distance_km > float(request.max_distance)
+
+    def rank(self, candidates: List[Hotel], request: SearchRequest) -> List[Hotel]:
+        if not candidates:
+            return candidates
+
+        max_price: float = max(hotel.price_value for hotel in candidates) or 1.0
+        max_distance: float = float(request.max_distance) or 1.0
+
+        def score(hotel: Hotel) -> float:
+            return self.price_weight * hotel.price_value / max_price + \
+                (1 - self.price_weight) * hotel.distance_km / max_distance
+
+        return sorted(candidates, key=score)[:int(request.num_hotels)]
+
+
+strategies: Dict[str, SearchStrategy] = {'lowprice': LowPriceStrategy(),
+                                         'highprice': HighPriceStrategy(),
+                                         'bestdeal': BestDealDistanceStrategy() if bestdeal_mode == 'distance'
+                                         else BestDealStrategy()
+                                         }
+
+
+def register_strategy(command: str, strategy: SearchStrategy) -> None:
+    """
+    Функция, которая добавляет стратегию поиска для новой команды.
+    :param command: команда без "/"
+    :param strategy: стратегия
+    """
+
+    strategies[command] = strategy
+
+
+def load_search_request(user_id: int, request_id: int) -> Optional[SearchRequest]:
+    """
+    Функция, которая загружает параметры поиска из БД. В случае ошибки с БД возвращает None.
+    :param user_id: id пользователя
+    :param request_id: id запроса
+    """
+
+    row = get_search_request(user_id, request_id)
+    if not isinstance(row, dict):
+        return None
+
+    return SearchRequest(user_id=user_id, request_id=request_id, **row)
+
+
+def get_photos(hotel_id: int, num_photos: Union[int, str]) -> Union[List[types.InputMediaPhoto], str]:
+    """
+    Функция, которая для заданного отеля ищет на rapidapi заданное количество фотографий и
+    возвращает список из types.InputMediaPhoto.
+    В случае ошибки возвращает строку "Error".
+    :param hotel_id: id отеля
+    :param num_photos: количество фотографий
+    """
+
+    try:
+        urls_lst: List[str] = get_photo_urls(hotel_id)
+
+        return [types.InputMediaPhoto(urls_lst[i_photo].format(size=photo_size)) for i_photo in range(int(num_photos))]
+
+    except api_errors as error:
+        log.error('Ошибка с получением фотографий', exc_info=error)
+
+        return 'Error'
+
+
+class Pager:
+    """
+    Постраничный отбор отелей по стратегии: какую страницу /properties/list запросить следующей
+    и какие отели страницы отдать пользователю. Запросы к API выполняет вызывающая функция,
+    поэтому отбор общий у синхронного (_pages) и асинхронного (async_api.pages_async) поиска.
+    """
+
+    def __init__(self, strategy: SearchStrategy, request: SearchRequest) -> None:
+        self.strategy = strategy
+        self.request = request
+        self.page: int = 1
+        self.found: int = 0
+        self.finished: bool = False
+        self._nights: int = request.nights
+        self._candidates: List[Hotel] = list()
+
+    def querystring(self) -> Dict[str, Union[str, int, float]]:
+        """ Параметры запроса следующей страницы self.page. """
+
+        return self.strategy.querystring(self.request, self.page)
+
+    def feed(self, hotels_lst: List[Hotel]) -> Dict[int, dict]:
+        """
+        Обрабатывает очередную страницу и возвращает партию отелей для пользователя - словарь
+        id отеля: словарь с данными отеля (может быть пустым). Для ranked-стратегий партия одна -
+        лучшие отели из кандидатов со всех страниц, после последней страницы.
+        :param hotels_lst: отели страницы self.page
+        """
+
+        strategy, request = self.strategy, self.request
+        selected: List[Hotel] = strategy.select(hotels_lst, request, self.found)
+        self.found += len(selected)
+        self.finished = strategy.finished(hotels_lst, request, self.found, self.page)
+        self.page += 1
+
+        if strategy.ranked:
+            self._candidates.extend(selected)
+            selected = strategy.rank(self._candidates, request) if self.finished else list()
+
+        return {hotel.id: hotel.card(self._nights) for hotel in selected}
+
+
+def _pages(strategy: SearchStrategy, request: SearchRequest, prefetch: bool = search_prefetch
+           ) -> Iterator[Dict[int, dict]]:
+    """
+    Отдает отобранные стратегией отели постранично в виде словарей id отеля: словарь с данными отеля.
+    Если после страницы отелей еще не хватает, следующая страница запрашивается в фоне (prefetch),
+    пока отели текущей страницы загружают фотографии и отправляются пользователю.
+    Как только набрано num_hotels отелей, страницы больше не запрашиваются.
+    """
+
+    pager = Pager(strategy, request)
+    next_page: Optional[Future] = None
+    while True:
+        if next_page is not None:
+            hotels_lst: List[Hotel] = next_page.result()
+        else:
+            hotels_lst: List[Hotel] = get_properties(pager.querystring())
+        batch: Dict[int, dict] = pager.feed(hotels_lst)
+
+        if pager.finished:
+            yield batch
+            return
+
+        next_page = _prefetch_executor.submit(copy_context().run, get_properties,
+                                              pager.querystring()) if prefetch else None
+        if batch:
+            yield batch
+
+
+def prepare_search(user_id: int, request_id: int) -> Optional[Tuple[SearchRequest, SearchStrategy]]:
+    """
+    Функция, которая загружает параметры поиска из БД и выбирает стратегию команды запроса.
+    Если параметров или стратегии нет, возвращает None.
+    :param user_id: id пользователя
+    :param request_id: id запроса
+    """
+
+    request: Optional[SearchRequest] = load_search_request(user_id, request_id)
+    strategy: Optional[SearchStrategy] = strategies.get(request.command) if request else None
+    if strategy is None:
+        log.error('Нет параметров или стратегии поиска для запроса {request_id}. user_id: {user_id}'.format(
+            request_id=request_id, user_id=user_id))
+        return None
+
+    update_log_context(request_id=request_id, command=request.command)
+
+    return request, strategy
+
+
+def stream_hotels(user_id: int, request_id: int) -> Iterator[HotelItem]:
+    """
+    Функция-генератор, которая ищет отели на rapidapi по стратегии команды запроса и отдает их по одному
+    (id отеля, словарь с данными отеля), как только готовы фотографии очередного отеля.
+    После последнего отеля сохраняет результат в запрос request_id (history_requests [request]):
+    новый поиск по запросу из истории ("Обновить цены") заменяет сохраненный результат.
+    Если ничего не найдено, отдает строку "По вашему запросу ничего не найдено.".
+    В случае ошибки с API отдает строку "Технические неполадки с сайтом, попробуйте еще раз."
+    :param user_id: id пользователя
+    :param request_id: id запроса
+    """
+
+    search: Optional[Tuple[SearchRequest, SearchStrategy]] = prepare_search(user_id, request_id)
+    if search is None:
+        yield 'Техническая неполадка. Попробуйте еще раз!'
+        return
+
+    request, strategy = search
+    hotel_dct = dict()
+    try:
+        for hotel_id, hotel in with_photos(_pages(strategy, request), request.photos, get_photos):
+            hotel_dct[hotel_id] = hotel
+            yield hotel_id, hotel
+
+        if not hotel_dct:
+            yield 'По вашему запросу ничего не найдено.'
+            return
+
+        set_request(user_id, request_id, hotel_dct)
+
+    except api_errors as error:
+        errors_total.inc('search', type(error).__name__)
+        log.error('Ошибка с получением отелей. user_id: {user_id}'.format(user_id=user_id), exc_info=error)
+
+        yield 'Технические неполадки с сайтом, попробуйте еще раз.'
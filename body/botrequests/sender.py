@@ -0,0 +1,260 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from telebot.apihelper import ApiTelegramException
+
+from body.botrequests.metrics import errors_total, send_seconds, timer
+from settings import send_chat_rate, send_chat_burst, send_global_rate, send_global_burst, send_workers, send_retries
+
+__all__ = ['TokenBucket',
+           'SendScheduler',
+           'retry_after'
+           ]
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Корзина токенов: пополняется на rate токенов в секунду, но не больше capacity.
+    Одна отправка расходует cost токенов, поэтому после паузы допускается всплеск до capacity сообщений.
+    """
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', '_lock')
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens: float = capacity
+        self.updated: float = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost: float = 1, now: Optional[float] = None) -> float:
+        """ Возвращает время (сек), через которое в корзине будет cost токенов, 0 - отправлять можно сейчас. """
+
+        with self._lock:
+            self._refill(time.monotonic() if now is None else now)
+            return max(0.0, (min(cost, self.capacity) - self.tokens) / self.rate)
+
+    def take(self, cost: float = 1, now: Optional[float] = None) -> None:
+        """ Расходует cost токенов. """
+
+        with self._lock:
+            self._refill(time.monotonic() if now is None else now)
+            self.tokens -= min(cost, self.capacity)
+
+    def reserve(self, cost: float = 1, now: Optional[float] = None) -> float:
+        """
+        Расходует cost токенов в долг и возвращает время (сек), которое нужно подождать перед отправкой.
+        Используется там, где ожидание не блокирует поток (асинхронный режим).
+        """
+
+        with self._lock:
+            self._refill(time.monotonic() if now is None else now)
+            self.tokens -= min(cost, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def full(self, now: Optional[float] = None) -> bool:
+        """ Возвращает True, если корзина полная (чат давно ничего не отправлял). """
+
+        with self._lock:
+            self._refill(time.monotonic() if now is None else now)
+            return self.tokens >= self.capacity
+
+
+def retry_after(error: Exception) -> Optional[int]:
+    """
+    Функция, которая возвращает retry_after (сек) из ответа Telegram 429 Too Many Requests,
+    или None, если ошибка другая.
+    :param error: исключение, полученное при отправке
+    """
+
+    if getattr(error, 'error_code', None) != 429:
+        return None
+    result_json: Dict[str, Any] = getattr(error, 'result_json', None) or dict()
+
+    return int(result_json.get('parameters', dict()).get('retry_after', 1))
+
+
+class _Job:
+    __slots__ = ('method', 'args', 'kwargs', 'cost', 'on_error', 'attempts')
+
+    def __init__(self, method: str, args: Tuple[Any, ...], kwargs: Dict[str, Any], cost: float,
+                 on_error: Optional[Callable[[Exception], None]]) -> None:
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.cost = cost
+        self.on_error = on_error
+        self.attempts: int = 0
+
+
+class SendScheduler:
+    """
+    Планировщик исходящих сообщений бота.
+    send() только ставит сообщение в очередь чата и сразу возвращает управление обработчику.
+    Поток планировщика выдает сообщения в пул отправки, соблюдая лимиты Telegram корзинами токенов:
+    отдельная корзина на каждый чат и общая на бота. Сообщения одного чата отправляются строго по очереди,
+    при ответе 429 сообщение повторяется через retry_after секунд.
+    """
+
+    prune_interval = 60
+
+    def __init__(self, bot: Any, chat_rate: float = send_chat_rate, chat_burst: float = send_chat_burst,
+                 global_rate: float = send_global_rate, global_burst: float = send_global_burst,
+                 workers: int = send_workers, retries: int = send_retries) -> None:
+        self._bot = bot
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._retries = retries
+        self._global = TokenBucket(global_rate, global_burst)
+        self._buckets: Dict[int, TokenBucket] = dict()
+        self._queues: Dict[int, Deque[_Job]] = dict()
+        self._active: Set[int] = set()
+        self._heap: List[Tuple[float, int, int]] = list()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped: bool = False
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='send')
+        self._thread = threading.Thread(target=self._run, name='send-scheduler', daemon=True)
+        self._thread.start()
+
+    def send(self, chat_id: int, method: str, *args: Any, cost: float = 1,
+             on_error: Optional[Callable[[Exception], None]] = None, **kwargs: Any) -> None:
+        """
+        Ставит вызов метода бота в очередь чата.
+        :param chat_id: id чата, первый аргумент метода
+        :param method: имя метода бота (send_message, send_media_group, ...)
+        :param cost: сколько токенов расходует отправка
+        :param on_error: вызывается при ошибке отправки; остальные сообщения с тем же on_error отменяются
+        """
+
+        job = _Job(method, args, kwargs, cost, on_error)
+        with self._cond:
+            self._queues.setdefault(chat_id, deque()).append(job)
+            if chat_id not in self._active:
+                self._active.add(chat_id)
+                heapq.heappush(self._heap, (time.monotonic(), next(self._seq), chat_id))
+                self._cond.notify()
+
+    def pending(self) -> int:
+        """ Возвращает количество сообщений в очередях. """
+
+        with self._cond:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """ Дожидается отправки поставленных в очередь сообщений (не дольше timeout сек) и останавливает потоки. """
+
+        deadline: Optional[float] = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._active:
+                remaining: Optional[float] = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    log.warning('Не отправлено сообщений: {num}'.format(
+                        num=sum(len(queue) for queue in self._queues.values())))
+                    break
+                self._cond.wait(remaining)
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket: Optional[TokenBucket] = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+
+        return bucket
+
+    def _prune(self) -> None:
+        """ Удаляет корзины чатов, которые давно ничего не отправляли (полная корзина равна новой). """
+
+        now: float = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._buckets.items()
+                        if chat_id not in self._active and bucket.full(now)]:
+            del self._buckets[chat_id]
+
+    def _run(self) -> None:
+        pruned: float = time.monotonic()
+        with self._cond:
+            while not self._stopped:
+                now: float = time.monotonic()
+                if now - pruned >= self.prune_interval:
+                    self._prune()
+                    pruned = now
+
+                if not self._heap:
+                    self._cond.wait(self.prune_interval)
+                    continue
+
+                ready, _, chat_id = self._heap[0]
+                if ready > now:
+                    self._cond.wait(ready - now)
+                    continue
+                heapq.heappop(self._heap)
+
+                job: _Job = self._queues[chat_id][0]
+                bucket: TokenBucket = self._bucket(chat_id)
+                wait: float = max(bucket.delay(job.cost, now), self._global.delay(job.cost, now))
+                if wait > 0:
+                    heapq.heappush(self._heap, (now + wait, next(self._seq), chat_id))
+                    continue
+
+                bucket.take(job.cost, now)
+                self._global.take(job.cost, now)
+                self._queues[chat_id].popleft()
+                self._executor.submit(self._send, chat_id, job)
+
+    def _send(self, chat_id: int, job: _Job) -> None:
+        """ Выполняет отправку в потоке пула; следующее сообщение чата планируется только после завершения. """
+
+        delay: float = 0
+        failed: Optional[Exception] = None
+        try:
+            with timer(send_seconds, job.method):
+                getattr(self._bot, job.method)(chat_id, *job.args, **job.kwargs)
+
+        except ApiTelegramException as error:
+            delay = retry_after(error) or 0
+            if delay and job.attempts < self._retries:
+                job.attempts += 1
+                log.warning('Ответ 429 для чата {chat_id}, повтор через {delay} сек'.format(chat_id=chat_id,
+                                                                                          delay=delay))
+                with self._cond:
+                    self._queues[chat_id].appendleft(job)
+            else:
+                failed = error
+
+        except Exception as error:
+            failed = error
+
+        if failed is not None:
+            errors_total.inc('telegram', type(failed).__name__)
+            log.error('Ошибка отправки {method}. chat_id: {chat_id}'.format(method=job.method, chat_id=chat_id),
+                      exc_info=failed)
+            if job.on_error is not None:
+                with self._cond:
+                    self._queues[chat_id] = deque(i_job for i_job in self._queues[chat_id]
+                                                  if i_job.on_error is not job.on_error)
+
+        with self._cond:
+            if self._queues[chat_id]:
+                heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), chat_id))
+            else:
+                del self._queues[chat_id]
+                self._active.discard(chat_id)
+            self._cond.notify_all()
+
+        if failed is not None and job.on_error is not None:
+            job.on_error(failed)
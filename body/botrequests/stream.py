@@ -0,0 +1,58 @@
+from concurrent.futures import Future, TimeoutError
+import logging
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
+
+from telebot import types
+
+from body.botrequests.metrics import errors_total
+from body.botrequests.photos import submit_photos
+from settings import photo_deadline
+
+__all__ = ['HotelItem',
+           'with_photos'
+           ]
+
+log = logging.getLogger(__name__)
+
+HotelItem = Union[Tuple[int, Dict[str, Union[str, List[types.InputMediaPhoto]]]], str]
+
+
+def with_photos(batches: Iterable[Dict[int, dict]], num_photos: Union[int, str],
+                fetch: Callable[[int, Union[int, str]], Union[List[types.InputMediaPhoto], str]],
+                deadline: float = photo_deadline) -> Iterator[Tuple[int, dict]]:
+    """
+    Функция-генератор, которая по мере получения партий отелей (страниц API) сразу запускает загрузку
+    фотографий всех отелей партии и отдает отели по порядку, как только готовы фотографии очередного отеля.
+    Пока пользователь получает первые отели, фотографии следующих продолжают загружаться.
+    Ограничение deadline действует на весь поиск: отели, фотографии которых не успели загрузиться
+    или загрузились с ошибкой, отдаются без фотографий.
+    :param batches: партии отелей - словари id отеля: карточка отеля
+    :param num_photos: количество фотографий (0 - без фотографий)
+    :param fetch: функция загрузки фотографий одного отеля
+    :param deadline: ограничение времени на загрузку всех фотографий (сек)
+    """
+
+    started: float = time.monotonic()
+    for batch in batches:
+        if not num_photos:
+            yield from batch.items()
+            continue
+
+        futures: Dict[int, Future] = submit_photos(batch.keys(), num_photos, fetch)
+        for hotel_id, hotel in batch.items():
+            try:
+                photo_lst: Union[List[types.InputMediaPhoto], str] = \
+                    futures[hotel_id].result(timeout=max(0.0, started + deadline - time.monotonic()))
+                if isinstance(photo_lst, list) and photo_lst:
+                    hotel['photos'] = photo_lst
+            except TimeoutError:
+                futures[hotel_id].cancel()
+                errors_total.inc('photos', 'TimeoutError')
+                log.warning('Фотографии отеля {hotel} не загружены за {deadline} сек'.format(hotel=hotel_id,
+                                                                                            deadline=deadline))
+            except Exception as error:
+                errors_total.inc('photos', type(error).__name__)
+                log.error('Ошибка с получением фотографий отеля {hotel}'.format(hotel=hotel_id), exc_info=error)
+
+            yield hotel_id, hotel
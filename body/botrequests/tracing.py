@@ -0,0 +1,370 @@
+import atexit
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar, Token
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+from body.botrequests.logs import get_log_context
+from settings import trace_sample_rate, trace_exporter, trace_file, trace_otlp_endpoint, trace_queue_size
+
+__all__ = ['Span',
+           'SPAN_INTERNAL',
+           'SPAN_SERVER',
+           'SPAN_CLIENT',
+           'span',
+           'begin_trace',
+           'end_trace',
+           'trace_update',
+           'trace_id',
+           'register_request_resolver',
+           'FileExporter',
+           'OtlpExporter',
+           'trace_stats',
+           'setup_tracing',
+           'stop_tracing'
+           ]
+
+log = logging.getLogger(__name__)
+
+# виды спанов OTLP
+SPAN_INTERNAL = 1
+SPAN_SERVER = 2
+SPAN_CLIENT = 3
+
+_service_name = 'hotelbot'
+_batch_size = 256
+
+_current_trace: ContextVar[Optional['_Trace']] = ContextVar('current_trace', default=None)
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+_resolver: Optional[Callable[[int], Optional[int]]] = None
+
+_queue: Optional['queue.Queue[Optional[Tuple[str, List[Span]]]]'] = None
+_thread: Optional[threading.Thread] = None
+_stats = {'exported': 0, 'dropped': 0}
+
+
+class Span:
+    """ Участок трассы: имя, вид, родитель, время начала и конца (нс от эпохи), атрибуты и ошибка. """
+
+    __slots__ = ('name', 'kind', 'span_id', 'parent_id', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, name: str, kind: int, parent_id: Optional[str], attributes: Dict[str, Any]) -> None:
+        self.name = name
+        self.kind = kind
+        self.span_id: str = '{:016x}'.format(random.getrandbits(64))
+        self.parent_id = parent_id
+        self.start: int = time.time_ns()
+        self.end: int = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value: Any) -> None:
+        """ Добавляет атрибут спана (например, код ответа HTTP). """
+
+        self.attributes[key] = value
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.end = time.time_ns()
+        if error is not None:
+            self.error = '{type}: {error}'.format(type=type(error).__name__, error=error)
+
+
+class _NullSpan:
+    """ Спан выключенной трассировки: атрибуты не сохраняются. """
+
+    __slots__ = ()
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+
+_null_span = nullcontext(_NullSpan())
+
+
+class _Trace:
+    """
+    Спаны одного обновления Telegram: копятся в памяти и выгружаются в end_trace.
+    При создании трасса и ее корневой спан становятся текущими в контексте потока или задачи asyncio.
+    """
+
+    __slots__ = ('root', 'spans', 'closed', 'tokens')
+
+    def __init__(self, root: Span) -> None:
+        self.root = root
+        self.spans: List[Span] = list()
+        self.closed: bool = False
+        self.tokens: Tuple[Token, Token] = (_current_span.set(root), _current_trace.set(self))
+
+
+class _SpanContext:
+    """ Контекстный менеджер спана: спан становится родителем спанов внутри блока, в том числе в пулах потоков. """
+
+    __slots__ = ('trace', 'span', 'token')
+
+    def __init__(self, trace: _Trace, name: str, kind: int, attributes: Dict[str, Any]) -> None:
+        self.trace = trace
+        parent: Optional[Span] = _current_span.get()
+        self.span = Span(name, kind, parent.span_id if parent else None, attributes)
+
+    def __enter__(self) -> Span:
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type: Any, error: Optional[BaseException], traceback: Any) -> None:
+        self.span.finish(error)
+        _current_span.reset(self.token)
+        # спаны, которые закончились после выгрузки трассы (например, опоздавшая фотография), отбрасываются
+        if not self.trace.closed:
+            self.trace.spans.append(self.span)
+
+
+def span(name: str, kind: int = SPAN_INTERNAL, **attributes: Any) -> ContextManager:
+    """
+    Функция, которая возвращает контекстный менеджер спана name внутри трассы текущего обновления.
+    Вне обновления или при выключенной трассировке возвращает общий пустой контекстный менеджер.
+    Менеджер возвращает спан, в который можно добавить атрибуты: span.set('http.status_code', 200).
+    :param name: имя спана, например "GET /properties/list"
+    :param kind: вид спана (SPAN_INTERNAL, SPAN_CLIENT)
+    :param attributes: атрибуты спана
+    """
+
+    trace: Optional[_Trace] = _current_trace.get()
+    if trace is None or trace.closed:
+        return _null_span
+
+    return _SpanContext(trace, name, kind, attributes)
+
+
+def begin_trace(name: str, **attributes: Any) -> Optional[_Trace]:
+    """
+    Функция, которая начинает трассу обработки обновления: корневой спан name и буфер спанов в контексте
+    потока или задачи asyncio. Если трассировка не запущена (setup_tracing), возвращает None.
+    :param name: имя корневого спана, например "update message"
+    :param attributes: атрибуты корневого спана
+    """
+
+    if _queue is None:
+        return None
+
+    return _Trace(Span(name, SPAN_SERVER, None, attributes))
+
+
+def end_trace(trace: Optional[_Trace], error: Optional[BaseException] = None) -> None:
+    """
+    Функция, которая заканчивает трассу обновления и ставит ее спаны в очередь выгрузки,
+    если обновление относится к запросу из "history_requests" и запрос попал в выборку.
+    Запрос берется из контекста журнала (request_id) или по пользователю - из register_request_resolver.
+    :param trace: трасса из begin_trace
+    :param error: исключение обработчика
+    """
+
+    if trace is None:
+        return
+
+    trace.root.finish(error)
+    trace.closed = True
+    _current_span.reset(trace.tokens[0])
+    _current_trace.reset(trace.tokens[1])
+
+    context: Dict[str, Any] = get_log_context()
+    request_id: Optional[int] = context.get('request_id')
+    if request_id is None and _resolver is not None and context.get('user_id') is not None:
+        request_id = _resolver(context['user_id'])
+    export_queue = _queue
+    if request_id is None or export_queue is None or not _sampled(request_id):
+        return
+
+    trace.root.attributes.update({field: context[field] for field in ('user_id', 'command') if field in context})
+    trace.root.set('request_id', request_id)
+    try:
+        export_queue.put_nowait((trace_id(request_id), [trace.root] + trace.spans))
+    except queue.Full:
+        _stats['dropped'] += 1
+
+
+@contextmanager
+def trace_update(name: str, **attributes: Any) -> Iterator[None]:
+    """ Контекстный менеджер трассы обработки одного обновления (begin_trace и end_trace). """
+
+    trace: Optional[_Trace] = begin_trace(name, **attributes)
+    try:
+        yield
+    except BaseException as error:
+        end_trace(trace, error)
+        raise
+    end_trace(trace)
+
+
+def _sampled(request_id: int) -> bool:
+    """
+    Попадает ли запрос в выборку trace_sample_rate. Решение зависит только от request_id,
+    поэтому все обновления диалога одного запроса либо выгружаются, либо нет.
+    """
+
+    return (request_id * 2654435761) % 2 ** 32 < trace_sample_rate * 2 ** 32
+
+
+def trace_id(request_id: int) -> str:
+    """
+    Функция, которая возвращает id трассы запроса (32 шестнадцатеричных символа OTLP):
+    спаны всех обновлений запроса попадают в одну трассу.
+    :param request_id: id запроса из "history_requests"
+    """
+
+    return hashlib.blake2b(str(request_id).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def register_request_resolver(func: Callable[[int], Optional[int]]) -> None:
+    """
+    Функция, которая задает поиск текущего запроса пользователя для обновлений, в контексте журнала которых
+    нет request_id (шаги диалога до поиска). func вызывается с user_id после обработчика и не должна обращаться к БД.
+    :param func: функция user_id -> request_id или None
+    """
+
+    global _resolver
+    _resolver = func
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def _encode(batch: List[Tuple[str, List[Span]]]) -> Dict[str, Any]:
+    """ Пакет трасс в формате OTLP JSON (ExportTraceServiceRequest). """
+
+    spans: List[Dict[str, Any]] = list()
+    for i_trace_id, i_spans in batch:
+        for i_span in i_spans:
+            encoded: Dict[str, Any] = {'traceId': i_trace_id, 'spanId': i_span.span_id, 'name': i_span.name,
+                                       'kind': i_span.kind, 'startTimeUnixNano': str(i_span.start),
+                                       'endTimeUnixNano': str(i_span.end),
+                                       'attributes': [_attribute(k, v) for k, v in i_span.attributes.items()]}
+            if i_span.parent_id:
+                encoded['parentSpanId'] = i_span.parent_id
+            if i_span.error:
+                encoded['status'] = {'code': 2, 'message': i_span.error}
+            spans.append(encoded)
+
+    return {'resourceSpans': [{'resource': {'attributes': [_attribute('service.name', _service_name)]},
+                               'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}]}]}
+
+
+class FileExporter:
+    """
+    Дописывает пакеты трасс в файл строками OTLP JSON: файл читает приемник otlpjsonfile коллектора
+    OpenTelemetry, а трассу одного запроса можно найти по trace_id(request_id).
+    """
+
+    def __init__(self, filename: str = trace_file) -> None:
+        if os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self._file = open(filename, 'a', encoding='utf-8')
+
+    def export(self, payload: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(payload, ensure_ascii=False))
+        self._file.write('\n')
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class OtlpExporter:
+    """ Отправляет пакеты трасс в коллектор OpenTelemetry по OTLP/HTTP в формате JSON. """
+
+    def __init__(self, endpoint: str = trace_otlp_endpoint, timeout: float = 5) -> None:
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def export(self, payload: Dict[str, Any]) -> None:
+        response = self._session.post(self.endpoint, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+
+    def close(self) -> None:
+        self._session.close()
+
+
+def _export(exporter: Any, export_queue: 'queue.Queue[Optional[Tuple[str, List[Span]]]]') -> None:
+    """ Выгружает трассы из очереди пакетами до _batch_size трасс, пока не получит None. """
+
+    stopping: bool = False
+    while not stopping:
+        batch: List[Optional[Tuple[str, List[Span]]]] = [export_queue.get()]
+        while len(batch) < _batch_size:
+            try:
+                batch.append(export_queue.get_nowait())
+            except queue.Empty:
+                break
+        if None in batch:
+            stopping = True
+            batch = [item for item in batch if item is not None]
+        if not batch:
+            continue
+
+        try:
+            exporter.export(_encode(batch))
+            _stats['exported'] += len(batch)
+        except Exception as error:
+            _stats['dropped'] += len(batch)
+            log.error('Ошибка выгрузки трасс', exc_info=error)
+
+    exporter.close()
+
+
+def trace_stats() -> Dict[str, int]:
+    """ Возвращает количество выгруженных, ожидающих и отброшенных трасс. """
+
+    return {'exported': _stats['exported'], 'queued': _queue.qsize() if _queue is not None else 0,
+            'dropped': _stats['dropped']}
+
+
+def setup_tracing(exporter: str = trace_exporter) -> None:
+    """
+    Функция, которая запускает трассировку, если trace_sample_rate > 0: трассы выгружаются фоновым потоком
+    в файл trace_file ('file') или в коллектор trace_otlp_endpoint ('otlp').
+    Если трассировка не запущена, спаны не создаются.
+    :param exporter: 'file' или 'otlp'
+    """
+
+    global _queue, _thread
+
+    if trace_sample_rate <= 0 or _queue is not None:
+        return
+
+    export_queue: 'queue.Queue[Optional[Tuple[str, List[Span]]]]' = queue.Queue(maxsize=trace_queue_size)
+    _thread = threading.Thread(target=_export, args=(OtlpExporter() if exporter == 'otlp' else FileExporter(),
+                                                     export_queue),
+                               name='trace-export', daemon=True)
+    _thread.start()
+    _queue = export_queue
+    atexit.register(stop_tracing)
+    log.info('Трассировка запущена: доля запросов {rate}, выгрузка {exporter}'.format(rate=trace_sample_rate,
+                                                                                     exporter=exporter))
+
+
+def stop_tracing() -> None:
+    """ Функция, которая выгружает накопленные трассы и останавливает фоновый поток трассировки. """
+
+    global _queue
+
+    if _queue is not None:
+        export_queue, _queue = _queue, None
+        export_queue.put(None)
+        _thread.join()
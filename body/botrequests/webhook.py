@@ -0,0 +1,232 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hmac
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+from telebot import apihelper
+
+from settings import (webhook_host, webhook_port, webhook_path, webhook_secret, webhook_queue_size, webhook_workers,
+                      webhook_max_body, api_timeout)
+
+__all__ = ['WebhookServer',
+           'set_webhook',
+           'delete_webhook'
+           ]
+
+log = logging.getLogger(__name__)
+
+_telegram_api = 'https://api.telegram.org/bot{0}/{1}'
+_secret_header = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def _api_url(token: str, method: str) -> str:
+    """ Адрес метода Bot API: тот же сервер, что у telebot (apihelper.API_URL, по умолчанию api.telegram.org). """
+
+    return (apihelper.API_URL or _telegram_api).format(token, method)
+
+
+def set_webhook(token: str, url: str, secret: str = webhook_secret, max_connections: int = webhook_workers) -> bool:
+    """
+    Функция, которая регистрирует адрес webhook в Telegram вместе с секретным токеном:
+    Telegram будет передавать его в заголовке X-Telegram-Bot-Api-Secret-Token каждого обновления.
+    Возвращает True, если Telegram принял адрес.
+    :param token: токен бота
+    :param url: публичный адрес webhook (https)
+    :param secret: секретный токен
+    :param max_connections: количество одновременных соединений Telegram с сервером
+    """
+
+    params: Dict[str, str] = {'url': url, 'max_connections': str(max_connections)}
+    if secret:
+        params['secret_token'] = secret
+    response = requests.post(_api_url(token, 'setWebhook'), data=params, timeout=api_timeout)
+    result: dict = response.json()
+    if not result.get('ok'):
+        log.error('Telegram не принял webhook: {result}'.format(result=result))
+
+    return bool(result.get('ok'))
+
+
+def delete_webhook(token: str) -> bool:
+    """
+    Функция, которая удаляет webhook, чтобы бот снова мог получать обновления через polling.
+    :param token: токен бота
+    """
+
+    response = requests.post(_api_url(token, 'deleteWebhook'), timeout=api_timeout)
+
+    return bool(response.json().get('ok'))
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    """ Обработчик HTTP-запросов webhook: проверяет путь и секрет, кладет тело обновления в очередь. """
+
+    protocol_version = 'HTTP/1.1'
+    server: '_HttpServer'
+
+    def do_POST(self) -> None:
+        webhook: WebhookServer = self.server.webhook
+        if self.path != webhook.path:
+            self._reply(404)
+            return
+
+        if webhook.secret and not hmac.compare_digest(self.headers.get(_secret_header, ''), webhook.secret):
+            webhook.count('unauthorized')
+            self._reply(403)
+            return
+
+        length: int = int(self.headers.get('Content-Length') or 0)
+        if not 0 < length <= webhook.max_body:
+            webhook.count('rejected')
+            self._reply(413 if length else 400)
+            return
+
+        body: str = self.rfile.read(length).decode('utf-8')
+        if webhook.put(body):
+            self._reply(200)
+        else:
+            # сервер останавливается или очередь заполнена: Telegram повторит доставку
+            self.close_connection = webhook.closed
+            self._reply(503)
+
+    def do_GET(self) -> None:
+        self._reply(404)
+
+    def _reply(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        log.debug(format % args)
+
+
+class _HttpServer(ThreadingHTTPServer):
+    daemon_threads = True
+    webhook: 'WebhookServer'
+
+
+class WebhookServer:
+    """
+    HTTP-сервер webhook: принимает обновления Telegram, проверяет секретный токен и складывает их
+    в ограниченную очередь, из которой обновления разбирает пул обработчиков.
+    Если очередь заполнена, сервер отвечает 503 и Telegram повторит доставку позже,
+    поэтому всплеск обновлений не растит память и время ожидания без ограничений.
+    """
+
+    def __init__(self, process: Callable[[str], None], host: str = webhook_host, port: int = webhook_port,
+                 path: str = webhook_path, secret: str = webhook_secret, queue_size: int = webhook_queue_size,
+                 workers: int = webhook_workers, max_body: int = webhook_max_body) -> None:
+        """
+        :param process: функция, которая обрабатывает тело одного обновления (JSON-строка)
+        """
+
+        self.path = path
+        self.secret = secret
+        self.max_body = max_body
+        self._process = process
+        self._queue: 'queue.Queue[Optional[Tuple[float, str]]]' = queue.Queue(maxsize=queue_size)
+        self._num_workers = workers
+        self._workers: List[threading.Thread] = list()
+        self._lock = threading.Lock()
+        self.closed: bool = False
+        self._stats: Dict[str, float] = {'received': 0, 'processed': 0, 'errors': 0, 'rejected': 0,
+                                         'unauthorized': 0, 'queue_wait': 0.0}
+        self._httpd = _HttpServer((host, port), _WebhookHandler)
+        self._httpd.webhook = self
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """ Адрес, на котором слушает сервер (порт 0 при создании - любой свободный). """
+
+        return self._httpd.server_address[:2]
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._stats[name] += value
+
+    def stats(self) -> Dict[str, float]:
+        """ Возвращает счетчики сервера: принято, обработано, ошибок, отклонено, текущая длина очереди. """
+
+        with self._lock:
+            stats: Dict[str, float] = dict(self._stats)
+        stats['queue'] = self._queue.qsize()
+
+        return stats
+
+    def put(self, body: str) -> bool:
+        """
+        Кладет обновление в очередь, возвращает False, если очередь заполнена или сервер останавливается:
+        соединения keep-alive живут и после shutdown(), а принятое после остановки обработчиков обновление
+        потерялось бы, хотя Telegram получил ответ 200.
+        """
+
+        with self._lock:
+            if self.closed:
+                return False
+            try:
+                self._queue.put_nowait((time.monotonic(), body))
+            except queue.Full:
+                self._stats['rejected'] += 1
+                log.debug('Очередь обновлений заполнена, обновление отклонено')
+                return False
+            self._stats['received'] += 1
+
+        return True
+
+    def _work(self) -> None:
+        while True:
+            item: Optional[Tuple[float, str]] = self._queue.get()
+            if item is None:
+                break
+            queued, body = item
+            self.count('queue_wait', time.monotonic() - queued)
+            try:
+                self._process(body)
+                self.count('processed')
+            except Exception as error:
+                self.count('errors')
+                log.error('Ошибка обработки обновления', exc_info=error)
+
+    def start(self) -> 'WebhookServer':
+        """ Запускает пул обработчиков и HTTP-сервер в фоновых потоках. """
+
+        for i_worker in range(self._num_workers):
+            worker = threading.Thread(target=self._work, name='webhook-{num}'.format(num=i_worker), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        threading.Thread(target=self._httpd.serve_forever, name='webhook-http', daemon=True).start()
+        log.info('Webhook-сервер запущен на {host}:{port}{path}'.format(host=self.address[0], port=self.address[1],
+                                                                       path=self.path))
+
+        return self
+
+    def serve_forever(self) -> None:
+        """ Запускает сервер и работает до KeyboardInterrupt, затем останавливает его. """
+
+        self.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """ Останавливает прием обновлений и дожидается обработки уже принятых. """
+
+        with self._lock:
+            self.closed = True
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers.clear()
+        log.info('Webhook-сервер остановлен: {stats}'.format(stats=self.stats()))
@@ -1,4 +1,4 @@
-from decouple import config
+from decouple import config, Csv
 
 
 INFO_LOG_FILENAME = "../log/logfile.log"
@@ -8,7 +8,8 @@ LOGGING_CONFIG = {
     "disable_existing_loggers": False,
     "formatters": {
         "default": {
-            "format": "%(asctime)s -- %(name)s -- %(funcName)s -- line: %(lineno)d -- %(levelname)s -- %(message)s",
+            "format": "%(asctime)s -- %(name)s -- %(funcName)s -- line: %(lineno)d -- %(levelname)s -- "
+                      "user_id: %(user_id)s -- request_id: %(request_id)s -- %(command)s -- %(message)s",
             "datefmt": "%Y-%m-%d %H:%M:%S",
         }
     },
@@ -18,19 +19,148 @@ LOGGING_CONFIG = {
             "level": "INFO",
             "filename": INFO_LOG_FILENAME,
             "formatter": "default",
-            "maxBytes": 2e20,
-            "backupCount": 2,
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 5,
             "encoding": "utf-8",
         },
     },
     "root": {"level": "INFO", "handlers": ["logfile"]},
 }
 
+# журнал: формат записей ('json' или 'text'), длина очереди фоновой записи, максимальная длина
+# записываемого ответа API (символов) и доля ответов API, которые попадают в журнал
+log_format = 'json'
+log_queue_size = 10000
+log_max_payload = 2000
+log_payload_sample = 0.01
+
 headers_request = {'x-rapidapi-host': "hotels4.p.rapidapi.com",
                    'x-rapidapi-key': config('x-rapidapi-key')
                    }
+
+# общая HTTP-сессия RapidAPI: размер пула keep-alive соединений, таймаут (сек), повторы при 429/5xx
+api_base_url = 'https://hotels4.p.rapidapi.com'
+api_timeout = 15
+api_pool_size = 32
+api_retries = 3
+api_backoff = 0.5
+
+# кэш подсказок городов: размер LRU в памяти, время жизни (сек), постоянный уровень в SQLite
+location_cache_size = 1024
+location_cache_ttl = 24 * 60 * 60
+location_cache_persistent = True
+
+# кэш результатов /properties/list (нормализованные отели): размер и время жизни (сек)
+search_cache_size = 256
+search_cache_ttl = 5 * 60
+
+# поиск отелей: предварительный запрос следующей страницы и количество потоков для него,
+# bestdeal: размер страницы и максимальное количество страниц на один поиск
+search_prefetch = True
+search_prefetch_workers = 8
+bestdeal_page_size = 25
+bestdeal_max_pages = 5
+# режим bestdeal: 'price' - сортировка по цене и отбор по расстоянию, 'distance' - сортировка API по расстоянию
+# до центра и оценка цены и расстояния (страницы читаются от центра, поэтому далекий редкий диапазон
+# не достигается за bestdeal_max_pages страниц); для 'distance' - сколько кандидатов собирать
+# на один отель и вес цены в оценке (0..1)
+bestdeal_mode = 'price'
+bestdeal_candidates = 3
+bestdeal_price_weight = 0.5
+
+# файл БД: задается в .env, чтобы несколько процессов бота работали с одной БД
+db_name = config('db_name', default='users.db')
+db_cached_statements = 256
+db_busy_timeout = 5.0
+
+# время жизни состояния диалога в памяти (сек) и интервал фонового сохранения в БД (None - отключено)
+dialog_ttl = 3600
+dialog_flush_interval = 5
+# хранилище состояний диалогов и обработчиков следующего шага: 'memory' - в памяти процесса,
+# 'sqlite' - в общей БД db_name (переживают перезапуск, обязательно для нескольких процессов)
+state_backend = config('state_backend', default='memory')
+
+# несколько процессов бота с общей БД: количество процессов и номер этого процесса (задаются в .env).
+# Процесс 0 получает обновления от Telegram (polling или webhook) и записывает их в общую очередь,
+# каждый процесс обрабатывает обновления пользователей с user_id % bot_workers, равным его номеру;
+# интервал опроса пустой очереди (сек) и количество обновлений, забираемых за раз
+bot_workers = config('bot_workers', default=1, cast=int)
+bot_worker_index = config('bot_worker_index', default=0, cast=int)
+route_poll_interval = 0.05
+route_batch = 100
+if bot_workers > 1:
+    LOGGING_CONFIG['handlers']['logfile']['filename'] = '../log/logfile-{num}.log'.format(num=bot_worker_index)
+
+# отправка сообщений: лимиты Telegram (сообщений в сек на чат и на бота), допустимый всплеск,
+# потоки отправки, количество повторов при ответе 429 и ожидание отправки очереди при остановке (сек)
+send_chat_rate = 1
+send_chat_burst = 3
+send_global_rate = 30
+send_global_burst = 30
+send_workers = 8
+send_retries = 3
+send_drain_timeout = 30
+
+# обработчики обновлений: количество потоков (обновления одного пользователя обрабатываются по очереди
+# в одном потоке) и максимальная длина очереди потока
+handler_workers = 8
+handler_queue_size = 100
+
+# получение обновлений: 'polling' или 'webhook'; адрес webhook и секретный токен задаются в .env
+bot_mode = config('bot_mode', default='polling')
+webhook_url = config('webhook_url', default='')
+webhook_secret = config('webhook_secret', default='')
+# webhook-сервер: адрес и путь, размер очереди обновлений, количество обработчиков, максимальный размер тела (байт)
+webhook_host = '0.0.0.0'
+webhook_port = 8443
+webhook_path = '/webhook'
+webhook_queue_size = 1000
+webhook_workers = 8
+webhook_max_body = 1024 * 1024
+
+# асинхронный режим (async_main.py): количество потоков для запросов к БД
+async_db_workers = 8
+
+# метрики Prometheus: включение, адрес локального HTTP-сервера /metrics и границы корзин гистограмм (сек);
+# выключенные метрики не замеряют время
+metrics_enabled = config('metrics_enabled', default=False, cast=bool)
+metrics_host = '127.0.0.1'
+metrics_port = 9100
+metrics_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# трассировка запросов: доля запросов "history_requests" со спанами обработчиков, запросов к API и к БД
+# (0 - выключено, решение принимается по request_id для всего диалога), выгрузка 'file' - строки OTLP JSON
+# в trace_file или 'otlp' - коллектор OpenTelemetry по OTLP/HTTP, длина очереди выгрузки (трасс)
+trace_sample_rate = 0.0
+trace_exporter = 'file'
+trace_file = '../log/traces.jsonl'
+trace_otlp_endpoint = 'http://127.0.0.1:4318/v1/traces'
+trace_queue_size = 10000
+
+# профилирование работающего бота: команда /profile [сек] для администраторов (admin_ids в .env через запятую)
+# или сигнал SIGUSR1; длительность по умолчанию и максимальная (сек), интервал выборки стеков (сек),
+# префиксы имен профилируемых потоков, каталог файлов со стеками и количество функций в отчете
+admin_ids = config('admin_ids', default='', cast=Csv(int))
+profile_seconds = 10
+profile_max_seconds = 120
+profile_interval = 0.005
+profile_threads = ('handler', 'send', 'photos', 'search', 'webhook')
+profile_dir = '../log'
+profile_top = 15
+
 num_history_requests = 3
 max_num_hotels = 9
 max_num_photos = 6
 photo_size = 'b'
+
+# пул потоков для параллельной загрузки фотографий и ограничение времени на все фотографии одного поиска (сек)
+photo_workers = 16
+photo_deadline = 16
+
+# кэш адресов фотографий отелей (память + SQLite): размер в памяти, время жизни и возраст фонового обновления (сек)
+photo_cache_size = 4096
+photo_cache_ttl = 30 * 24 * 60 * 60
+photo_cache_refresh = 7 * 24 * 60 * 60
+# интервал удаления устаревших записей постоянного кэша (таблица api_cache) отдельным фоновым потоком (сек)
+cache_purge_interval = 60 * 60
 id_sticker_time = 'CAACAgIAAxkBAAEENoNiNi3VrQWj9ozdSRESxrPqyyopZQACBQEAAvcCyA_R5XS3RiWkoSME'